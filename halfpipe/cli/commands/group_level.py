@@ -330,6 +330,7 @@ class GroupLevelCommand(Command):
                         contrast_list,
                         algorithms,
                         arguments.nipype_n_procs,
+                        memory_gb=arguments.nipype_memory_gb,
                     )
 
                 for from_key, to_key in modelfit_aliases.items():
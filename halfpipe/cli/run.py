@@ -58,7 +58,7 @@ def run_stage_workflow(opts):
     if workflow is None:
         return None
 
-    opts.graphs = init_execgraph(opts.workdir, workflow)
+    opts.graphs = init_execgraph(opts.workdir, workflow, n_procs=opts.nipype_n_procs)
 
     if opts.graphs is None:
         return
@@ -91,13 +91,13 @@ def run_stage_run(opts):
             graphs = obj
 
         elif opts.uuid is not None:
-            from ..utils.cache import uncache_obj
+            from ..workflows.graphstore import GraphStore
 
-            obj = uncache_obj(workdir, type_str="graphs", uuid=opts.uuid)
-            if not isinstance(obj, Mapping):
+            graph_store = GraphStore.load(workdir, opts.uuid)
+            if graph_store is None:
                 raise ValueError(f'Could not find graphs for "{opts.uuid}"')
 
-            graphs = obj
+            graphs = graph_store
 
         else:
             raise RuntimeError(
@@ -116,6 +116,7 @@ def run_stage_run(opts):
         resource_monitor=opts.nipype_resource_monitor,
         raise_insufficient=False,
         keep=opts.keep,
+        persistent=True,  # re-use worker processes between chunks
     )
 
     if opts.nipype_n_procs is not None:
@@ -216,26 +217,32 @@ def run_stage_run(opts):
 
     from nipype.pipeline import engine as pe
 
-    for i, chunk in enumerate(chunks_to_run):
-        if len(chunks_to_run) > 1:
-            logger.info(f"Running chunk {i+1} of {len(chunks_to_run)}")
-
-        try:
-            assert isinstance(chunk, nx.DiGraph)
-
-            runner = runnercls(plugin_args=plugin_args)
-            firstnode = next(iter(chunk.nodes()))
-            if firstnode is not None:
-                assert isinstance(firstnode, pe.Node)
-                runner.run(chunk, updatehash=False, config=firstnode.config)
-        except Exception as e:
-            if opts.debug:
-                raise e
-            else:
-                logger.warning(f"Ignoring exception in chunk {i+1}", exc_info=True)
-
-        if len(chunks_to_run) > 1:
-            logger.info(f"Completed chunk {i+1} of {len(chunks_to_run)}")
+    runner = None
+    try:
+        for i, chunk in enumerate(chunks_to_run):
+            if len(chunks_to_run) > 1:
+                logger.info(f"Running chunk {i+1} of {len(chunks_to_run)}")
+
+            try:
+                assert isinstance(chunk, nx.DiGraph)
+
+                if runner is None or not hasattr(runner, "shutdown"):
+                    runner = runnercls(plugin_args=plugin_args)
+                firstnode = next(iter(chunk.nodes()))
+                if firstnode is not None:
+                    assert isinstance(firstnode, pe.Node)
+                    runner.run(chunk, updatehash=False, config=firstnode.config)
+            except Exception as e:
+                if opts.debug:
+                    raise e
+                else:
+                    logger.warning(f"Ignoring exception in chunk {i+1}", exc_info=True)
+
+            if len(chunks_to_run) > 1:
+                logger.info(f"Completed chunk {i+1} of {len(chunks_to_run)}")
+    finally:
+        if runner is not None and hasattr(runner, "shutdown"):
+            runner.shutdown()
 
 
 def run(opts, should_run):
@@ -297,6 +304,10 @@ def main():
     profile = False
 
     try:
+        from ..utils.multiprocessing import set_forkserver_preload
+
+        set_forkserver_preload()
+
         from ..logging.base import setup_context as setup_logging_context
 
         setup_logging_context()
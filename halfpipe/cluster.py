@@ -5,7 +5,7 @@
 import os
 from math import ceil
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, List, Mapping
 
 from .utils import inflect_engine as p
 from .utils import logger
@@ -73,7 +73,7 @@ singularity run \\
 """
 
 
-def make_script(workdir: Path, graphs: Dict[str, Any], opts):
+def make_script(workdir: Path, graphs: Mapping[str, Any], opts):
     first_workflow = next(iter(graphs.values()))
     uuid = first_workflow.uuid
 
@@ -14,3 +14,6 @@ class IdentifiableWorkflow(pe.Workflow):
 
         self.uuid = uuid
         self.bids_to_sub_id_map: dict[str, str] = dict()
+
+        # identifies the inputs of each subject to find cached subject graphs
+        self.subject_uuids: dict[str, UUID] = dict()
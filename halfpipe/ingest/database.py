@@ -36,6 +36,29 @@ class Database:
             hash.update(filepath.encode())
         return hash.hexdigest()
 
+    def sha1_by_subject(self) -> dict[str, str]:
+        """
+        get a hash of the files of each subject, which also covers the files
+        that do not belong to any subject, such as atlases or seeds
+        """
+        shared_hash = sha1()
+        subject_filepaths: dict[str, list[str]] = dict()
+        for filepath, tags in self.tags_by_filepaths.items():
+            subject = tags.get("sub")
+            if subject is None:
+                shared_hash.update(filepath.encode())
+            else:
+                subject_filepaths.setdefault(subject, list()).append(filepath)
+
+        sha1_by_subject: dict[str, str] = dict()
+        for subject, filepaths in subject_filepaths.items():
+            hash = shared_hash.copy()
+            for filepath in sorted(filepaths):
+                hash.update(filepath.encode())
+            sha1_by_subject[subject] = hash.hexdigest()
+
+        return sha1_by_subject
+
     def put(self, spec_fileobj):
         resolved_files = self.resolved_spec.put(spec_fileobj)
         for resolved_fileobj in resolved_files:
@@ -2,8 +2,13 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
+from dataclasses import dataclass
+from functools import lru_cache
+from hashlib import sha1
 from os import path as op
 from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
 from typing import Literal, overload
 
 import nibabel as nib
@@ -12,14 +17,324 @@ import pandas as pd
 from nipype.interfaces.base import (
     BaseInterface,
     BaseInterfaceInputSpec,
+    Directory,
     File,
     TraitedSpec,
+    isdefined,
     traits,
 )
-from scipy.ndimage import mean
+from scipy.sparse import csr_matrix
 
+from ..utils import logger
 from ..utils.image import nvol
-from ..utils.matrix import atleast_4d
+from ..utils.matrix import atleast_4d, save_matrix
+
+
+def _file_digest(path: str | Path) -> str:
+    m = sha1()
+    with open(path, "rb") as file_handle:
+        for chunk in iter(lambda: file_handle.read(2**20), b""):
+            m.update(chunk)
+    return m.hexdigest()
+
+
+def _file_stats(*paths: str | Path | None) -> tuple[tuple[int, int], ...]:
+    stats = [Path(path).stat() for path in paths if path is not None]
+    return tuple((stat.st_mtime_ns, stat.st_size) for stat in stats)
+
+
+@dataclass(frozen=True)
+class AtlasIndex:
+    """
+    Voxels of an atlas image sorted by label. This does not depend on the
+    mask of a subject, so it can be stored once and shared between subjects
+    """
+
+    shape: tuple[int, ...]
+    affine: np.ndarray
+
+    voxel_indices: np.ndarray  # flat indices of the labelled voxels
+    counts: np.ndarray  # number of voxels for each label including zero
+
+    array_names = ("affine", "voxel_indices", "counts")
+
+    @property
+    def nlabel(self) -> int:
+        return self.counts.size - 1
+
+    @property
+    def voxel_labels(self) -> np.ndarray:
+        return np.repeat(np.arange(1, self.nlabel + 1), self.counts[1:])
+
+    @classmethod
+    def from_file(cls, atlas_file: str | Path) -> "AtlasIndex":
+        atlas_img = nib.load(atlas_file)
+        assert nvol(atlas_img) == 1
+
+        shape = atlas_img.shape[:3]
+        labels = np.asanyarray(atlas_img.dataobj).astype(int)
+        labels = np.ravel(labels.reshape(shape))
+
+        assert np.all(labels >= 0)
+
+        counts = np.bincount(labels)
+        order = np.argsort(labels, kind="stable")
+
+        return cls(
+            shape=shape,
+            affine=atlas_img.affine,
+            voxel_indices=order[counts[0] :],
+            counts=counts,
+        )
+
+    def save(self, path: Path) -> None:
+        """
+        Write the arrays to a temporary directory first, so that readers never
+        see a partial index
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = Path(mkdtemp(dir=path.parent, prefix=f".{path.name}."))
+
+        np.save(temporary_path / "shape.npy", np.array(self.shape))
+        for name in self.array_names:
+            np.save(temporary_path / f"{name}.npy", getattr(self, name))
+
+        try:
+            temporary_path.rename(path)
+        except OSError:  # another process was faster
+            rmtree(temporary_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: Path) -> "AtlasIndex":
+        shape = tuple(int(n) for n in np.load(path / "shape.npy"))
+        arrays = {
+            name: np.load(path / f"{name}.npy", mmap_mode="r")
+            for name in cls.array_names
+        }
+        return cls(shape=shape, **arrays)
+
+
+@lru_cache(maxsize=2**4)
+def _load_atlas_index(
+    atlas_file: str,
+    cache_directory: str | None,
+    file_stats: tuple[tuple[int, int], ...],
+) -> AtlasIndex:
+    _ = file_stats  # only used to detect when a file was changed
+
+    if cache_directory is None:
+        return AtlasIndex.from_file(atlas_file)
+
+    path = Path(cache_directory) / "atlas_index" / _file_digest(atlas_file)
+
+    if path.is_dir():
+        try:
+            return AtlasIndex.load(path)
+        except (OSError, ValueError):
+            logger.warning(f'Could not read atlas index from "{path}"', exc_info=True)
+
+    atlas_index = AtlasIndex.from_file(atlas_file)
+    atlas_index.save(path)
+
+    return atlas_index
+
+
+def load_atlas_index(
+    atlas_file: str | Path, cache_directory: str | Path | None = None
+) -> AtlasIndex:
+    """
+    Atlas indices are stored in the cache directory by the hash of the atlas
+    file, and are memory-mapped when they are read, so that all subjects and
+    worker processes share the same index
+    """
+    return _load_atlas_index(
+        str(atlas_file),
+        None if cache_directory is None else str(cache_directory),
+        _file_stats(atlas_file),
+    )
+
+
+@dataclass(frozen=True)
+class LabelIndex:
+    """
+    Sparse matrix that maps the voxels of an atlas to the regions that they
+    belong to, so that the mean signals of all regions can be calculated with
+    a single matrix product
+    """
+
+    shape: tuple[int, ...]
+    affine: np.ndarray
+
+    voxel_indices: np.ndarray  # flat indices of the voxels that are in a region
+    label_matrix: csr_matrix  # regions by voxels
+    counts: np.ndarray  # number of voxels in each region
+
+    is_valid: np.ndarray
+    region_coverage: list[float] | None
+
+    @classmethod
+    def from_atlas_index(
+        cls,
+        atlas_index: AtlasIndex,
+        mask: np.ndarray | None = None,
+        background_label: int = 0,
+        min_region_coverage: float = 0,
+    ) -> "LabelIndex":
+        nlabel = atlas_index.nlabel
+
+        assert background_label <= nlabel
+
+        indices = np.arange(0, nlabel + 1, dtype=int)
+        is_valid = np.ones(nlabel + 1, dtype=bool)
+
+        voxel_indices = atlas_index.voxel_indices
+        voxel_labels = atlas_index.voxel_labels
+        is_selected = np.ones(voxel_indices.size, dtype=bool)
+
+        out_region_coverage = None
+
+        if mask is not None:
+            assert mask.shape == atlas_index.shape
+            mask = np.ravel(mask).astype(bool)
+
+            unmasked_counts = atlas_index.counts
+
+            is_selected = mask[voxel_indices]
+
+            masked_counts = np.bincount(voxel_labels[is_selected], minlength=nlabel + 1)
+            masked_counts[0] = np.count_nonzero(mask) - np.count_nonzero(is_selected)
+
+            with np.errstate(divide="ignore", invalid="ignore"):
+                region_coverage = masked_counts / unmasked_counts
+            region_coverage[unmasked_counts == 0] = 0
+
+            out_region_coverage = list(region_coverage[indices != background_label])
+            assert len(out_region_coverage) == nlabel
+
+            is_valid &= region_coverage >= min_region_coverage
+
+        is_valid[0] = False
+        is_valid[background_label] = False
+
+        is_selected &= is_valid[voxel_labels]
+
+        counts = np.bincount(voxel_labels[is_selected], minlength=nlabel + 1)
+        is_valid &= counts > 0  # the mean of an empty region is not defined
+
+        # the voxels are sorted by label, so the matrix can be built directly
+        (selected,) = np.nonzero(is_selected)
+        label_matrix = csr_matrix(
+            (
+                np.ones(selected.size),
+                np.arange(selected.size),
+                np.concatenate([[0], np.cumsum(counts[1:])]),
+            ),
+            shape=(nlabel, selected.size),
+        )
+
+        return cls(
+            shape=atlas_index.shape,
+            affine=atlas_index.affine,
+            voxel_indices=voxel_indices[selected],
+            label_matrix=label_matrix,
+            counts=counts[1:],
+            is_valid=is_valid[1:],
+            region_coverage=out_region_coverage,
+        )
+
+    @classmethod
+    def from_files(
+        cls,
+        atlas_file: str | Path,
+        mask_file: str | Path | None = None,
+        background_label: int = 0,
+        min_region_coverage: float = 0,
+        cache_directory: str | Path | None = None,
+    ) -> "LabelIndex":
+        atlas_index = load_atlas_index(atlas_file, cache_directory=cache_directory)
+
+        mask: np.ndarray | None = None
+        if mask_file is not None:
+            mask_img = nib.load(mask_file)
+
+            assert nvol(mask_img) == 1
+            assert mask_img.shape[:3] == atlas_index.shape
+            assert np.allclose(mask_img.affine, atlas_index.affine)
+
+            mask = np.asanyarray(mask_img.dataobj).astype(bool)
+            mask = mask.reshape(atlas_index.shape)
+
+        return cls.from_atlas_index(
+            atlas_index,
+            mask=mask,
+            background_label=background_label,
+            min_region_coverage=min_region_coverage,
+        )
+
+    def mean_signals(self, in_img: nib.Nifti1Image) -> np.ndarray:
+        """
+        Calculate the mean signal of each region for each volume of the image
+        """
+        assert in_img.shape[:3] == self.shape
+        assert np.allclose(in_img.affine, self.affine)
+
+        coordinates = np.unravel_index(self.voxel_indices, self.shape)
+        if self.voxel_indices.size == 0:
+            voxel_data = np.zeros((0, nvol(in_img)))
+        else:
+            # read only the bounding box of the regions from the image file
+            bounding_box = tuple(
+                slice(int(c.min()), int(c.max()) + 1) for c in coordinates
+            )
+            in_data = atleast_4d(in_img.dataobj[bounding_box])
+            coordinates = tuple(c - s.start for c, s in zip(coordinates, bounding_box))
+            voxel_data = in_data[coordinates].astype(np.float64)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = (self.label_matrix @ voxel_data) / self.counts[:, np.newaxis]
+        result[np.logical_not(self.is_valid), :] = np.nan
+
+        return result.T
+
+
+@lru_cache(maxsize=2**4)
+def _load_label_index(
+    atlas_file: str,
+    mask_file: str | None,
+    background_label: int,
+    min_region_coverage: float,
+    cache_directory: str | None,
+    file_stats: tuple[tuple[int, int], ...],
+) -> LabelIndex:
+    _ = file_stats  # only used to detect when a file was changed
+    return LabelIndex.from_files(
+        atlas_file,
+        mask_file=mask_file,
+        background_label=background_label,
+        min_region_coverage=min_region_coverage,
+        cache_directory=cache_directory,
+    )
+
+
+def load_label_index(
+    atlas_file: str | Path,
+    mask_file: str | Path | None = None,
+    background_label: int = 0,
+    min_region_coverage: float = 0,
+    cache_directory: str | Path | None = None,
+) -> LabelIndex:
+    """
+    Label indices are cached, so that they are only computed once when the
+    same atlas is used for multiple inputs
+    """
+    return _load_label_index(
+        str(atlas_file),
+        None if mask_file is None else str(mask_file),
+        background_label,
+        min_region_coverage,
+        None if cache_directory is None else str(cache_directory),
+        _file_stats(atlas_file, mask_file),
+    )
 
 
 @overload
@@ -30,6 +345,7 @@ def mean_signals(
     mask_file: str | Path | None = None,
     background_label: int = 0,
     min_region_coverage: float = 0,
+    cache_directory: str | Path | None = None,
 ) -> np.ndarray:
     ...
 
@@ -42,6 +358,7 @@ def mean_signals(
     mask_file: str | Path | None = None,
     background_label: int = 0,
     min_region_coverage: float = 0,
+    cache_directory: str | Path | None = None,
 ) -> tuple[np.ndarray, list[float]]:
     ...
 
@@ -53,66 +370,22 @@ def mean_signals(
     mask_file: str | Path | None = None,
     background_label: int = 0,
     min_region_coverage: float = 0,
+    cache_directory: str | Path | None = None,
 ):
     in_img = nib.load(in_file)
-    atlas_img = nib.load(atlas_file)
-
-    assert nvol(atlas_img) == 1
-    assert atlas_img.shape[:3] == in_img.shape[:3]
-    assert np.allclose(atlas_img.affine, in_img.affine)
-
-    labels = np.asanyarray(atlas_img.dataobj).astype(int)
-
-    nlabel: int = labels.max()
-
-    assert background_label <= nlabel
-
-    indices = np.arange(0, nlabel + 1, dtype=int)
 
-    out_region_coverage = None
-
-    if mask_file is not None:
-        mask_img = nib.load(mask_file)
-
-        assert nvol(mask_img) == 1
-        assert mask_img.shape[:3] == in_img.shape[:3]
-        assert np.allclose(mask_img.affine, in_img.affine)
-
-        mask_data = np.asanyarray(mask_img.dataobj).astype(bool)
-
-        unmasked_counts = np.bincount(np.ravel(labels), minlength=nlabel + 1)[
-            : nlabel + 1
-        ]
-
-        labels[np.logical_not(mask_data)] = background_label
-
-        masked_counts = np.bincount(np.ravel(labels), minlength=nlabel + 1)[
-            : nlabel + 1
-        ]
-
-        region_coverage = masked_counts.astype(float) / unmasked_counts.astype(float)
-        region_coverage[unmasked_counts == 0] = 0
-
-        out_region_coverage = list(region_coverage[indices != background_label])
-        assert len(out_region_coverage) == nlabel
-
-        indices = indices[region_coverage >= min_region_coverage]
-
-    indices = indices[indices != background_label]
-
-    assert np.all(labels >= 0)
-
-    in_data = atleast_4d(in_img.get_fdata())
-
-    result = np.full((in_data.shape[3], nlabel), np.nan)
+    label_index = load_label_index(
+        atlas_file,
+        mask_file=mask_file,
+        background_label=background_label,
+        min_region_coverage=min_region_coverage,
+        cache_directory=cache_directory,
+    )
 
-    for i, img in enumerate(np.moveaxis(in_data, 3, 0)):
-        result[i, indices - 1] = mean(
-            img, labels=labels.reshape(img.shape), index=indices
-        )
+    result = label_index.mean_signals(in_img)
 
     if output_coverage is True:
-        return result, out_region_coverage
+        return result, label_index.region_coverage
     else:
         return result
 
@@ -131,11 +404,25 @@ class ConnectivityMeasureInputSpec(BaseInterfaceInputSpec):
     background_label = traits.Int(desc="", default=0, usedefault=True)
     min_region_coverage = traits.Float(desc="", default=0.8, usedefault=True)
 
+    output_format = traits.Enum(
+        "tsv",
+        "npz",
+        desc="Write text files or binary numpy files that only contain the "
+        "upper triangle of the connectivity matrices",
+        usedefault=True,
+    )
+
+    cache_directory = Directory(
+        desc="Directory where atlas indices are stored to share them between nodes",
+        exists=True,
+        nohash=True,
+    )
+
 
 class ConnectivityMeasureOutputSpec(TraitedSpec):
-    time_series = File(desc="Numpy text file with the timeseries matrix")
-    covariance = File(desc="Numpy text file with the connectivity matrix")
-    correlation = File(desc="Numpy text file with the connectivity matrix")
+    time_series = File(desc="Numpy file with the timeseries matrix")
+    covariance = File(desc="Numpy file with the connectivity matrix")
+    correlation = File(desc="Numpy file with the connectivity matrix")
     region_coverage = traits.List(traits.Float)
 
 
@@ -149,6 +436,10 @@ class ConnectivityMeasure(BaseInterface):
     output_spec = ConnectivityMeasureOutputSpec
 
     def _run_interface(self, runtime):
+        cache_directory = None
+        if isdefined(self.inputs.cache_directory):
+            cache_directory = self.inputs.cache_directory
+
         self._time_series, self._region_coverage = mean_signals(
             self.inputs.in_file,
             self.inputs.atlas_file,
@@ -156,6 +447,7 @@ class ConnectivityMeasure(BaseInterface):
             mask_file=self.inputs.mask_file,
             background_label=self.inputs.background_label,
             min_region_coverage=self.inputs.min_region_coverage,
+            cache_directory=cache_directory,
         )
 
         df: pd.DataFrame = pd.DataFrame(self._time_series)
@@ -168,16 +460,23 @@ class ConnectivityMeasure(BaseInterface):
     def _list_outputs(self):
         outputs = self.output_spec().get()
 
-        argdict = dict(fmt="%.10f", delimiter="\t")
+        output_format = self.inputs.output_format
+
+        time_series_file = op.abspath(f"timeseries.{output_format}")
+        covariance_file = op.abspath(f"covariance.{output_format}")
+        correlation_file = op.abspath(f"correlation.{output_format}")
 
-        time_series_file = op.abspath("timeseries.tsv")
-        np.savetxt(time_series_file, self._time_series, **argdict)
+        if output_format == "npz":
+            save_matrix(time_series_file, self._time_series)
+            save_matrix(covariance_file, self._cov_mat, symmetric=True)
+            save_matrix(correlation_file, self._corr_mat, symmetric=True)
 
-        covariance_file = op.abspath("covariance.tsv")
-        np.savetxt(covariance_file, self._cov_mat, **argdict)
+        else:
+            argdict = dict(fmt="%.10f", delimiter="\t")
 
-        correlation_file = op.abspath("correlation.tsv")
-        np.savetxt(correlation_file, self._corr_mat, **argdict)
+            np.savetxt(time_series_file, self._time_series, **argdict)
+            np.savetxt(covariance_file, self._cov_mat, **argdict)
+            np.savetxt(correlation_file, self._corr_mat, **argdict)
 
         outputs["time_series"] = time_series_file
         outputs["covariance"] = covariance_file
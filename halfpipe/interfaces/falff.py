@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+from nipype.interfaces.base import File, TraitedSpec, traits
+
+from .transformer import Transformer, TransformerInputSpec
+
+max_voxels_per_block = 2**12
+
+
+def power_spectrum(array: np.ndarray) -> np.ndarray:
+    """
+    One-sided power spectrum of each column of the array after removing the
+    mean and the linear trend. The spectrum is scaled so that it sums to the
+    sum of squares of the detrended time series
+    """
+    m, _ = array.shape
+
+    t = np.arange(m, dtype=np.float64)
+    design = np.column_stack([np.ones(m), t - t.mean()])
+
+    betas, _, _, _ = np.linalg.lstsq(design, array, rcond=None)
+    residuals = array - design @ betas
+
+    spectrum = np.fft.rfft(residuals, axis=0)
+    power = np.square(spectrum.real) + np.square(spectrum.imag)
+
+    # all frequencies except zero and nyquist appear twice in the full spectrum
+    weights = np.full(power.shape[0], 2.0)
+    weights[0] = 1
+    if m % 2 == 0:
+        weights[-1] = 1
+
+    return power * weights[:, np.newaxis] / m
+
+
+def alff(
+    array: np.ndarray,
+    repetition_time: float,
+    bands: list[tuple[float, float]],
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Amplitude of low frequency fluctuations as the standard deviation of the
+    signal within each frequency band, and the fractional amplitude as the
+    ratio to the standard deviation of the whole signal. The voxels are the
+    columns of the array and are processed in blocks
+    """
+    m, n = array.shape
+
+    frequencies = np.fft.rfftfreq(m, d=repetition_time)
+    is_in_band = np.vstack(
+        [(frequencies >= low) & (frequencies <= high) for low, high in bands]
+    ).astype(np.float64)
+
+    alff_array = np.zeros((len(bands), n), dtype=np.float64)
+    falff_array = np.zeros((len(bands), n), dtype=np.float64)
+
+    if m < 2:
+        return alff_array, falff_array
+
+    for start in range(0, n, max_voxels_per_block):
+        block = slice(start, start + max_voxels_per_block)
+
+        power = power_spectrum(array[:, block].astype(np.float64, copy=False))
+
+        band_power = is_in_band @ power
+        total_power = np.sum(power, axis=0)
+
+        alff_array[:, block] = np.sqrt(band_power / (m - 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            falff_array[:, block] = np.sqrt(
+                np.where(total_power > 0, band_power / total_power, 0)
+            )
+
+    return alff_array, falff_array
+
+
+class ALFFInputSpec(TransformerInputSpec):
+    mask = File(desc="mask to use for volumes", exists=True, mandatory=True)
+
+    repetition_time = traits.Float(mandatory=True)
+    bands = traits.List(
+        traits.Tuple(traits.Float, traits.Float),
+        value=[(0.01, 0.1)],
+        usedefault=True,
+        desc="lower and upper frequency of each band in hertz",
+    )
+
+
+class ALFFOutputSpec(TraitedSpec):
+    alff_files = traits.List(File(), desc="one alff map for each band")
+    falff_files = traits.List(File(), desc="one falff map for each band")
+
+
+class ALFF(Transformer):
+    """
+    Calculate alff and falff maps for multiple frequency bands from the power
+    spectrum of the unfiltered time series
+    """
+
+    input_spec = ALFFInputSpec
+    output_spec = ALFFOutputSpec
+
+    suffix = "alff"
+    squeeze = True
+
+    def _transform(self, array):
+        assert self.mask is not None
+
+        return alff(array, self.inputs.repetition_time, self.inputs.bands)
+
+    def _run_interface(self, runtime):
+        array = self._load(self.inputs.in_file)
+
+        alff_array, falff_array = self._transform(array)
+
+        for key, prefix, out_array in [
+            ("alff_files", "alff", alff_array),
+            ("falff_files", "falff", falff_array),
+        ]:
+            self._results[key] = list()
+            for i, row in enumerate(out_array):
+                self.suffix = f"{prefix}{i + 1:d}"
+                self._results[key].append(self._dump(row[np.newaxis, :]))
+
+        return runtime
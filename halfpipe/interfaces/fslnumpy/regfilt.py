@@ -28,59 +28,95 @@ def binarize(array, lowerth, upperth, threstype="inclusive", invert: bool = Fals
     return array2
 
 
-def regfilt(array, design, comps, calculate_mask=True, aggressive=False):
+max_block_bytes = 2**26  # filter at most 64 megabytes of data at a time
+
+
+def regfilt(
+    array,
+    design,
+    comps,
+    calculate_mask=True,
+    aggressive=False,
+    block_size: int | None = None,
+):
     """
     numpy translation of fsl fsl_regfilt.cc dofilter
+
+    the input array is filtered in place, in blocks of `block_size` voxels, so
+    that the memory use on top of the input is bounded by the size of a block
     """
+    logger = logging.getLogger("halfpipe")
+
     zero_based_comps = [c - 1 for c in comps]
 
     # setup
 
-    data = array.copy()
-    mask_vec: npt.NDArray | None = None
+    mean = array.mean(axis=0)
     if calculate_mask is True:
-        mean = data.mean(axis=0)
         mmin = mean.min()
         mmax = mean.max()
         mask = binarize(mean, mmin + 0.01 * (mmax - mmin), mmax)
-        mask_vec = np.ravel(mask)
-        data = data[:, mask_vec]
+        indices: npt.NDArray | None = np.flatnonzero(mask)
+        n = indices.size
+    else:
+        indices = None
+        _, n = array.shape
 
-    m, n = data.shape
+    m, _ = array.shape
 
-    mean_r = data.mean(axis=0)
-    data -= mean_r[None, :]
-    mean_c = design.mean(axis=0)
-    design -= mean_c[None, :]
+    design = design - design.mean(axis=0)[None, :]
 
-    logging.getLogger("halfpipe").info(f"Data matrix size : {m} x {n}")
+    logger.info(f"Data matrix size : {m} x {n}")
 
     # dofilter
 
-    logging.getLogger("halfpipe").info("Calculating maps")
-
-    unmix_matrix = np.linalg.pinv(design)
-    maps = unmix_matrix @ data
+    logger.info("Calculating unmixing matrix")
 
+    # only the noise components are needed to filter the data
     noisedes = design[:, zero_based_comps]
-    noisemaps = maps[zero_based_comps, :].T
-
-    logging.getLogger("halfpipe").info("Calculating filtered data")
-
     if aggressive:
-        new_data = data - noisedes @ (np.linalg.pinv(noisedes) @ data)
+        noise_unmix_matrix = np.linalg.pinv(noisedes)
     else:
-        new_data = data - noisedes @ noisemaps.T
+        unmix_matrix = np.linalg.pinv(design)
+        noise_unmix_matrix = unmix_matrix[zero_based_comps, :]
+
+    if block_size is None:
+        block_size = max_block_bytes // (m * np.dtype(np.float64).itemsize)
+    block_size = max(1, min(block_size, n))
+
+    block_count = -(-n // block_size)
+    # the block and the product with the noise design are held at the same time
+    block_bytes = block_size * m * np.dtype(np.float64).itemsize
+    peak_gb = (array.nbytes + 2 * block_bytes) / 2**30
+    logger.info(
+        f"Calculating filtered data in {block_count:d} blocks of {block_size:d} voxels "
+        f"with a peak memory use of {peak_gb:.3f} GB"
+    )
 
-    new_data += mean_r[None, :]
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
 
-    if calculate_mask is True:
-        temp_vol = np.zeros_like(array)
-        temp_vol[:, mask_vec] = new_data
-    else:
-        temp_vol = new_data
+        if indices is None:
+            columns: slice | npt.NDArray = slice(start, stop)
+        else:
+            columns = indices[start:stop]
+
+        data = array[:, columns].astype(np.float64)
+
+        mean_r = mean[columns]
+        data -= mean_r[None, :]
+
+        noisemaps = noise_unmix_matrix @ data
+        data -= noisedes @ noisemaps
 
-    return temp_vol
+        data += mean_r[None, :]
+
+        array[:, columns] = data
+
+    if indices is not None:
+        array[:, np.logical_not(np.ravel(mask))] = 0
+
+    return array
 
 
 class FilterRegressorInputSpec(TransformerInputSpec):
@@ -94,12 +130,14 @@ class FilterRegressorInputSpec(TransformerInputSpec):
         usedefault=True,
     )
     aggressive = traits.Bool(default=False, usedefault=True)
+    block_size = traits.Int(desc="number of voxels to filter at a time")
 
 
 class FilterRegressor(Transformer):
     input_spec = FilterRegressorInputSpec
 
     suffix = "regfilt"
+    chainable = True
 
     def _transform(self, array):
         design = np.loadtxt(self.inputs.design_file, dtype=np.float64, ndmin=2)
@@ -114,6 +152,10 @@ class FilterRegressor(Transformer):
 
         calculate_mask = isdefined(self.inputs.mask) and self.inputs.mask is True
 
+        block_size: int | None = None
+        if isdefined(self.inputs.block_size):
+            block_size = self.inputs.block_size
+
         np.nan_to_num(array, copy=False)  # nans create problems further down the line
 
         array2 = regfilt(
@@ -122,6 +164,7 @@ class FilterRegressor(Transformer):
             filter_columns,
             calculate_mask=calculate_mask,
             aggressive=self.inputs.aggressive,
+            block_size=block_size,
         )
 
         return array2
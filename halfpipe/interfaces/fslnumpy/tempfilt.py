@@ -8,97 +8,94 @@ from nipype.interfaces.base import traits
 from ..transformer import Transformer, TransformerInputSpec
 
 
-def bandpass_temporal_filter(array, hp_sigma, lp_sigma):
+def highpass_weights(hp_sigma: float, size: int) -> tuple[np.ndarray, np.ndarray]:
     """
-    numpy translation of fsl newimagefuns.h bandpass_temporal_filter
+    The local linear fit in fsl bandpass_temporal_filter is linear in the data,
+    so we can write it as a matrix product. Column `t` of the returned matrix
+    has the weights that give the intercept of the fit at time point `t`, and
+    the boolean array marks the time points for which the fit is defined
     """
+    hp_mask_size = int(np.floor(hp_sigma * 3))
 
-    if hp_sigma <= 0:
-        hp_mask_size_minus = 0
-    else:
-        hp_mask_size_minus = int(np.floor(hp_sigma * 3))
+    t = np.arange(size)
+    dt = (t[:, np.newaxis] - t[np.newaxis, :]).astype(float)  # tt - t
 
-    hp_mask_size_plus = hp_mask_size_minus
+    w = np.where(
+        np.abs(dt) <= hp_mask_size,
+        np.exp(-0.5 * (dt * dt) / (hp_sigma * hp_sigma)),
+        0.0,
+    )
 
-    if lp_sigma <= 0:
-        lp_mask_size_minus = 0
-    else:
-        lp_mask_size_minus = int(np.floor(lp_sigma * 20)) + 2
+    a = np.sum(w * dt, axis=0)
+    c = np.sum(w * dt * dt, axis=0)
+    n = np.sum(w, axis=0)
 
-    lp_mask_size_plus = lp_mask_size_minus
+    tmpdenom = c * n - a * a
+    is_valid = np.logical_not(np.isclose(tmpdenom, 0))
 
-    hp_exp = np.zeros(0)
-    if hp_sigma > 0:
-        hp_exp = np.zeros(hp_mask_size_minus + hp_mask_size_plus + 1)
-        for t in range(-hp_mask_size_minus, hp_mask_size_plus + 1):
-            hp_exp[t] = np.exp(-0.5 * (float(t * t)) / (hp_sigma * hp_sigma))
+    w, dt = w[:, is_valid], dt[:, is_valid]
+    a, c, tmpdenom = a[is_valid], c[is_valid], tmpdenom[is_valid]
 
-    lp_exp = np.zeros(0)
-    if lp_sigma > 0:
-        total = 0.0
-        lp_exp = np.zeros(lp_mask_size_minus + lp_mask_size_plus + 1)
-        for t in range(-lp_mask_size_minus, lp_mask_size_plus + 1):
-            lp_exp[t] = np.exp(-0.5 * (float(t * t)) / (lp_sigma * lp_sigma))
-            total += lp_exp[t]
-        for t in range(-lp_mask_size_minus, lp_mask_size_plus + 1):
-            lp_exp[t] /= total
+    weights = np.zeros((size, size))
+    weights[:, is_valid] = w * (c - a * dt) / tmpdenom
+
+    return weights, is_valid
+
+
+def lowpass_weights(lp_sigma: float, size: int) -> np.ndarray:
+    """
+    Gaussian smoothing kernel as a matrix, where column `t` has the weights for
+    time point `t`, normalized to sum to one where the kernel is truncated
+    """
+    lp_mask_size = int(np.floor(lp_sigma * 20)) + 2
+
+    kernel_t = np.arange(-lp_mask_size, lp_mask_size + 1, dtype=float)
+    lp_exp = np.exp(-0.5 * (kernel_t * kernel_t) / (lp_sigma * lp_sigma))
+    lp_exp /= lp_exp.sum()
+
+    t = np.arange(size)
+    dt = t[:, np.newaxis] - t[np.newaxis, :]  # tt - t
+
+    weights = np.where(
+        np.abs(dt) <= lp_mask_size,
+        lp_exp[np.clip(dt + lp_mask_size, 0, kernel_t.size - 1)],
+        0.0,
+    )
+
+    total = weights.sum(axis=0)
+    total[total <= 0] = 1.0
+    weights /= total[np.newaxis, :]
 
-    m, sourcetsize = array.shape
-    array2 = np.zeros_like(array)
+    return weights
+
+
+def bandpass_temporal_filter(array, hp_sigma, lp_sigma):
+    """
+    numpy translation of fsl newimagefuns.h bandpass_temporal_filter,
+    where the loops over time points are replaced by matrix products
+    """
+
+    _, sourcetsize = array.shape
 
     if hp_sigma > 0:
-        c0 = None
-        for t in range(sourcetsize):
-
-            A = 0
-            B = np.zeros((m,), dtype=array.dtype)
-            C = 0
-            D = np.zeros((m,), dtype=array.dtype)
-            N = 0
-
-            for tt in range(
-                max(t - hp_mask_size_minus, 0),
-                min(t + hp_mask_size_plus, sourcetsize - 1) + 1,
-            ):
-                dt = tt - t
-                w = hp_exp[dt]
-                A += w * dt
-                B += w * array[:, tt]
-                C += w * dt * dt
-                D += w * dt * array[:, tt]
-                N += w
-
-            tmpdenom = C * N - A * A
-            if not np.isclose(tmpdenom, 0):
-                c = (B * C - A * D) / tmpdenom
-                if c0 is None:
-                    c0 = c
-                array2[:, t] = c0 + array[:, t] - c
-            else:
-                array2[:, t] = array[:, t]
+        weights, is_valid = highpass_weights(hp_sigma, sourcetsize)
+
+        array2 = np.array(array, copy=True)
+
+        if np.any(is_valid):
+            c = array @ weights[:, is_valid]
+            c0 = c[:, :1]  # first time point where the fit is defined
+
+            array2[:, is_valid] = c0 + array[:, is_valid] - c
 
         array2 -= array2.mean(axis=1)[:, None]
 
         np.copyto(array, array2)  # destination, then source
 
     if lp_sigma > 0:
-        for t in range(sourcetsize):
-            total = np.zeros((m,), dtype=array.dtype)
-            sum = 0
-
-            for tt in range(
-                max(t - lp_mask_size_minus, 0),
-                min(t + lp_mask_size_plus, sourcetsize - 1) + 1,
-            ):
-                total += array[:, tt] * lp_exp[tt - t]
-                sum += lp_exp[tt - t]
-
-            if sum > 0:
-                array2[:, t] = total / sum
-            else:
-                array2[:, t] = total
+        weights = lowpass_weights(lp_sigma, sourcetsize)
 
-        np.copyto(array, array2)
+        np.copyto(array, array @ weights)
 
     return array
 
@@ -112,6 +109,7 @@ class TemporalFilter(Transformer):
     input_spec = TemporalFilterInputSpec
 
     suffix = "bptf"
+    chainable = True
 
     def _transform(self, array):
         lowpass_sigma = self.inputs.lowpass_sigma
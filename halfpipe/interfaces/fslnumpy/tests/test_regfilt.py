@@ -3,6 +3,7 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 import os
+import tracemalloc
 from random import seed
 
 import nibabel as nib
@@ -10,7 +11,47 @@ import numpy as np
 import pytest
 from nipype.interfaces import fsl
 
-from ..regfilt import FilterRegressor
+from ..regfilt import FilterRegressor, binarize, regfilt
+
+
+def regfilt_copy(array, design, comps, calculate_mask=True, aggressive=False):
+    """
+    previous implementation that filters a copy of the whole data at once
+    """
+    zero_based_comps = [c - 1 for c in comps]
+
+    data = array.copy()
+    if calculate_mask is True:
+        mean = data.mean(axis=0)
+        mmin = mean.min()
+        mmax = mean.max()
+        mask = binarize(mean, mmin + 0.01 * (mmax - mmin), mmax)
+        mask_vec = np.ravel(mask)
+        data = data[:, mask_vec]
+
+    mean_r = data.mean(axis=0)
+    data -= mean_r[None, :]
+    design = design - design.mean(axis=0)[None, :]
+
+    maps = np.linalg.pinv(design) @ data
+
+    noisedes = design[:, zero_based_comps]
+    noisemaps = maps[zero_based_comps, :].T
+
+    if aggressive:
+        new_data = data - noisedes @ (np.linalg.pinv(noisedes) @ data)
+    else:
+        new_data = data - noisedes @ noisemaps.T
+
+    new_data += mean_r[None, :]
+
+    if calculate_mask is True:
+        temp_vol = np.zeros_like(array)
+        temp_vol[:, mask_vec] = new_data
+    else:
+        temp_vol = new_data
+
+    return temp_vol
 
 
 @pytest.mark.slow
@@ -59,3 +100,47 @@ def test_FilterRegressor(tmp_path):
     # print(np.mean(np.abs(r0 - r1)))
 
     assert np.allclose(r0, r1)
+
+
+@pytest.mark.timeout(300)
+@pytest.mark.parametrize("calculate_mask", [True, False])
+@pytest.mark.parametrize("aggressive", [True, False])
+@pytest.mark.parametrize("block_size", [None, 1, 97])
+def test_regfilt(calculate_mask, aggressive, block_size):
+    np.random.seed(0)
+
+    array = np.random.rand(100, 1000) * 1000 + 10000
+    array[:, :100] = 0  # outside the brain
+
+    design = np.random.rand(100, 5)
+    comps = [1, 3, 4]
+
+    r0 = regfilt_copy(array, design.copy(), comps, calculate_mask, aggressive)
+    r1 = regfilt(
+        array.copy(), design.copy(), comps, calculate_mask, aggressive, block_size
+    )
+
+    assert np.allclose(r0, r1, rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.timeout(300)
+def test_regfilt_memory():
+    np.random.seed(0)
+
+    array = np.random.rand(200, 20000) * 1000 + 10000
+    design = np.random.rand(200, 10)
+    comps = [1, 2, 3]
+
+    peaks = list()
+    for function, kwargs in [(regfilt_copy, dict()), (regfilt, dict(block_size=1000))]:
+        tracemalloc.start()
+        function(array, design, comps, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peaks.append(peak)
+
+    copy_peak, block_peak = peaks
+
+    # the previous implementation needs at least three copies of the data
+    assert copy_peak > 2 * array.nbytes
+    assert block_peak < 0.25 * array.nbytes
@@ -4,13 +4,109 @@
 
 import os
 from random import seed
+from timeit import timeit
 
 import nibabel as nib
 import numpy as np
 import pytest
 from nipype.interfaces import fsl
 
-from ..tempfilt import TemporalFilter
+from ..tempfilt import TemporalFilter, bandpass_temporal_filter
+
+
+def bandpass_temporal_filter_loop(array, hp_sigma, lp_sigma):
+    """
+    previous implementation with loops that follows the fsl code line by line
+    """
+
+    if hp_sigma <= 0:
+        hp_mask_size_minus = 0
+    else:
+        hp_mask_size_minus = int(np.floor(hp_sigma * 3))
+
+    hp_mask_size_plus = hp_mask_size_minus
+
+    if lp_sigma <= 0:
+        lp_mask_size_minus = 0
+    else:
+        lp_mask_size_minus = int(np.floor(lp_sigma * 20)) + 2
+
+    lp_mask_size_plus = lp_mask_size_minus
+
+    hp_exp = np.zeros(0)
+    if hp_sigma > 0:
+        hp_exp = np.zeros(hp_mask_size_minus + hp_mask_size_plus + 1)
+        for t in range(-hp_mask_size_minus, hp_mask_size_plus + 1):
+            hp_exp[t] = np.exp(-0.5 * (float(t * t)) / (hp_sigma * hp_sigma))
+
+    lp_exp = np.zeros(0)
+    if lp_sigma > 0:
+        total = 0.0
+        lp_exp = np.zeros(lp_mask_size_minus + lp_mask_size_plus + 1)
+        for t in range(-lp_mask_size_minus, lp_mask_size_plus + 1):
+            lp_exp[t] = np.exp(-0.5 * (float(t * t)) / (lp_sigma * lp_sigma))
+            total += lp_exp[t]
+        for t in range(-lp_mask_size_minus, lp_mask_size_plus + 1):
+            lp_exp[t] /= total
+
+    m, sourcetsize = array.shape
+    array2 = np.zeros_like(array)
+
+    if hp_sigma > 0:
+        c0 = None
+        for t in range(sourcetsize):
+
+            A = 0
+            B = np.zeros((m,), dtype=array.dtype)
+            C = 0
+            D = np.zeros((m,), dtype=array.dtype)
+            N = 0
+
+            for tt in range(
+                max(t - hp_mask_size_minus, 0),
+                min(t + hp_mask_size_plus, sourcetsize - 1) + 1,
+            ):
+                dt = tt - t
+                w = hp_exp[dt]
+                A += w * dt
+                B += w * array[:, tt]
+                C += w * dt * dt
+                D += w * dt * array[:, tt]
+                N += w
+
+            tmpdenom = C * N - A * A
+            if not np.isclose(tmpdenom, 0):
+                c = (B * C - A * D) / tmpdenom
+                if c0 is None:
+                    c0 = c
+                array2[:, t] = c0 + array[:, t] - c
+            else:
+                array2[:, t] = array[:, t]
+
+        array2 -= array2.mean(axis=1)[:, None]
+
+        np.copyto(array, array2)  # destination, then source
+
+    if lp_sigma > 0:
+        for t in range(sourcetsize):
+            total = np.zeros((m,), dtype=array.dtype)
+            sum = 0
+
+            for tt in range(
+                max(t - lp_mask_size_minus, 0),
+                min(t + lp_mask_size_plus, sourcetsize - 1) + 1,
+            ):
+                total += array[:, tt] * lp_exp[tt - t]
+                sum += lp_exp[tt - t]
+
+            if sum > 0:
+                array2[:, t] = total / sum
+            else:
+                array2[:, t] = total
+
+        np.copyto(array, array2)
+
+    return array
 
 
 @pytest.mark.slow
@@ -46,3 +142,35 @@ def test_TemporalFilter(tmp_path):
 
     r1 = nib.load(result.outputs.out_file).get_fdata()
     assert np.allclose(r0, r1)
+
+
+@pytest.mark.timeout(300)
+@pytest.mark.parametrize(
+    "highpass_sigma, lowpass_sigma, size",
+    [(125, 12, 100), (25, -1, 200), (-1, 2.5, 150), (3, 1, 3), (10, 0.5, 1)],
+)
+def test_bandpass_temporal_filter(highpass_sigma, lowpass_sigma, size):
+    np.random.seed(0)
+
+    array = np.random.rand(1000, size) * 1000 + 10000
+
+    r0 = bandpass_temporal_filter_loop(array.copy(), highpass_sigma, lowpass_sigma)
+    r1 = bandpass_temporal_filter(array.copy(), highpass_sigma, lowpass_sigma)
+
+    assert np.allclose(r0, r1, rtol=1e-10, atol=1e-10)
+
+
+@pytest.mark.timeout(300)
+def test_bandpass_temporal_filter_benchmark():
+    np.random.seed(0)
+
+    array = np.random.rand(10000, 200) * 1000 + 10000
+
+    loop_time = timeit(
+        lambda: bandpass_temporal_filter_loop(array.copy(), 125, 12), number=1
+    )
+    vectorized_time = timeit(
+        lambda: bandpass_temporal_filter(array.copy(), 125, 12), number=1
+    )
+
+    assert vectorized_time < loop_time
@@ -21,6 +21,19 @@ class GrandMeanScalingInputSpec(BaseInterfaceInputSpec):
     mask = File(exists=True, desc="3D brain mask")
     mean = traits.Float(mandatory=True, desc="grand mean scale value")
 
+    dtype = traits.Enum(
+        "float64",
+        "float32",
+        usedefault=True,
+        desc="floating point type for the data in memory and in the output images",
+    )
+    compresslevel = traits.Range(
+        low=0,
+        high=9,
+        desc="gzip compression level for the output images, where zero means "
+        "that uncompressed .nii files are written",
+    )
+
 
 class GrandMeanScalingOutputSpec(TraitedSpec):
     files = traits.List(File(exists=True))
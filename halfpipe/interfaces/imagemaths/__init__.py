@@ -3,18 +3,30 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 from .addmeans import AddMeans
+from .apply_mask import ApplyMask
+from .divide import Divide
+from .image_range import ImageRange
 from .mask_coverage import MaskCoverage
 from .max_intensity import MaxIntensity
+from .meants import MeanTimeSeries
 from .merge import Merge, MergeMask
 from .resample import Resample
+from .tsnr import TSNR
+from .tstat import TStat
 from .zscore import ZScore
 
 __all__ = [
     "AddMeans",
+    "ApplyMask",
+    "Divide",
+    "ImageRange",
     "MaskCoverage",
     "MaxIntensity",
+    "MeanTimeSeries",
     "Merge",
     "MergeMask",
     "Resample",
+    "TSNR",
+    "TStat",
     "ZScore",
 ]
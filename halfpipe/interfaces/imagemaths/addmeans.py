@@ -16,18 +16,17 @@ class AddMeans(Transformer):
     input_spec = AddMeansInputSpec
 
     suffix = "addmean"
-
-    def _run_interface(self, runtime):
-        in_file = self.inputs.in_file
-        mean_file = self.inputs.mean_file
-
-        mean_data = self._load(mean_file)
+    chainable = True
+
+    def _transform(self, array):
+        # use a separate instance, so that we do not overwrite
+        # the state from loading the input file
+        mean_transformer = Transformer(dtype=self.inputs.dtype)
+        mean_data = mean_transformer._load(
+            self.inputs.mean_file, mask_file=self.inputs.mask
+        )
         mean_r = np.nanmean(mean_data, axis=0)
 
-        array = self._load(in_file)
         array2 = array + mean_r
 
-        out_file = self._dump(array2)
-        self._results["out_file"] = out_file
-
-        return runtime
+        return array2
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+from nipype.interfaces.base import File
+
+from ..transformer import Transformer, TransformerInputSpec
+
+
+class ApplyMaskInputSpec(TransformerInputSpec):
+    mask = File(desc="mask to use for volumes", exists=True, mandatory=True)
+
+
+class ApplyMask(Transformer):
+    """
+    Set the voxels outside of the mask to zero, replaces `fsl.ApplyMask`
+    """
+
+    input_spec = ApplyMaskInputSpec
+
+    suffix = "masked"
+    squeeze = True
+
+    def _transform(self, array):
+        return array  # the mask is applied when loading and saving the image
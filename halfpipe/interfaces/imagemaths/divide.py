@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+from nipype.interfaces.base import File
+
+from ..transformer import Transformer, TransformerInputSpec
+
+
+class DivideInputSpec(TransformerInputSpec):
+    divisor_file = File(exists=True, mandatory=True)
+
+
+class Divide(Transformer):
+    """
+    Divide the input image by another image, where division by zero gives
+    zero like in `3dcalc`
+    """
+
+    input_spec = DivideInputSpec
+
+    suffix = "div"
+    squeeze = True
+
+    def _transform(self, array):
+        # use a separate instance, so that we do not overwrite
+        # the state from loading the input file
+        divisor_transformer = Transformer(dtype=self.inputs.dtype)
+        divisor = divisor_transformer._load(
+            self.inputs.divisor_file, mask_file=self.inputs.mask
+        )
+
+        array2 = np.zeros(np.broadcast(array, divisor).shape, dtype=array.dtype)
+        np.divide(array, divisor, out=array2, where=divisor != 0)
+
+        return array2
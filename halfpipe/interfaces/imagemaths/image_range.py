@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+from nipype.interfaces.base import TraitedSpec, traits
+
+from ..transformer import Transformer
+
+
+class ImageRangeOutputSpec(TraitedSpec):
+    out_stat = traits.List(traits.Float, desc="minimum and maximum intensity")
+
+
+class ImageRange(Transformer):
+    """
+    Minimum and maximum intensity of an image, replaces `fslstats -R`
+    """
+
+    output_spec = ImageRangeOutputSpec
+
+    def _run_interface(self, runtime):
+        array = self._load(self.inputs.in_file)
+
+        self._results["out_stat"] = [float(np.nanmin(array)), float(np.nanmax(array))]
+
+        return runtime
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+from pathlib import Path
+
+import numpy as np
+from nipype.interfaces.base import File
+
+from ...utils.path import split_ext
+from ..transformer import Transformer, TransformerInputSpec
+
+
+class MeanTimeSeriesInputSpec(TransformerInputSpec):
+    mask = File(desc="mask to use for volumes", exists=True, mandatory=True)
+
+
+class MeanTimeSeries(Transformer):
+    """
+    Mean time series of the voxels in the mask as a text file, replaces
+    `fsl.ImageMeants`
+    """
+
+    input_spec = MeanTimeSeriesInputSpec
+
+    suffix = "ts"
+
+    def _transform(self, array):
+        return np.mean(array, axis=1, keepdims=True)
+
+    def _dump(self, array2):
+        stem, _ = split_ext(self.inputs.in_file)
+
+        out_file = str(Path(f"{stem}_{self.suffix}.txt").resolve())
+        np.savetxt(out_file, array2, fmt="%.10f")
+
+        return out_file
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+from nipype.algorithms import confounds as nac
+from nipype.interfaces import afni, fsl
+from scipy.signal import detrend
+
+from ..apply_mask import ApplyMask
+from ..divide import Divide
+from ..image_range import ImageRange
+from ..meants import MeanTimeSeries
+from ..tsnr import TSNR
+from ..tstat import TStat
+
+
+@pytest.fixture(scope="module")
+def image_files(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp(basename="image")
+
+    np.random.seed(0)
+
+    shape = (10, 9, 8)
+
+    mask = np.random.rand(*shape) > 0.2
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), mask_file)
+
+    t = np.arange(50)
+    bold = np.random.rand(*shape, 50) * 100 + 1000 + 0.5 * t
+    bold_file = str(tmp_path / "bold.nii.gz")
+    nib.save(nib.Nifti1Image(bold.astype(np.float32), np.eye(4)), bold_file)
+
+    volume = np.random.rand(*shape) * 10
+    volume[0, 0, :] = 0  # division by zero
+    volume_file = str(tmp_path / "volume.nii.gz")
+    nib.save(nib.Nifti1Image(volume.astype(np.float32), np.eye(4)), volume_file)
+
+    return bold_file, volume_file, mask_file
+
+
+def load(path):
+    return np.asarray(nib.load(path).dataobj, dtype=np.float64)
+
+
+def test_tstat(tmp_path, image_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, _, mask_file = image_files
+
+    result = TStat(in_file=bold_file, mask=mask_file, statistic="stdev").run()
+    assert result.outputs is not None
+
+    mask = load(mask_file) > 0
+    expected = np.std(detrend(load(bold_file), axis=3), axis=3, ddof=1)
+    expected[~mask] = 0
+
+    assert np.allclose(load(result.outputs.out_file), expected)
+
+
+def test_divide(tmp_path, image_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, volume_file, mask_file = image_files
+
+    mask = load(mask_file) > 0
+    stddev = np.std(load(bold_file), axis=3)
+    stddev_file = "stddev.nii.gz"
+    nib.save(nib.Nifti1Image(stddev, np.eye(4)), stddev_file)
+
+    result = Divide(in_file=stddev_file, divisor_file=volume_file, mask=mask_file).run()
+    assert result.outputs is not None
+
+    volume = load(volume_file)
+    expected = np.zeros_like(volume)
+    is_valid = mask & (volume != 0)
+    expected[is_valid] = stddev[is_valid] / volume[is_valid]
+
+    assert np.allclose(load(result.outputs.out_file), expected)
+
+
+def test_apply_mask(tmp_path, image_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, _, mask_file = image_files
+
+    result = ApplyMask(in_file=bold_file, mask=mask_file, dtype="float32").run()
+    assert result.outputs is not None
+
+    mask = load(mask_file) > 0
+    expected = load(bold_file) * mask[..., np.newaxis]
+
+    assert np.array_equal(load(result.outputs.out_file), expected)
+
+
+def test_image_range(tmp_path, image_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, _, _ = image_files
+
+    result = ImageRange(in_file=bold_file).run()
+    assert result.outputs is not None
+
+    bold = load(bold_file)
+    assert np.allclose(result.outputs.out_stat, [bold.min(), bold.max()])
+
+
+def test_mean_time_series(tmp_path, image_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, _, mask_file = image_files
+
+    result = MeanTimeSeries(in_file=bold_file, mask=mask_file).run()
+    assert result.outputs is not None
+
+    mask = load(mask_file) > 0
+    expected = load(bold_file)[mask].mean(axis=0)
+
+    assert np.allclose(np.loadtxt(result.outputs.out_file), expected)
+
+
+def test_tsnr(tmp_path, image_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, _, _ = image_files
+
+    result = TSNR(in_file=bold_file).run()
+    assert result.outputs is not None
+
+    nipype_result = nac.TSNR(in_file=bold_file).run()
+    assert nipype_result.outputs is not None
+
+    assert np.allclose(
+        load(result.outputs.out_file), load(nipype_result.outputs.tsnr_file)
+    )
+
+
+@pytest.mark.slow
+@pytest.mark.timeout(600)
+def test_native_external(tmp_path, image_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, volume_file, mask_file = image_files
+
+    result = TStat(in_file=bold_file, mask=mask_file, statistic="stdev").run()
+    assert result.outputs is not None
+    external_result = afni.TStat(
+        in_file=bold_file, mask=mask_file, options="-stdev", outputtype="NIFTI_GZ"
+    ).run()
+    assert external_result.outputs is not None
+    assert np.allclose(
+        load(result.outputs.out_file),
+        load(external_result.outputs.out_file),
+        rtol=1e-5,
+    )
+
+    result = ApplyMask(in_file=bold_file, mask=mask_file, dtype="float32").run()
+    assert result.outputs is not None
+    external_result = fsl.ApplyMask(in_file=bold_file, mask_file=mask_file).run()
+    assert external_result.outputs is not None
+    assert np.allclose(
+        load(result.outputs.out_file), load(external_result.outputs.out_file)
+    )
+
+    result = ImageRange(in_file=bold_file).run()
+    assert result.outputs is not None
+    external_result = fsl.ImageStats(in_file=bold_file, op_string="-R").run()
+    assert external_result.outputs is not None
+    assert np.allclose(result.outputs.out_stat, external_result.outputs.out_stat)
+
+    result = MeanTimeSeries(in_file=bold_file, mask=mask_file).run()
+    assert result.outputs is not None
+    external_result = fsl.ImageMeants(in_file=bold_file, mask=mask_file).run()
+    assert external_result.outputs is not None
+    assert np.allclose(
+        np.loadtxt(result.outputs.out_file),
+        np.loadtxt(external_result.outputs.out_file),
+        rtol=1e-5,
+    )
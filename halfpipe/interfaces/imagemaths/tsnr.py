@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+
+from ..transformer import Transformer
+
+
+class TSNR(Transformer):
+    """
+    Temporal signal-to-noise ratio, replaces `nipype.algorithms.confounds.TSNR`
+    """
+
+    suffix = "tsnr"
+    squeeze = True
+
+    def _transform(self, array):
+        np.nan_to_num(array, copy=False)
+
+        mean = np.mean(array, axis=0, keepdims=True)
+        stddev = np.std(array, axis=0, keepdims=True)
+
+        array2 = np.zeros_like(mean)
+        np.divide(mean, stddev, out=array2, where=stddev > 1e-3)
+
+        return array2
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+from nipype.interfaces.base import traits
+
+from ..transformer import Transformer, TransformerInputSpec
+
+
+def detrended_stdev(array: np.ndarray) -> np.ndarray:
+    """
+    Standard deviation of each column after removing the mean and the linear
+    trend, like `3dTstat -stdev`
+    """
+    m, _ = array.shape
+    if m < 2:
+        return np.zeros_like(array[:1])
+
+    t = np.arange(m, dtype=np.float64)
+    design = np.column_stack([np.ones(m), t - t.mean()])
+
+    betas, _, _, _ = np.linalg.lstsq(design, array, rcond=None)
+    residuals = array - design @ betas
+
+    return np.sqrt(np.sum(np.square(residuals), axis=0, keepdims=True) / (m - 1))
+
+
+class TStatInputSpec(TransformerInputSpec):
+    statistic = traits.Enum("stdev", "mean", usedefault=True)
+
+
+class TStat(Transformer):
+    """
+    Voxel-wise statistics over time, replaces `afni.TStat`
+    """
+
+    input_spec = TStatInputSpec
+
+    suffix = "tstat"
+    squeeze = True
+
+    def _transform(self, array):
+        if self.inputs.statistic == "stdev":
+            return detrended_stdev(array)
+        elif self.inputs.statistic == "mean":
+            return np.mean(array, axis=0, keepdims=True)
+        raise ValueError(f'Unknown statistic "{self.inputs.statistic}"')
@@ -8,6 +8,8 @@ from ..transformer import Transformer
 
 
 class ZScore(Transformer):
+    chainable = True
+
     def _transform(self, array):
         mean = np.nanmean(array)
         std = np.nanstd(array)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+import numpy as np
+from nipype.interfaces.base import File, traits
+
+from .transformer import Transformer, TransformerInputSpec
+
+neighborhood_sizes = dict(faces=1, edges=2, vertices=3)
+
+max_voxels_per_slab = 2**14
+
+
+def rank(array: np.ndarray) -> np.ndarray:
+    """
+    Rank each column of the array starting from one, where tied values get
+    the average of their ranks
+    """
+    m, n = array.shape
+
+    order = np.argsort(array, axis=0, kind="stable")
+    sorted_array = np.take_along_axis(array, order, axis=0)
+
+    index = np.broadcast_to(np.arange(m)[:, np.newaxis], (m, n))
+
+    is_different = np.diff(sorted_array, axis=0) != 0
+    is_first = np.concatenate([np.ones((1, n), dtype=bool), is_different])
+    is_last = np.concatenate([is_different, np.ones((1, n), dtype=bool)])
+
+    # find the start and end of each run of tied values
+    first = np.maximum.accumulate(np.where(is_first, index, 0), axis=0)
+    last = np.flip(
+        np.minimum.accumulate(np.flip(np.where(is_last, index, m - 1), axis=0), axis=0),
+        axis=0,
+    )
+
+    ranks = np.empty((m, n), dtype=np.float64)
+    np.put_along_axis(ranks, order, (first + last) / 2 + 1, axis=0)
+
+    return ranks
+
+
+def neighbor_indices(mask: np.ndarray, neighborhood: str = "vertices") -> np.ndarray:
+    """
+    For each voxel in the mask, find the indices of the voxels in its
+    neighborhood, where -1 means that the neighbor is outside of the mask
+    """
+    size = neighborhood_sizes[neighborhood]
+
+    offsets = [
+        offset
+        for offset in product([-1, 0, 1], repeat=3)
+        if np.sum(np.abs(offset)) <= size
+    ]
+
+    index_volume = np.full(mask.shape, -1, dtype=np.int64)
+    index_volume[mask] = np.arange(np.count_nonzero(mask))
+    index_volume = np.pad(index_volume, 1, constant_values=-1)
+
+    coordinates = np.nonzero(mask)
+
+    indices = np.empty((coordinates[0].size, len(offsets)), dtype=np.int64)
+    for i, offset in enumerate(offsets):
+        shifted_coordinates = tuple(c + o + 1 for c, o in zip(coordinates, offset))
+        indices[:, i] = index_volume[shifted_coordinates]
+
+    return indices
+
+
+def kendall_w(ranks: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """
+    Kendall's coefficient of concordance between the ranked time series of
+    each voxel and its neighbors
+    """
+    m, _ = ranks.shape
+    n, _ = indices.shape
+
+    rank_sums = np.zeros((m, n), dtype=np.float64)
+    counts = np.zeros(n, dtype=np.float64)
+
+    for neighbor in indices.T:
+        is_valid = neighbor >= 0
+        rank_sums[:, is_valid] += ranks[:, neighbor[is_valid]]
+        counts += is_valid
+
+    mean_rank_sum = counts * (m + 1) / 2
+    s = np.sum(np.square(rank_sums - mean_rank_sum), axis=0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = 12 * s / (np.square(counts) * (m**3 - m))
+
+    return np.nan_to_num(w)
+
+
+def reho(
+    array: np.ndarray,
+    mask: np.ndarray,
+    neighborhood: str = "vertices",
+    num_threads: int = 1,
+) -> np.ndarray:
+    """
+    Regional homogeneity for the time series of the voxels in the mask, which
+    are the columns of the array. The voxels are processed in slabs of
+    neighboring voxels on multiple threads
+    """
+    _, n = array.shape
+
+    indices = neighbor_indices(mask, neighborhood)
+
+    # the ranks are small integers or halves, so single precision is exact
+    ranks = np.empty(array.shape, dtype=np.float32)
+    w = np.zeros((1, n), dtype=np.float64)
+
+    slabs = [
+        slice(start, start + max_voxels_per_slab)
+        for start in range(0, n, max_voxels_per_slab)
+    ]
+
+    def rank_slab(slab: slice) -> None:
+        ranks[:, slab] = rank(array[:, slab])
+
+    def kendall_w_slab(slab: slice) -> None:
+        w[0, slab] = kendall_w(ranks, indices[slab])
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        # all ranks need to be ready before we can look at the neighbors
+        list(executor.map(rank_slab, slabs))
+        list(executor.map(kendall_w_slab, slabs))
+
+    return w
+
+
+class ReHoInputSpec(TransformerInputSpec):
+    mask = File(desc="mask to use for volumes", exists=True, mandatory=True)
+
+    neighborhood = traits.Enum(
+        "vertices",
+        "edges",
+        "faces",
+        usedefault=True,
+        desc="voxels that share a vertex (27), an edge (19) or a face (7)",
+    )
+    num_threads = traits.Int(1, usedefault=True)
+
+
+class ReHo(Transformer):
+    """
+    Regional homogeneity as Kendall's W of each voxel and its neighbors,
+    replaces `3dReHo`
+    """
+
+    input_spec = ReHoInputSpec
+
+    suffix = "reho"
+    squeeze = True
+
+    def _transform(self, array):
+        assert self.mask is not None
+
+        return reho(
+            array,
+            self.mask,
+            neighborhood=self.inputs.neighborhood,
+            num_threads=self.inputs.num_threads,
+        )
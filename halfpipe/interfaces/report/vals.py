@@ -5,6 +5,7 @@
 import numpy as np
 import pandas as pd
 from nipype.interfaces.base import (
+    Directory,
     DynamicTraitedSpec,
     File,
     SimpleInterface,
@@ -23,6 +24,8 @@ class CalcMeanInputSpec(TraitedSpec):
     parcellation = File(exists=True)
     dseg = File(exists=True)
 
+    cache_directory = Directory(exists=True, nohash=True)
+
     vals = traits.Dict(traits.Str(), traits.Any())
     key = traits.Str()
 
@@ -41,17 +44,26 @@ class CalcMean(SimpleInterface):
         mask_file = None
         if isdefined(self.inputs.mask):
             mask_file = self.inputs.mask
+        cache_directory = None
+        if isdefined(self.inputs.cache_directory):
+            cache_directory = self.inputs.cache_directory
 
         if isdefined(self.inputs.dseg):  # get grey matter only
             dseg_mean_signals = mean_signals(
-                in_file, self.inputs.dseg, mask_file=mask_file
+                in_file,
+                self.inputs.dseg,
+                mask_file=mask_file,
+                cache_directory=cache_directory,
             )
             _, gm_mean, _ = np.ravel(dseg_mean_signals).tolist()
             self._results["mean"] = float(gm_mean)
 
         elif isdefined(self.inputs.parcellation):
             parc_mean_signals = mean_signals(
-                in_file, self.inputs.parcellation, mask_file=mask_file
+                in_file,
+                self.inputs.parcellation,
+                mask_file=mask_file,
+                cache_directory=cache_directory,
             )
             parc_mean_signals_list = list(
                 map(float, np.ravel(parc_mean_signals).tolist())
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+from pathlib import Path
+
+import numpy as np
+from nipype.interfaces.base import File, InputMultiPath, TraitedSpec, traits
+from scipy.linalg import solve_triangular
+
+from ...ingest.spreadsheet import read_spreadsheet
+from ...stats.miscmaths import t2z_convert_array
+from ..transformer import Transformer, TransformerInputSpec
+
+max_voxels_per_block = 2**12
+
+
+def pinv_design(design: np.ndarray) -> np.ndarray:
+    """
+    Pseudo-inverse of a design matrix from its QR decomposition. We fall back
+    to the singular value decomposition only if the design is rank-deficient
+    """
+    _, k = design.shape
+
+    q, r = np.linalg.qr(design)
+    if np.linalg.matrix_rank(r) < k:
+        return np.linalg.pinv(design)
+
+    return solve_triangular(r, q.T)
+
+
+def ols(
+    array: np.ndarray, design: np.ndarray, contrasts: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """
+    Fit the same design to each column of the array with ordinary least
+    squares, like `fsl_glm`. Returns the copes, varcopes and t statistics for
+    each row of the contrast matrix and the degrees of freedom
+    """
+    m, n = array.shape
+    _, k = design.shape
+
+    pinv = pinv_design(design)
+    betas = pinv @ array
+
+    residual_sum_of_squares = np.zeros(n)
+    for start in range(0, n, max_voxels_per_block):
+        block = slice(start, start + max_voxels_per_block)
+        residuals = array[:, block] - design @ betas[:, block]
+        residual_sum_of_squares[block] = np.sum(np.square(residuals), axis=0)
+
+    dof = m - k
+    sigmasq = residual_sum_of_squares / dof
+
+    contrast_variance = np.einsum("ij,jk,ik->i", contrasts, pinv @ pinv.T, contrasts)
+
+    copes = contrasts @ betas
+    varcopes = contrast_variance[:, np.newaxis] * sigmasq[np.newaxis, :]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tstats = np.where(varcopes > 0, copes / np.sqrt(varcopes), 0)
+
+    return copes, varcopes, tstats, dof
+
+
+def demean(array: np.ndarray) -> np.ndarray:
+    array -= array.mean(axis=0)
+    return array
+
+
+def load_matrix_file(path) -> np.ndarray:
+    return np.atleast_2d(read_spreadsheet(path).to_numpy(dtype=np.float64))
+
+
+class GLMInputSpec(TransformerInputSpec):
+    mask = File(desc="mask to use for volumes", exists=True, mandatory=True)
+
+    designs = InputMultiPath(
+        File(exists=True),
+        mandatory=True,
+        desc="design matrix files without header, one for each model",
+    )
+    contrasts = InputMultiPath(
+        File(exists=True),
+        mandatory=True,
+        desc="contrast matrix files without header, one for each model",
+    )
+    demean = traits.Bool(True, usedefault=True)
+
+
+class GLMOutputSpec(TraitedSpec):
+    copes = traits.List(traits.List(File()), desc="for each model and contrast")
+    varcopes = traits.List(traits.List(File()), desc="for each model and contrast")
+    tstats = traits.List(traits.List(File()), desc="for each model and contrast")
+    zstats = traits.List(traits.List(File()), desc="for each model and contrast")
+    dof_files = traits.List(File(), desc="for each model")
+
+
+class GLM(Transformer):
+    """
+    Temporal regression of multiple designs on the same image, replaces
+    `fsl.GLM`. The image is only loaded once
+    """
+
+    input_spec = GLMInputSpec
+    output_spec = GLMOutputSpec
+
+    squeeze = True
+
+    def _run_interface(self, runtime):
+        if len(self.inputs.designs) != len(self.inputs.contrasts):
+            raise ValueError("Need one contrast matrix file for each design file")
+
+        array = self._load(self.inputs.in_file)
+        if self.inputs.demean:
+            array = demean(array)
+
+        for key in ["copes", "varcopes", "tstats", "zstats", "dof_files"]:
+            self._results[key] = list()
+
+        for i, (design_file, contrast_file) in enumerate(
+            zip(self.inputs.designs, self.inputs.contrasts)
+        ):
+            design = load_matrix_file(design_file)
+            if self.inputs.demean:
+                design = demean(design)
+            contrasts = load_matrix_file(contrast_file)
+
+            copes, varcopes, tstats, dof = ols(array, design, contrasts)
+            zstats = t2z_convert_array(tstats, dof)
+
+            for key, name, out_array in [
+                ("copes", "cope", copes),
+                ("varcopes", "varcope", varcopes),
+                ("tstats", "tstat", tstats),
+                ("zstats", "zstat", zstats),
+            ]:
+                out_files = list()
+                for j, row in enumerate(out_array):
+                    self.suffix = f"design{i + 1:d}_{name}{j + 1:d}"
+                    out_files.append(self._dump(row[np.newaxis, :]))
+                self._results[key].append(out_files)
+
+            self.suffix = f"design{i + 1:d}_dof"
+            dof_array = np.full((1, array.shape[1]), dof, dtype=np.float64)
+            self._results["dof_files"].append(self._dump(dof_array))
+
+        return runtime
+
+
+class SpatialRegressionInputSpec(TransformerInputSpec):
+    mask = File(desc="mask to use for volumes", exists=True, mandatory=True)
+
+    map_files = InputMultiPath(
+        File(exists=True),
+        mandatory=True,
+        desc="images with one volume per component to use as spatial design",
+    )
+    demean = traits.Bool(True, usedefault=True)
+
+
+class SpatialRegressionOutputSpec(TraitedSpec):
+    out_files = traits.List(File(), desc="time series of the components")
+
+
+class SpatialRegression(Transformer):
+    """
+    Spatial regression of multiple maps on the same image, replaces `fsl.GLM`
+    with a design image. The image is only loaded once
+    """
+
+    input_spec = SpatialRegressionInputSpec
+    output_spec = SpatialRegressionOutputSpec
+
+    def _run_interface(self, runtime):
+        array = self._load(self.inputs.in_file).T  # voxels x volumes
+        if self.inputs.demean:
+            array = demean(array)
+
+        dtype = self.inputs.dtype
+
+        self._results["out_files"] = list()
+        for i, map_file in enumerate(self.inputs.map_files):
+            design = Transformer(dtype=dtype)._load(
+                map_file, mask_file=self.inputs.mask
+            )
+            design = design.T.astype(np.float64)  # voxels x components
+            if self.inputs.demean:
+                design = demean(design)
+
+            betas = pinv_design(design) @ array  # components x volumes
+
+            out_file = str(Path(f"{self.stem}_map{i + 1:d}_timeseries.tsv").resolve())
+            np.savetxt(out_file, betas.T, delimiter="\t")
+            self._results["out_files"].append(out_file)
+
+        return runtime
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+import statsmodels.api as sm
+from nipype.interfaces import fsl
+
+from ..glm import GLM, SpatialRegression, ols
+
+
+@pytest.fixture(scope="module")
+def glm_files(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp(basename="glm")
+
+    np.random.seed(0)
+
+    shape = (10, 9, 8)
+    m = 60
+
+    mask = np.random.rand(*shape) > 0.2
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), mask_file)
+
+    maps = np.random.rand(*shape, 3)
+    maps[~mask] = 0
+    map_file = str(tmp_path / "maps.nii.gz")
+    nib.save(nib.Nifti1Image(maps, np.eye(4)), map_file)
+
+    timeseries = np.random.rand(m, 3)
+    bold = maps @ timeseries.T + np.random.rand(*shape, m) + 1000
+    bold_file = str(tmp_path / "bold.nii.gz")
+    nib.save(nib.Nifti1Image(bold, np.eye(4)), bold_file)
+
+    design_files = list()
+    contrast_files = list()
+    for i in range(2):
+        design = np.random.rand(m, 4)
+        design_file = str(tmp_path / f"design{i}.tsv")
+        np.savetxt(design_file, design, delimiter="\t")
+        design_files.append(design_file)
+
+        contrasts = np.eye(4)[: i + 1]
+        contrast_file = str(tmp_path / f"contrast{i}.tsv")
+        np.savetxt(contrast_file, contrasts, delimiter="\t")
+        contrast_files.append(contrast_file)
+
+    return bold_file, mask_file, map_file, design_files, contrast_files
+
+
+def test_ols():
+    np.random.seed(0)
+
+    m = 100
+    design = np.random.rand(m, 3)
+    array = np.random.rand(m, 20)
+    contrasts = np.array([[1, 0, 0], [0, 1, -1]])
+
+    copes, varcopes, tstats, dof = ols(array, design, contrasts)
+
+    assert dof == m - 3
+    for i in range(array.shape[1]):
+        result = sm.OLS(array[:, i], design).fit()
+        test = result.t_test(contrasts)
+        assert np.allclose(copes[:, i], test.effect)
+        assert np.allclose(varcopes[:, i], np.square(test.sd).ravel())
+        assert np.allclose(tstats[:, i], test.tvalue.ravel())
+
+
+def test_ols_rank_deficient():
+    np.random.seed(0)
+
+    m = 100
+    design = np.random.rand(m, 3)
+    design[:, 2] = design[:, 1]
+    array = np.random.rand(m, 20)
+    contrasts = np.array([[1, 0, 0]])
+
+    copes, _, tstats, _ = ols(array, design, contrasts)
+
+    reference, _, _, _ = ols(array, design[:, :2], contrasts[:, :2])
+    assert np.allclose(copes, reference)
+    assert np.all(np.isfinite(tstats))
+
+
+def test_glm(tmp_path, glm_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, mask_file, _, design_files, contrast_files = glm_files
+
+    result = GLM(
+        in_file=bold_file,
+        mask=mask_file,
+        designs=design_files,
+        contrasts=contrast_files,
+    ).run()
+    assert result.outputs is not None
+
+    mask = nib.load(mask_file).get_fdata() > 0
+    array = nib.load(bold_file).get_fdata()[mask].T
+    array -= array.mean(axis=0)
+
+    for i, (design_file, contrast_file) in enumerate(zip(design_files, contrast_files)):
+        design = np.loadtxt(design_file)
+        design -= design.mean(axis=0)
+        contrasts = np.loadtxt(contrast_file, ndmin=2)
+
+        copes, varcopes, _, dof = ols(array, design, contrasts)
+
+        assert len(result.outputs.copes[i]) == contrasts.shape[0]
+        for j in range(contrasts.shape[0]):
+            cope = nib.load(result.outputs.copes[i][j]).get_fdata()
+            varcope = nib.load(result.outputs.varcopes[i][j]).get_fdata()
+            assert cope.shape == mask.shape
+            assert np.allclose(cope[mask], copes[j])
+            assert np.allclose(varcope[mask], varcopes[j])
+
+        dof_image = nib.load(result.outputs.dof_files[i]).get_fdata()
+        assert np.all(dof_image[mask] == dof)
+
+
+def test_spatial_regression(tmp_path, glm_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, mask_file, map_file, _, _ = glm_files
+
+    result = SpatialRegression(
+        in_file=bold_file, mask=mask_file, map_files=[map_file, map_file]
+    ).run()
+    assert result.outputs is not None
+
+    mask = nib.load(mask_file).get_fdata() > 0
+    array = nib.load(bold_file).get_fdata()[mask]
+    design = nib.load(map_file).get_fdata()[mask]
+
+    array -= array.mean(axis=0)
+    design -= design.mean(axis=0)
+    expected, _, _, _ = np.linalg.lstsq(design, array, rcond=None)
+
+    assert len(result.outputs.out_files) == 2
+    for out_file in result.outputs.out_files:
+        timeseries = np.loadtxt(out_file)
+        assert timeseries.shape == (array.shape[1], design.shape[1])
+        assert np.allclose(timeseries, expected.T)
+
+
+@pytest.mark.slow
+@pytest.mark.timeout(600)
+def test_glm_fsl(tmp_path, glm_files):
+    os.chdir(str(tmp_path))
+
+    bold_file, mask_file, _, design_files, contrast_files = glm_files
+
+    result = GLM(
+        in_file=bold_file,
+        mask=mask_file,
+        designs=design_files[:1],
+        contrasts=contrast_files[:1],
+    ).run()
+    assert result.outputs is not None
+    (cope_file,) = result.outputs.copes[0]
+    (zstat_file,) = result.outputs.zstats[0]
+
+    np.savetxt("design.txt", np.loadtxt(design_files[0]))
+    np.savetxt("contrast.txt", np.loadtxt(contrast_files[0], ndmin=2))
+    fsl_result = fsl.GLM(
+        in_file=bold_file,
+        mask=mask_file,
+        design="design.txt",
+        contrasts="contrast.txt",
+        out_cope="cope.nii.gz",
+        out_z_name="zstat.nii.gz",
+        demean=True,
+    ).run()
+    assert fsl_result.outputs is not None
+
+    for a, b in [
+        (cope_file, fsl_result.outputs.out_cope),
+        (zstat_file, fsl_result.outputs.out_z),
+    ]:
+        assert np.allclose(
+            nib.load(a).get_fdata(), np.squeeze(nib.load(b).get_fdata()), atol=1e-4
+        )
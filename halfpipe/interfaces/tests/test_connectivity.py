@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+from scipy.ndimage import mean
+
+from ...utils.matrix import load_matrix
+from ..connectivity import (
+    AtlasIndex,
+    ConnectivityMeasure,
+    load_atlas_index,
+    load_label_index,
+    mean_signals,
+)
+from ..report.vals import CalcMean
+
+
+def mean_signals_loop(in_file, atlas_file, mask_file=None, min_region_coverage=0):
+    """
+    previous implementation that calls scipy.ndimage.mean for each volume
+    """
+    labels = np.asanyarray(nib.load(atlas_file).dataobj).astype(int)
+    nlabel = labels.max()
+    indices = np.arange(0, nlabel + 1, dtype=int)
+
+    region_coverage = None
+    if mask_file is not None:
+        mask_data = np.asanyarray(nib.load(mask_file).dataobj).astype(bool)
+
+        unmasked_counts = np.bincount(np.ravel(labels), minlength=nlabel + 1)
+        labels[np.logical_not(mask_data)] = 0
+        masked_counts = np.bincount(np.ravel(labels), minlength=nlabel + 1)
+
+        region_coverage = masked_counts.astype(float) / unmasked_counts.astype(float)
+        region_coverage[unmasked_counts == 0] = 0
+
+        indices = indices[region_coverage >= min_region_coverage]
+        region_coverage = list(region_coverage[1:])
+
+    indices = indices[indices != 0]
+
+    in_data = nib.load(in_file).get_fdata()
+    if in_data.ndim == 3:
+        in_data = in_data[..., np.newaxis]
+
+    result = np.full((in_data.shape[3], nlabel), np.nan)
+    for i, img in enumerate(np.moveaxis(in_data, 3, 0)):
+        result[i, indices - 1] = mean(img, labels=labels, index=indices)
+
+    return result, region_coverage
+
+
+@pytest.fixture(scope="module")
+def atlas_files(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp(basename="atlas")
+
+    np.random.seed(0)
+
+    shape = (10, 9, 8)
+
+    labels = np.random.randint(0, 12, size=shape)
+    labels[labels == 7] = 0  # empty region
+    atlas_file = str(tmp_path / "atlas.nii.gz")
+    nib.save(nib.Nifti1Image(labels.astype(np.int16), np.eye(4)), atlas_file)
+
+    mask = np.random.rand(*shape) > 0.2
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), mask_file)
+
+    in_file = str(tmp_path / "bold.nii.gz")
+    in_data = np.random.rand(*shape, 20).astype(np.float32) * 1000
+    nib.save(nib.Nifti1Image(in_data, np.eye(4)), in_file)
+
+    tsnr_file = str(tmp_path / "tsnr.nii.gz")
+    nib.save(nib.Nifti1Image(in_data[..., 0], np.eye(4)), tsnr_file)
+
+    return in_file, tsnr_file, atlas_file, mask_file
+
+
+@pytest.mark.parametrize("use_mask", [False, True])
+@pytest.mark.parametrize("min_region_coverage", [0, 0.8])
+def test_mean_signals(atlas_files, use_mask, min_region_coverage):
+    in_file, tsnr_file, atlas_file, mask_file = atlas_files
+    if not use_mask:
+        mask_file = None
+
+    for file in [in_file, tsnr_file]:
+        r0, coverage0 = mean_signals_loop(
+            file, atlas_file, mask_file, min_region_coverage
+        )
+        r1, coverage1 = mean_signals(
+            file,
+            atlas_file,
+            output_coverage=True,
+            mask_file=mask_file,
+            min_region_coverage=min_region_coverage,
+        )
+
+        assert r0.shape == r1.shape
+        assert np.allclose(r0, r1, equal_nan=True)
+
+        if mask_file is not None:
+            assert np.allclose(coverage0, coverage1)
+        else:
+            assert coverage1 is None
+
+
+def test_connectivity_measure(tmp_path, atlas_files):
+    os.chdir(str(tmp_path))
+
+    in_file, tsnr_file, atlas_file, mask_file = atlas_files
+
+    instance = ConnectivityMeasure(min_region_coverage=0.5)
+    instance.inputs.in_file = in_file
+    instance.inputs.atlas_file = atlas_file
+    instance.inputs.mask_file = mask_file
+    result = instance.run()
+    assert result.outputs is not None
+
+    time_series = np.loadtxt(result.outputs.time_series)
+    r0, _ = mean_signals_loop(in_file, atlas_file, mask_file, 0.5)
+    assert np.allclose(time_series, r0, atol=1e-8, equal_nan=True)
+
+    # the index is reused for inputs with the same atlas
+    label_index = load_label_index(
+        atlas_file, mask_file=mask_file, min_region_coverage=0.5
+    )
+    assert label_index is load_label_index(
+        atlas_file, mask_file=mask_file, min_region_coverage=0.5
+    )
+
+
+def test_atlas_index_cache(tmp_path, atlas_files):
+    os.chdir(str(tmp_path))
+
+    in_file, tsnr_file, atlas_file, mask_file = atlas_files
+
+    cache_directory = tmp_path / "cache"
+    cache_directory.mkdir()
+
+    atlas_index = load_atlas_index(atlas_file, cache_directory=cache_directory)
+
+    (path,) = (cache_directory / "atlas_index").iterdir()
+    cached_atlas_index = AtlasIndex.load(path)
+
+    assert isinstance(cached_atlas_index.voxel_indices, np.memmap)
+    assert cached_atlas_index.shape == atlas_index.shape
+    for name in AtlasIndex.array_names:
+        assert np.array_equal(
+            getattr(cached_atlas_index, name), getattr(atlas_index, name)
+        )
+
+    # the cache is used by the interfaces
+    instance = ConnectivityMeasure(min_region_coverage=0.5)
+    instance.inputs.in_file = in_file
+    instance.inputs.atlas_file = atlas_file
+    instance.inputs.mask_file = mask_file
+    instance.inputs.cache_directory = str(cache_directory)
+    result = instance.run()
+    assert result.outputs is not None
+
+    instance = CalcMean(cache_directory=str(cache_directory))
+    instance.inputs.in_file = tsnr_file
+    instance.inputs.parcellation = atlas_file
+    instance.inputs.mask = mask_file
+    result = instance.run()
+    assert result.outputs is not None
+
+    r0, _ = mean_signals_loop(tsnr_file, atlas_file, mask_file)
+    assert np.allclose(result.outputs.mean, np.ravel(r0), equal_nan=True)
+
+    assert len(list((cache_directory / "atlas_index").iterdir())) == 1
+
+
+def test_connectivity_measure_npz(tmp_path, atlas_files):
+    os.chdir(str(tmp_path))
+
+    in_file, _, atlas_file, mask_file = atlas_files
+
+    outputs = dict()
+    for output_format in ["tsv", "npz"]:
+        path = tmp_path / output_format
+        path.mkdir()
+        os.chdir(str(path))
+
+        instance = ConnectivityMeasure(output_format=output_format)
+        instance.inputs.in_file = in_file
+        instance.inputs.atlas_file = atlas_file
+        instance.inputs.mask_file = mask_file
+        result = instance.run()
+        assert result.outputs is not None
+        outputs[output_format] = result.outputs
+
+    for name in ["time_series", "covariance", "correlation"]:
+        a = load_matrix(getattr(outputs["tsv"], name))
+        b = load_matrix(getattr(outputs["npz"], name))
+        assert np.allclose(a, b, atol=1e-9, equal_nan=True)
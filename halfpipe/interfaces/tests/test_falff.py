@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+from scipy.signal import detrend
+
+from ..falff import ALFF, alff
+
+
+def ideal_bandpass(array, repetition_time, low, high):
+    """
+    remove the linear trend and all frequencies outside of the band
+    """
+    m, _ = array.shape
+
+    spectrum = np.fft.rfft(detrend(array, axis=0), axis=0)
+    frequencies = np.fft.rfftfreq(m, d=repetition_time)
+    spectrum[(frequencies < low) | (frequencies > high)] = 0
+
+    return np.fft.irfft(spectrum, n=m, axis=0)
+
+
+@pytest.mark.parametrize("m", [100, 101])
+def test_alff(m):
+    np.random.seed(0)
+
+    repetition_time = 2.0
+    bands = [(0.01, 0.1), (0.1, 0.25), (0.0, np.inf)]
+
+    array = np.random.rand(m, 5000) * 100 + 1000 + np.arange(m)[:, np.newaxis]
+
+    alff_array, falff_array = alff(array, repetition_time, bands)
+
+    unfiltered_std = np.std(detrend(array, axis=0), axis=0, ddof=1)
+    for i, (low, high) in enumerate(bands):
+        filtered = ideal_bandpass(array, repetition_time, low, high)
+        filtered_std = np.std(filtered, axis=0, ddof=1)
+
+        assert np.allclose(alff_array[i], filtered_std)
+        assert np.allclose(falff_array[i], filtered_std / unfiltered_std)
+
+    assert np.allclose(falff_array[-1], 1)
+
+
+def test_alff_interface(tmp_path):
+    os.chdir(str(tmp_path))
+
+    np.random.seed(0)
+
+    shape = (10, 9, 8)
+    mask = np.random.rand(*shape) > 0.2
+    bold = np.random.rand(*shape, 120) * 100 + 1000
+    bold[~mask] = 0
+
+    nib.save(nib.Nifti1Image(bold, np.eye(4)), "bold.nii.gz")
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), "mask.nii.gz")
+
+    bands = [(0.01, 0.1), (0.1, 0.2)]
+    result = ALFF(
+        in_file="bold.nii.gz",
+        mask="mask.nii.gz",
+        repetition_time=2.0,
+        bands=bands,
+    ).run()
+    assert result.outputs is not None
+
+    assert len(result.outputs.alff_files) == len(bands)
+    assert len(result.outputs.falff_files) == len(bands)
+
+    alff_array, falff_array = alff(bold[mask].T, 2.0, bands)
+    for i in range(len(bands)):
+        alff_data = nib.load(result.outputs.alff_files[i]).get_fdata()
+        falff_data = nib.load(result.outputs.falff_files[i]).get_fdata()
+
+        assert alff_data.shape == shape
+        assert np.allclose(alff_data[mask], alff_array[i])
+        assert np.allclose(falff_data[mask], falff_array[i])
+        assert np.all(falff_data[~mask] == 0)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import os
+from itertools import product
+from shutil import which
+from timeit import timeit
+
+import nibabel as nib
+import numpy as np
+import pytest
+from scipy.stats import rankdata
+
+from ..fixes.reho import ReHo as AFNIReHo
+from ..reho import ReHo, neighborhood_sizes, rank, reho
+
+
+def reho_loop(array4d, mask, neighborhood="vertices"):
+    """
+    straightforward implementation that loops over voxels and neighbors
+    """
+    size = neighborhood_sizes[neighborhood]
+    m = array4d.shape[3]
+
+    out = np.zeros(mask.shape)
+    for x, y, z in zip(*np.nonzero(mask)):
+        ranks = list()
+        for dx, dy, dz in product([-1, 0, 1], repeat=3):
+            if abs(dx) + abs(dy) + abs(dz) > size:
+                continue
+            i, j, k = x + dx, y + dy, z + dz
+            if not all(0 <= c < s for c, s in zip((i, j, k), mask.shape)):
+                continue
+            if not mask[i, j, k]:
+                continue
+            ranks.append(rankdata(array4d[i, j, k, :]))
+
+        k = len(ranks)
+        rank_sums = np.sum(ranks, axis=0)
+        s = np.sum(np.square(rank_sums - k * (m + 1) / 2))
+        out[x, y, z] = 12 * s / (k**2 * (m**3 - m))
+
+    return out
+
+
+def make_data(shape=(10, 9, 8), m=40):
+    np.random.seed(0)
+
+    mask = np.random.rand(*shape) > 0.2
+    array4d = np.random.rand(*shape, m)
+    array4d[..., 5] = array4d[..., 6]  # ties
+    array4d = np.round(array4d * 20)  # more ties
+
+    return array4d, mask
+
+
+def test_rank():
+    np.random.seed(0)
+
+    array = np.round(np.random.rand(50, 100) * 10)
+    assert np.array_equal(rank(array), rankdata(array, axis=0))
+
+
+@pytest.mark.parametrize("neighborhood", ["faces", "edges", "vertices"])
+def test_reho(neighborhood):
+    array4d, mask = make_data()
+
+    expected = reho_loop(array4d, mask, neighborhood)
+
+    out = np.zeros(mask.shape)
+    out[mask] = reho(array4d[mask].T, mask, neighborhood, num_threads=2)[0]
+
+    assert np.allclose(out, expected)
+
+
+def test_reho_interface(tmp_path):
+    os.chdir(str(tmp_path))
+
+    array4d, mask = make_data()
+
+    nib.save(nib.Nifti1Image(array4d, np.eye(4)), "bold.nii.gz")
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), "mask.nii.gz")
+
+    result = ReHo(in_file="bold.nii.gz", mask="mask.nii.gz").run()
+    assert result.outputs is not None
+
+    out = nib.load(result.outputs.out_file).get_fdata()
+    assert out.shape == mask.shape
+    assert np.allclose(out, reho_loop(array4d, mask))
+
+
+@pytest.mark.timeout(300)
+def test_reho_benchmark():
+    array4d, mask = make_data(shape=(15, 15, 15), m=100)
+    array = array4d[mask].T
+
+    loop_time = timeit(lambda: reho_loop(array4d, mask), number=1)
+    vectorized_time = timeit(lambda: reho(array, mask), number=1)
+
+    assert vectorized_time < loop_time
+
+
+@pytest.mark.slow
+@pytest.mark.timeout(600)
+@pytest.mark.skipif(which("3dReHo") is None, reason="requires AFNI")
+def test_reho_afni(tmp_path):
+    os.chdir(str(tmp_path))
+
+    array4d, mask = make_data()
+
+    bold_file = str(tmp_path / "bold.nii.gz")
+    nib.save(nib.Nifti1Image(array4d, np.eye(4)), bold_file)
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), mask_file)
+
+    result = ReHo(in_file=bold_file, mask=mask_file).run()
+    assert result.outputs is not None
+    r0 = nib.load(result.outputs.out_file).get_fdata()
+
+    instance = AFNIReHo(neighborhood="vertices", out_file="reho.nii")
+    instance.inputs.in_file = bold_file
+    instance.inputs.mask_file = mask_file
+    result = instance.run()
+    assert result.outputs is not None
+    r1 = nib.load(result.outputs.out_file).get_fdata()
+
+    assert np.allclose(r0, r1, atol=1e-5)
@@ -8,6 +8,7 @@ import os
 
 import nibabel as nib
 import numpy as np
+import pytest
 from nilearn.image import new_img_like
 from templateflow import api
 
@@ -44,3 +45,47 @@ def test_transformer_nii(tmp_path):
     img_data = nib.load(out_file).get_fdata()
 
     assert np.allclose(test_img_data, img_data)
+
+
+@pytest.mark.parametrize("dtype", ["float64", "float32"])
+@pytest.mark.parametrize("compresslevel", [None, 0, 1])
+@pytest.mark.parametrize("use_mask", [True, False])
+def test_transformer_options(tmp_path, dtype, compresslevel, use_mask):
+    os.chdir(str(tmp_path))
+
+    shape = (5, 6, 7)
+    n_volumes = 10
+
+    mask = np.random.rand(*shape) > 0.5
+    mask_file = "mask.nii.gz"
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), mask_file)
+
+    test_img_data = np.random.rand(*shape, n_volumes)
+    if use_mask:
+        test_img_data[np.logical_not(mask), :] = 0
+
+    test_file = "img.nii.gz"
+    nib.save(nib.Nifti1Image(test_img_data, np.eye(4)), test_file)
+
+    tf = Transformer()
+    if use_mask:
+        tf.inputs.mask = mask_file
+    tf.inputs.dtype = dtype
+    if compresslevel is not None:
+        tf.inputs.compresslevel = compresslevel
+
+    array = tf._load(test_file)
+    assert array.dtype == np.dtype(dtype)
+    assert array.shape[0] == n_volumes
+
+    out_file = tf._dump(array)
+    if compresslevel == 0:
+        assert out_file.endswith(".nii")
+    else:
+        assert out_file.endswith(".nii.gz")
+
+    img = nib.load(out_file)
+    assert img.get_data_dtype() == np.dtype(dtype)
+
+    rtol = 1e-6 if dtype == "float32" else 1e-12
+    assert np.allclose(test_img_data, img.get_fdata(), rtol=rtol)
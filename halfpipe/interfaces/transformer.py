@@ -2,12 +2,22 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
+import gzip
 from pathlib import Path
 
 import nibabel as nib
 import numpy as np
 from nilearn.image import new_img_like
-from nipype.interfaces.base import File, SimpleInterface, TraitedSpec, isdefined
+from nipype.interfaces.base import (
+    DynamicTraitedSpec,
+    File,
+    SimpleInterface,
+    TraitedSpec,
+    Undefined,
+    isdefined,
+    traits,
+)
+from nipype.interfaces.io import add_traits
 
 from ..ingest.spreadsheet import read_spreadsheet
 from ..utils.image import nvol
@@ -18,6 +28,19 @@ class TransformerInputSpec(TraitedSpec):
     in_file = File(desc="File to filter", exists=True, mandatory=True)
     mask = File(desc="mask to use for volumes", exists=True)
 
+    dtype = traits.Enum(
+        "float64",
+        "float32",
+        usedefault=True,
+        desc="floating point type for the data in memory and in the output image",
+    )
+    compresslevel = traits.Range(
+        low=0,
+        high=9,
+        desc="gzip compression level for the output image, where zero means "
+        "that an uncompressed .nii file is written",
+    )
+
 
 class TransformerOutputSpec(TraitedSpec):
     out_file = File()
@@ -32,10 +55,36 @@ class Transformer(SimpleInterface):
     output_spec = TransformerOutputSpec
 
     suffix = "transformed"
+    squeeze = False  # write outputs with a single volume as 3d images
+
+    # whether `_transform` only depends on the inputs and the array, so that
+    # the transformer can be used as a step of a `TransformerChain`
+    chainable = False
 
     def _transform(self, _):
         raise NotImplementedError()
 
+    @staticmethod
+    def _load_mask(mask_file, in_img: nib.Nifti1Image) -> np.ndarray | None:
+        if (
+            isdefined(mask_file)
+            and isinstance(mask_file, str)
+            and Path(mask_file).is_file()
+        ):
+            mask_img = nib.squeeze_image(nib.load(mask_file))
+
+            assert nvol(mask_img) == 1
+            assert np.allclose(mask_img.affine, in_img.affine)
+
+            mask_fdata = mask_img.get_fdata(dtype=np.float64)
+            mask_bin = np.logical_not(
+                np.logical_or(mask_fdata <= 0, np.isclose(mask_fdata, 0, atol=1e-2))
+            )
+
+            return mask_bin
+
+        return None
+
     def _load(self, in_file, mask_file=None):
         stem, ext = split_ext(in_file)
         self.stem, self.ext = stem, ext
@@ -46,52 +95,31 @@ class Transformer(SimpleInterface):
         self.mask = None
 
         if ext in [".nii", ".nii.gz"]:
+            dtype = np.dtype(self.inputs.dtype)
 
             in_img = nib.load(in_file)
             self.in_img = in_img
 
-            ndim = np.asanyarray(in_img.dataobj).ndim
+            # read the data once, without caching it in the image object
+            in_data = np.asanyarray(in_img.dataobj)
+
+            ndim = in_data.ndim
             if ndim == 3:
-                volumes = [in_img]
-            elif ndim == 4:
-                volumes = nib.four_to_three(in_img)
-            else:
+                in_data = in_data[..., np.newaxis]
+            elif ndim != 4:
                 raise ValueError(
                     f'Unexpect number of dimensions {ndim:d} in "{in_file}"'
                 )
 
-            volume_shape = volumes[0].shape
-            n_voxels = np.prod(volume_shape)
-
-            if (
-                isdefined(mask_file)
-                and isinstance(mask_file, str)
-                and Path(mask_file).is_file()
-            ):
-                mask_img = nib.squeeze_image(nib.load(mask_file))
-
-                assert nvol(mask_img) == 1
-                assert np.allclose(mask_img.affine, in_img.affine)
-
-                mask_fdata = mask_img.get_fdata(dtype=np.float64)
-                mask_bin = np.logical_not(
-                    np.logical_or(mask_fdata <= 0, np.isclose(mask_fdata, 0, atol=1e-2))
-                )
-
-                self.mask = mask_bin
-                n_voxels = np.count_nonzero(mask_bin)
-
-            n_volumes = len(volumes)
+            self.mask = self._load_mask(mask_file, in_img)
 
-            array = np.zeros((n_volumes, n_voxels))
-
-            for i, volume in enumerate(volumes):
-                volume_data = volume.get_fdata()
+            if self.mask is not None:
+                voxel_data = in_data[self.mask, :]  # a single copy
+            else:
+                voxel_data = in_data.reshape((-1, in_data.shape[3]))
 
-                if self.mask is not None:
-                    array[i, :] = volume_data[self.mask]
-                else:
-                    array[i, :] = np.ravel(volume_data)
+            # volumes x voxels, which is a view of the voxels x volumes array
+            array = voxel_data.astype(dtype, copy=False).T
 
         else:  # a text file
             in_df = read_spreadsheet(in_file)
@@ -108,19 +136,36 @@ class Transformer(SimpleInterface):
 
         if ext in [".nii", ".nii.gz"]:
             in_img = self.in_img
+            dtype = np.dtype(self.inputs.dtype)
 
             if self.mask is not None:
                 _, n = array2.T.shape
-                out_array = np.zeros((*in_img.shape[:3], n))
+                out_array = np.zeros((*in_img.shape[:3], n), dtype=dtype)
                 out_array[self.mask, :] = array2.T
             else:
-                out_array = array2.T.reshape((*in_img.shape[:3], -1))
+                out_array = array2.T.reshape((*in_img.shape[:3], -1)).astype(
+                    dtype, copy=False
+                )
+
+            if self.squeeze is True and out_array.shape[3] == 1:
+                out_array = out_array[..., 0]
 
             out_img = new_img_like(in_img, out_array, copy_header=True)
             assert isinstance(out_img.header, nib.Nifti1Header)
 
-            out_img.header.set_data_dtype(np.float64)
-            nib.save(out_img, out_file)
+            out_img.header.set_data_dtype(dtype)
+
+            compresslevel = self.inputs.compresslevel
+            if not isdefined(compresslevel):
+                nib.save(out_img, out_file)
+            elif compresslevel == 0:
+                out_file = str(Path(f"{stem}_{self.suffix}.nii").resolve())
+                nib.save(out_img, out_file)
+            else:
+                out_file = str(Path(f"{stem}_{self.suffix}.nii.gz").resolve())
+                with gzip.open(out_file, "wb", compresslevel=compresslevel) as fileobj:
+                    file_map = {"image": nib.FileHolder(fileobj=fileobj)}
+                    out_img.to_file_map(file_map)
 
         else:
             in_df = self.in_df
@@ -144,3 +189,95 @@ class Transformer(SimpleInterface):
         self._results["out_file"] = out_file
 
         return runtime
+
+
+class TransformerChainInputSpec(DynamicTraitedSpec):
+    in_file = File(desc="File to filter", exists=True, mandatory=True)
+
+    step_names = traits.List(traits.Str, desc="names of the transformer classes")
+
+    dtype = traits.Enum(
+        "float64",
+        "float32",
+        usedefault=True,
+        desc="floating point type for the data in memory and in the output image",
+    )
+    compresslevel = traits.Range(
+        low=0,
+        high=9,
+        desc="gzip compression level for the output image, where zero means "
+        "that an uncompressed .nii file is written",
+    )
+
+
+class TransformerChain(Transformer):
+    """
+    Interface that applies a sequence of transformers to the data in memory,
+    so that only the output of the last one is written to disk. The inputs of
+    each transformer are available with the prefix `step1_`, `step2_` and so on.
+    Each step applies its own mask to the data and sets the voxels outside of
+    the mask to zero, so that the result is the same as running the
+    transformers one after the other
+    """
+
+    input_spec = TransformerChainInputSpec
+    output_spec = TransformerOutputSpec
+
+    chainable = True
+
+    def __init__(self, transformers: list[type[Transformer]] | None = None, **inputs):
+        super(TransformerChain, self).__init__(**inputs)
+
+        if transformers is None:
+            transformers = list()
+
+        self.transformers = transformers
+        self.inputs.step_names = [t.__name__ for t in transformers]
+
+        self.suffix = "_".join(t.suffix for t in transformers)
+
+        self.step_input_names: list[list[str]] = list()
+        for i, transformer in enumerate(transformers):
+            input_names = [
+                name
+                for name in transformer.input_spec().copyable_trait_names()
+                if name not in frozenset(["in_file", "dtype", "compresslevel"])
+            ]
+            self.step_input_names.append(input_names)
+
+            add_traits(self.inputs, [f"step{i + 1:d}_{name}" for name in input_names])
+
+    def step_inputs(self, i: int) -> dict:
+        inputs = dict()
+
+        for name in self.step_input_names[i]:
+            value = getattr(self.inputs, f"step{i + 1:d}_{name}")
+            if isdefined(value):
+                inputs[name] = value
+
+        return inputs
+
+    def _load(self, in_file, mask_file=None):
+        return super(TransformerChain, self)._load(in_file, mask_file=Undefined)
+
+    def _transform(self, array):
+        for i, transformer_class in enumerate(self.transformers):
+            transformer = transformer_class(
+                dtype=self.inputs.dtype, **self.step_inputs(i)
+            )
+
+            mask = None
+            if self.ext in [".nii", ".nii.gz"]:
+                mask = transformer._load_mask(transformer.inputs.mask, self.in_img)
+
+            if mask is None:
+                array = transformer._transform(array)
+                continue
+
+            mask = np.ravel(mask)  # same voxel order as in `_load`
+            array2 = transformer._transform(array[:, mask])
+
+            array = np.zeros((array2.shape[0], mask.size), dtype=array2.dtype)
+            array[:, mask] = array2
+
+        return array
@@ -94,6 +94,11 @@ class AtlasBasedConnectivityFeatureSchema(BaseFeatureSchema):
     min_region_coverage = fields.Float(
         dump_default=0.8, validate=validate.Range(min=0.0, max=1.0)
     )
+    output_format = fields.Str(
+        dump_default="tsv",
+        load_default="tsv",
+        validate=validate.OneOf(["tsv", "npz"]),
+    )
 
 
 class ReHoFeatureSchema(BaseFeatureSchema):
@@ -5,21 +5,33 @@
 import gc
 import multiprocessing as mp
 import os
+import sys
 from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from itertools import count
+from textwrap import indent
 from threading import Thread
+from time import monotonic
+from timeit import default_timer as timer
+from traceback import format_exception
 from typing import Any
 
+import numpy as np
 from matplotlib import pyplot as plt
 from nipype.pipeline import plugins as nip
+from nipype.pipeline.engine import MapNode
 from nipype.utils.profiler import get_system_total_memory_gb
 from stackprinter import format_current_exception
 
 from ..logging import logging_context
 from ..utils import logger
 from .reftracer import PathReferenceTracer
+from .scheduler import JobScheduler, job_key
 
+worker_node_config: dict = dict()
 
-def initializer(workdir, logging_args, plugin_args, host_env):
+
+def initializer(workdir, logging_args, plugin_args, host_env, node_config=None):
     from ..logging import setup as setup_logging
 
     setup_logging(**logging_args)
@@ -44,6 +56,36 @@ def initializer(workdir, logging_args, plugin_args, host_env):
 
     os.chdir(workdir)
 
+    if node_config is not None:
+        worker_node_config.update(node_config)
+
+
+def execute_node(node, updatehash, taskid) -> dict[str, Any]:
+    # Init variables
+    result: dict[str, Any] = dict(result=None, traceback=None, taskid=taskid)
+
+    # Restore the config that was removed before sending the node
+    if node.config is None and len(worker_node_config) > 0:
+        node.config = deepcopy(worker_node_config)
+
+    # Try and execute the node via node.run()
+    start = timer()
+    try:
+        result["result"] = node.run(updatehash=updatehash)
+    except Exception:  # catch all here
+        result["traceback"] = format_current_exception()
+        result["result"] = node.result
+    result["duration"] = timer() - start
+
+    return result
+
+
+def collect_garbage():
+    # Avoid matplotlib memory leak
+    if len(plt.get_fignums()) > 0:
+        plt.close("all")
+    gc.collect()
+
 
 # Run node
 def run_node(node, updatehash, taskid):
@@ -63,24 +105,26 @@ def run_node(node, updatehash, taskid):
         dictionary containing the node runtime results and stats
     """
 
-    # Init variables
-    result: dict[str, Any] = dict(result=None, traceback=None, taskid=taskid)
-
-    # Try and execute the node via node.run()
-    try:
-        result["result"] = node.run(updatehash=updatehash)
-    except Exception:  # catch all here
-        result["traceback"] = format_current_exception()
-        result["result"] = node.result
-
-    # Avoid matplotlib memory leak
-    plt.close("all")
-    gc.collect()
+    result = execute_node(node, updatehash, taskid)
+    collect_garbage()
 
     # Return the result dictionary
     return result
 
 
+def run_batch(nodes, updatehash, taskids) -> list[dict[str, Any]]:
+    """
+    Run multiple small nodes one after the other in the same worker, so that
+    the overhead of submitting and cleaning up is paid only once
+    """
+    results = [
+        execute_node(node, updatehash, taskid) for node, taskid in zip(nodes, taskids)
+    ]
+    collect_garbage()
+
+    return results
+
+
 class MultiProcPlugin(nip.MultiProcPlugin):
     def __init__(self, plugin_args: dict):
         # Init variables and instance attributes
@@ -110,6 +154,36 @@ class MultiProcPlugin(nip.MultiProcPlugin):
             self._cwd,
         )
 
+        # The pool is started on the first run, so that the workers can receive
+        # the node config in advance. If the plugin is persistent, the workers
+        # are kept for further runs until `shutdown` is called
+        self.pool: ProcessPoolExecutor | None = None
+        self._node_config: dict | None = None
+        self._persistent = plugin_args.get("persistent", False)
+
+        # Small nodes are submitted together
+        self._batch_size = plugin_args.get("batch_size", 16)
+        self._batch: list[tuple[Any, int]] = list()
+        self._batch_updatehash = False
+        self._batch_ids = count()
+        self._task_batches: dict[int, int] = dict()
+
+        self._stats = None
+        self._keep = plugin_args.get("keep", "all")
+
+        self._scheduler = JobScheduler(
+            small_job_seconds=plugin_args.get("small_job_seconds", 1.0)
+        )
+        self._task_keys: dict = dict()
+        self._summary_interval = plugin_args.get("summary_interval", 300.0)
+        self._summary_time = monotonic()
+
+    def _start_pool(self):
+        if self.pool is not None:
+            return
+
+        self._node_config = deepcopy(getattr(self, "_config", None))
+
         mp_context = mp.get_context("forkserver")  # force forkserver
         self.pool = ProcessPoolExecutor(
             max_workers=self.processors,
@@ -117,20 +191,40 @@ class MultiProcPlugin(nip.MultiProcPlugin):
             initargs=(
                 self._cwd,
                 logging_context.logging_args(),
-                plugin_args,
+                self.plugin_args,
                 dict(os.environ),
+                self._node_config,
             ),
             mp_context=mp_context,
         )
 
-        self._stats = None
-        self._keep = plugin_args.get("keep", "all")
+    def _prerun_check(self, graph):
+        super(MultiProcPlugin, self)._prerun_check(graph)
+
+        self._start_pool()
+
+        self._rt = None
         if self._keep != "all":
             self._rt = PathReferenceTracer(self._cwd)
 
+        self._scheduler.reset(self.memory_gb, self.processors)
+        self._summary_time = monotonic()
+
     def _postrun_check(self):
+        logger.info(f"[MultiProc] {self._scheduler.summary()}")
+
+        if not self._persistent:
+            self.shutdown()
+
+    def shutdown(self):
+        if self.pool is None:
+            return
+
+        pool = self.pool
+        self.pool = None
+
         shutdown_thread = Thread(
-            target=self.pool.shutdown, kwargs=dict(wait=True), daemon=True
+            target=pool.shutdown, kwargs=dict(wait=True), daemon=True
         )
         shutdown_thread.start()
         shutdown_thread.join(timeout=10)
@@ -140,21 +234,113 @@ class MultiProcPlugin(nip.MultiProcPlugin):
                 "when the program closes. These error messages can usually be ignored"
             )
 
-    def _submit_job(self, node, updatehash=False):
+    def _prepare_node(self, node) -> int:
         self._taskid += 1
 
         # Don't allow streaming outputs
         if getattr(node.interface, "terminal_output", "") == "stream":
             node.interface.terminal_output = "allatonce"
 
-        result_future = self.pool.submit(run_node, node, updatehash, self._taskid)
+        self._task_keys[self._taskid] = (job_key(node), node.n_procs, node.mem_gb)
+
+        # The workers already have the config, so we do not need to send it
+        if self._node_config is not None and node.config == self._node_config:
+            node.config = None
+
+        return self._taskid
+
+    def _submit_job(self, node, updatehash=False):
+        taskid = self._prepare_node(node)
+
+        assert self.pool is not None
+        result_future = self.pool.submit(run_node, node, updatehash, taskid)
         result_future.add_done_callback(self._async_callback)
-        self._task_obj[self._taskid] = result_future
+        self._task_obj[taskid] = result_future
 
         logger.debug(
-            "[MultiProc] Submitted task %s (taskid=%d).", node.fullname, self._taskid
+            "[MultiProc] Submitted task %s (taskid=%d).", node.fullname, taskid
         )
-        return self._taskid
+        return taskid
+
+    def _add_to_batch(self, node, updatehash=False):
+        taskid = self._prepare_node(node)
+
+        self._batch.append((node, taskid))
+        self._batch_updatehash = updatehash
+
+        logger.debug(
+            "[MultiProc] Added task %s to batch (taskid=%d).", node.fullname, taskid
+        )
+        return taskid
+
+    def _submit_batch(self):
+        if len(self._batch) == 0:
+            return
+
+        nodes, taskids = map(list, zip(*self._batch))
+        self._batch.clear()
+
+        assert self.pool is not None
+        result_future = self.pool.submit(
+            run_batch, nodes, self._batch_updatehash, taskids
+        )
+        result_future.add_done_callback(self._async_callback)
+
+        batch_id = next(self._batch_ids)
+        for taskid in taskids:
+            self._task_obj[taskid] = result_future
+            self._task_batches[taskid] = batch_id
+
+        logger.debug(
+            "[MultiProc] Submitted batch of %d tasks (taskids=%s).",
+            len(taskids),
+            taskids,
+        )
+
+    def _clear_task(self, taskid):
+        super(MultiProcPlugin, self)._clear_task(taskid)
+        self._task_batches.pop(taskid, None)
+
+    def _is_small(self, jobid) -> bool:
+        assert self.procs is not None
+
+        node = self.procs[jobid]
+        if self._batch_size <= 1 or node.n_procs > 1:
+            return False
+        if isinstance(node, MapNode) or node.run_without_submitting:
+            return False
+        return self._scheduler.is_small(job_key(node))
+
+    def _check_resources(self, running_tasks):
+        """
+        The tasks of a batch run one after the other, so they only use the
+        resources of one task
+        """
+        assert self.procs is not None
+
+        batch_resources: dict[int, tuple[float, int]] = dict()
+        task_resources: list[tuple[float, int]] = list()
+        for taskid, jobid in running_tasks:
+            resources = (self.procs[jobid].mem_gb, self.procs[jobid].n_procs)
+
+            batch_id = self._task_batches.get(taskid)
+            if batch_id is None:
+                task_resources.append(resources)
+                continue
+
+            mem_gb, n_procs = batch_resources.get(batch_id, (0.0, 0))
+            batch_resources[batch_id] = (
+                max(mem_gb, resources[0]),
+                max(n_procs, resources[1]),
+            )
+
+        free_memory_gb = self.memory_gb
+        free_processors = self.processors
+        for mem_gb, n_procs in [*task_resources, *batch_resources.values()]:
+            free_memory_gb -= min(mem_gb, free_memory_gb)
+            free_processors -= min(n_procs, free_processors)
+
+        return free_memory_gb, free_processors
 
     def _generate_dependency_list(self, graph):
         if self._rt is not None:
@@ -163,6 +349,190 @@ class MultiProcPlugin(nip.MultiProcPlugin):
             for node in graph.nodes:
                 self._rt.set_node_pending(node)
         super(MultiProcPlugin, self)._generate_dependency_list(graph)
+        self._scheduler.add_graph(graph, self.procs)
+
+    def _submit_mapnode(self, jobid):
+        assert self.procs is not None
+
+        count = len(self.procs)
+        submit = super(MultiProcPlugin, self)._submit_mapnode(jobid)
+        self._scheduler.add_subnodes(jobid, len(self.procs) - count)
+        return submit
+
+    def _sort_jobs(self, jobids, scheduler="priority"):
+        if scheduler is not None and scheduler != "priority":
+            return super(MultiProcPlugin, self)._sort_jobs(jobids, scheduler=scheduler)
+
+        assert self.procs is not None
+
+        for jobid in jobids:
+            self._scheduler.update_estimate(self.procs[jobid])
+        return self._scheduler.sort(jobids, self.procs)
+
+    def _send_procs_to_workers(self, updatehash=False, graph=None):
+        """
+        Sends jobs to workers when system resources are available. Adapted
+        from nipype to keep track of how long jobs wait, and to submit small
+        jobs in batches that only take up the resources of one job
+        """
+        assert self.procs is not None
+
+        # Check to see if a job is available (jobs with all dependencies run)
+        jobids = np.flatnonzero(
+            ~self.proc_done & (self.depidx.sum(axis=0) == 0).__array__()
+        )
+        self._scheduler.mark_ready(jobids)
+
+        # Check available resources by summing all threads and memory used
+        free_memory_gb, free_processors = self._check_resources(self.pending_tasks)
+
+        stats = (
+            len(self.pending_tasks),
+            len(jobids),
+            free_memory_gb,
+            self.memory_gb,
+            free_processors,
+            self.processors,
+        )
+        if self._stats != stats:
+            tasks_list_msg = ""
+            running_tasks = [
+                f"  * {self.procs[jobid].fullname}" for _, jobid in self.pending_tasks
+            ]
+            if running_tasks:
+                tasks_list_msg = "\nCurrently running:\n"
+                tasks_list_msg += "\n".join(running_tasks)
+                tasks_list_msg = indent(tasks_list_msg, " " * 21)
+            logger.info(
+                "[MultiProc] Running %d tasks, and %d jobs ready. Free "
+                "memory (GB): %0.2f/%0.2f, Free processors: %d/%d.%s",
+                *stats,
+                tasks_list_msg,
+            )
+            self._stats = stats
+
+        if monotonic() - self._summary_time > self._summary_interval:
+            logger.info(f"[MultiProc] {self._scheduler.summary()}")
+            self._summary_time = monotonic()
+
+        if free_memory_gb < 0.01 or free_processors == 0:
+            logger.debug("No resources available")
+            return
+
+        if len(jobids) + len(self.pending_tasks) == 0:
+            logger.debug(
+                "No tasks are being run, and no jobs can "
+                "be submitted to the queue. Potential deadlock"
+            )
+            return
+
+        jobids = self._sort_jobs(jobids, scheduler=self.plugin_args.get("scheduler"))
+
+        # Resources that are taken up by the current batch
+        batch_gb = 0.0
+        batch_th = 0
+
+        # Submit jobs
+        for jobid in jobids:
+            # First expand mapnodes
+            if isinstance(self.procs[jobid], MapNode):
+                try:
+                    num_subnodes = self.procs[jobid].num_subnodes()
+                except Exception:
+                    traceback = format_exception(*sys.exc_info())
+                    self._clean_queue(
+                        jobid, graph, result={"result": None, "traceback": traceback}
+                    )
+                    self.proc_pending[jobid] = False
+                    continue
+                if num_subnodes > 1:
+                    submit = self._submit_mapnode(jobid)
+                    if not submit:
+                        continue
+
+            # Check requirements of this job
+            next_job_gb = min(self.procs[jobid].mem_gb, self.memory_gb)
+            next_job_th = min(self.procs[jobid].n_procs, self.processors)
+
+            is_small = self._is_small(jobid)
+            if is_small:  # only needs what the batch does not have yet
+                next_job_gb = max(0.0, next_job_gb - batch_gb)
+                next_job_th = max(0, next_job_th - batch_th)
+
+            # If node does not fit, skip at this moment
+            if next_job_th > free_processors or next_job_gb > free_memory_gb:
+                logger.debug(
+                    "Cannot allocate job %d (%0.2fGB, %d threads).",
+                    jobid,
+                    next_job_gb,
+                    next_job_th,
+                )
+                continue
+
+            free_memory_gb -= next_job_gb
+            free_processors -= next_job_th
+            logger.debug(
+                "Allocating %s ID=%d (%0.2fGB, %d threads). Free: "
+                "%0.2fGB, %d threads.",
+                self.procs[jobid].fullname,
+                jobid,
+                next_job_gb,
+                next_job_th,
+                free_memory_gb,
+                free_processors,
+            )
+
+            # change job status in appropriate queues
+            self.proc_done[jobid] = True
+            self.proc_pending[jobid] = True
+            self._scheduler.mark_started([jobid])
+
+            # If cached and up-to-date just retrieve it, don't run
+            if self._local_hash_check(jobid, graph):
+                continue
+
+            # updatehash and run_without_submitting are also run locally
+            if updatehash or self.procs[jobid].run_without_submitting:
+                logger.debug("Running node %s on master thread", self.procs[jobid])
+                try:
+                    self.procs[jobid].run(updatehash=updatehash)
+                except Exception:
+                    traceback = format_exception(*sys.exc_info())
+                    self._clean_queue(
+                        jobid, graph, result={"result": None, "traceback": traceback}
+                    )
+
+                # Release resources
+                self._task_finished_cb(jobid)
+                self._remove_node_dirs()
+                free_memory_gb += next_job_gb
+                free_processors += next_job_th
+                # Display stats next loop
+                self._stats = None
+                continue
+
+            # Task should be submitted to workers
+            # Send job to task manager and add to pending tasks
+            if self._status_callback:
+                self._status_callback(self.procs[jobid], "start")
+
+            node = deepcopy(self.procs[jobid])
+            if is_small:
+                tid = self._add_to_batch(node, updatehash=updatehash)
+                batch_gb += next_job_gb
+                batch_th += next_job_th
+                if len(self._batch) >= self._batch_size:
+                    self._submit_batch()
+                    batch_gb = 0.0
+                    batch_th = 0
+            else:
+                tid = self._submit_job(node, updatehash=updatehash)
+
+            self.pending_tasks.insert(0, (tid, jobid))
+            # Display stats next loop
+            self._stats = None
+
+        self._submit_batch()
 
     def _task_finished_cb(self, jobid, cached=False):
         assert self.procs is not None
@@ -183,8 +553,21 @@ class MultiProcPlugin(nip.MultiProcPlugin):
         assert self.procs is not None
 
         try:
-            result = args.result()
-            self._taskresult[result["taskid"]] = result
+            results = args.result()
+            if isinstance(results, dict):
+                results = [results]
+
+            for result in results:
+                self._taskresult[result["taskid"]] = result
+
+                key, n_procs, mem_gb = self._task_keys.pop(result["taskid"])
+                self._scheduler.observe(
+                    key,
+                    result["duration"],
+                    runtime=getattr(result["result"], "runtime", None),
+                    n_procs=n_procs,
+                    mem_gb=mem_gb,
+                )
         except Exception as e:
             running_tasks = [
                 self.procs[jobid].fullname for _, jobid in self.pending_tasks
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import re
+from math import inf
+from time import monotonic
+from typing import Iterable, Sequence
+
+import networkx as nx
+
+subject_pattern = re.compile(
+    r"(?:^|\.)single_subject_(?P<subjectname>[^.]+)_wf(?:\.|$)"
+)
+
+
+def extract_subject(node) -> str | None:
+    fullname = getattr(node, "fullname", None)
+    if not isinstance(fullname, str):
+        return None
+    m = subject_pattern.search(fullname)
+    if m is not None:
+        return m.group("subjectname")
+    return None
+
+
+def job_key(node) -> str:
+    """
+    Nodes with the same key are expected to use similar resources, for example
+    the same node of different subjects or the sub-nodes of a map node
+    """
+    name = re.sub(r"\d+$", "", node.name)
+    return f"{type(node.interface).__name__}.{name}"
+
+
+def critical_path_lengths(graph: nx.DiGraph, procs: Sequence) -> list[int]:
+    """
+    Number of nodes on the longest path from each node to the end of the graph
+    """
+    index = {node: i for i, node in enumerate(procs)}
+
+    lengths = [1] * len(procs)
+    for node in reversed(list(nx.topological_sort(graph))):
+        i = index[node]
+        for successor in graph.successors(node):
+            lengths[i] = max(lengths[i], lengths[index[successor]] + 1)
+
+    return lengths
+
+
+class JobScheduler:
+    """
+    Decides in which order the plugin tries to submit the jobs that are ready
+    to run. Jobs of subjects that are already in progress come first, so that
+    their working directories can be cleaned up sooner. Within a subject, jobs
+    on longer critical paths come first, and larger jobs come before smaller
+    ones so that they are packed first. Also remembers how long similar jobs
+    took, and keeps the metrics for queue wait and utilization
+    """
+
+    def __init__(self, small_job_seconds: float = 1.0) -> None:
+        self.small_job_seconds = small_job_seconds
+
+        # estimates are kept between runs
+        self.peak_mem_gb: dict[str, float] = dict()
+        self.max_duration: dict[str, float] = dict()
+
+        self.reset()
+
+    def reset(self, total_memory_gb: float = 0.0, total_processors: int = 0) -> None:
+        self.critical_paths: list[int] = list()
+        self.subjects: list[str | None] = list()
+
+        self.subject_ranks: dict[str, int] = dict()
+
+        self.ready_since: dict[int, float] = dict()
+        self.started_count = 0
+        self.queue_wait_sum = 0.0
+        self.queue_wait_max = 0.0
+
+        self.start_time = monotonic()
+        self.total_memory_gb = total_memory_gb
+        self.total_processors = total_processors
+        self.processor_seconds = 0.0
+        self.memory_gb_seconds = 0.0
+
+    def add_graph(self, graph: nx.DiGraph, procs: Sequence) -> None:
+        self.critical_paths = critical_path_lengths(graph, procs)
+        self.subjects = [extract_subject(node) for node in procs]
+
+    def add_subnodes(self, parent: int, count: int) -> None:
+        """
+        Sub-nodes of a map node need to run before their parent
+        """
+        self.critical_paths.extend([self.critical_paths[parent] + 1] * count)
+        self.subjects.extend([self.subjects[parent]] * count)
+
+    def subject_rank(self, jobid: int) -> float:
+        subject = self.subjects[jobid]
+        if subject is None:
+            return -1  # jobs of the group level
+        return self.subject_ranks.get(subject, inf)
+
+    def sort(self, jobids: Iterable[int], procs: Sequence) -> list[int]:
+        return sorted(
+            jobids,
+            key=lambda jobid: (
+                self.subject_rank(jobid),
+                -self.critical_paths[jobid],
+                -procs[jobid].mem_gb,
+                -procs[jobid].n_procs,
+                jobid,
+            ),
+        )
+
+    def observe(
+        self,
+        key: str,
+        duration: float,
+        runtime=None,
+        n_procs: int = 1,
+        mem_gb: float = 0.0,
+    ) -> None:
+        """
+        Remember how long a job took and its peak memory usage from the
+        resource monitor
+        """
+        self.max_duration[key] = max(self.max_duration.get(key, 0.0), duration)
+
+        self.processor_seconds += duration * n_procs
+        self.memory_gb_seconds += duration * mem_gb
+
+        mem_peak_gb = getattr(runtime, "mem_peak_gb", None)
+        if isinstance(mem_peak_gb, float):
+            self.peak_mem_gb[key] = max(self.peak_mem_gb.get(key, 0.0), mem_peak_gb)
+
+    def is_small(self, key: str) -> bool:
+        """
+        Whether similar nodes have always finished quickly
+        """
+        duration = self.max_duration.get(key)
+        if duration is None:
+            return False
+        return duration < self.small_job_seconds
+
+    def update_estimate(self, node) -> None:
+        """
+        Raise the memory estimate of a node if a similar node used more
+        """
+        mem_peak_gb = self.peak_mem_gb.get(job_key(node))
+        if mem_peak_gb is not None and mem_peak_gb > node.mem_gb:
+            node._mem_gb = mem_peak_gb
+
+    def mark_ready(self, jobids: Iterable[int], now: float | None = None) -> None:
+        if now is None:
+            now = monotonic()
+        for jobid in jobids:
+            self.ready_since.setdefault(jobid, now)
+
+    def mark_started(self, jobids: Iterable[int], now: float | None = None) -> None:
+        if now is None:
+            now = monotonic()
+        for jobid in jobids:
+            ready_since = self.ready_since.pop(jobid, None)
+            if ready_since is None:
+                continue
+
+            queue_wait = now - ready_since
+            self.started_count += 1
+            self.queue_wait_sum += queue_wait
+            self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+
+            subject = self.subjects[jobid]
+            if subject is not None and subject not in self.subject_ranks:
+                self.subject_ranks[subject] = len(self.subject_ranks)
+
+    def utilization(self, now: float | None = None) -> tuple[float, float]:
+        """
+        Fraction of processors and memory that were used by jobs while running
+        """
+        if now is None:
+            now = monotonic()
+
+        duration = now - self.start_time
+        if duration <= 0:
+            return 0.0, 0.0
+
+        processors, memory = 0.0, 0.0
+        if self.total_processors > 0:
+            processors = self.processor_seconds / (duration * self.total_processors)
+        if self.total_memory_gb > 0:
+            memory = self.memory_gb_seconds / (duration * self.total_memory_gb)
+        return processors, memory
+
+    def summary(self, now: float | None = None) -> str:
+        mean_queue_wait = 0.0
+        if self.started_count > 0:
+            mean_queue_wait = self.queue_wait_sum / self.started_count
+
+        processors, memory = self.utilization(now)
+
+        return (
+            f"Started {self.started_count:d} jobs with a queue wait of "
+            f"{mean_queue_wait:.1f} seconds on average and {self.queue_wait_max:.1f} "
+            f"seconds at most. Utilization was {processors:.0%} of processors "
+            f"and {memory:.0%} of memory"
+        )
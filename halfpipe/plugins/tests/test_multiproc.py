@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+from pathlib import Path
+from timeit import default_timer as timer
+
+import pytest
+from nipype.interfaces import utility as niu
+from nipype.pipeline import engine as pe
+from nipype.utils.filemanip import loadpkl
+
+from ...utils import logger
+from ..multiproc import MultiProcPlugin
+
+
+def add_one(x):
+    return x + 1
+
+
+def make_workflow(workdir: Path, name: str, n: int) -> pe.Workflow:
+    workflow = pe.Workflow(name=name, base_dir=str(workdir))
+    workflow.config["execution"]["poll_sleep_duration"] = 0.1
+
+    for i in range(n):
+        node = pe.Node(
+            niu.Function(input_names=["x"], output_names=["y"], function=add_one),
+            name=f"add_one{i:d}",
+        )
+        node.inputs.x = i
+        workflow.add_nodes([node])
+
+    return workflow
+
+
+def measure_task_overhead(workdir: Path, batch_size: int, n: int = 128) -> float:
+    plugin = MultiProcPlugin(
+        dict(
+            workdir=str(workdir),
+            n_procs=2,
+            memory_gb=4,
+            persistent=True,
+            batch_size=batch_size,
+        )
+    )
+
+    try:
+        # first run to start the workers and to learn that the nodes are small
+        make_workflow(workdir, "warmup", 4).run(plugin=plugin)
+
+        workflow = make_workflow(workdir, "benchmark", n)
+        start = timer()
+        workflow.run(plugin=plugin)
+        duration = timer() - start
+    finally:
+        plugin.shutdown()
+
+    result = loadpkl(workdir / "benchmark" / "add_one7" / "result_add_one7.pklz")
+    assert result.outputs.y == 8
+
+    return duration / n
+
+
+@pytest.mark.slow
+@pytest.mark.timeout(600)
+def test_multiproc_task_overhead_benchmark(tmp_path: Path):
+    unbatched_dir = tmp_path / "unbatched"
+    unbatched_dir.mkdir()
+    unbatched_overhead = measure_task_overhead(unbatched_dir, batch_size=1)
+
+    batched_dir = tmp_path / "batched"
+    batched_dir.mkdir()
+    batched_overhead = measure_task_overhead(batched_dir, batch_size=16)
+
+    # timings depend on the machine, so they are only reported
+    logger.info(
+        f"Task overhead was {unbatched_overhead * 1e3:.1f} ms without batching "
+        f"and {batched_overhead * 1e3:.1f} ms with batching"
+    )
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+from dataclasses import dataclass, field
+
+import networkx as nx
+import pytest
+
+from ..scheduler import JobScheduler, critical_path_lengths, extract_subject, job_key
+
+
+class MockInterface:
+    pass
+
+
+@dataclass(eq=False)
+class MockNode:
+    fullname: str
+    _mem_gb: float = 0.2
+    n_procs: int = 1
+    interface: MockInterface = field(default_factory=MockInterface)
+
+    @property
+    def mem_gb(self) -> float:
+        return self._mem_gb
+
+    @property
+    def name(self) -> str:
+        return self.fullname.split(".")[-1]
+
+
+def make_graph() -> tuple[nx.DiGraph, list[MockNode]]:
+    graph = nx.DiGraph()
+    procs: list[MockNode] = list()
+    for subject in ["01", "02"]:
+        prefix = f"nipype_wf.single_subject_{subject}_wf"
+        a = MockNode(f"{prefix}.a")
+        b = MockNode(f"{prefix}.b", _mem_gb=4.0)
+        c = MockNode(f"{prefix}.c")
+        d = MockNode(f"{prefix}.d")
+        graph.add_edges_from([(a, c), (c, d), (b, d)])
+        procs.extend([a, b, c, d])
+    return graph, procs
+
+
+def test_critical_path_lengths():
+    graph, procs = make_graph()
+    assert critical_path_lengths(graph, procs) == [3, 2, 2, 1] * 2
+
+
+def test_extract_subject():
+    node = MockNode("nipype_wf.single_subject_01_wf.func_preproc_wf.a")
+    assert extract_subject(node) == "01"
+    assert extract_subject(MockNode("nipype_wf.models_wf.a")) is None
+    assert job_key(MockNode("a.b.merge12")) == "MockInterface.merge"
+
+
+def test_job_scheduler_sort():
+    graph, procs = make_graph()
+
+    scheduler = JobScheduler()
+    scheduler.add_graph(graph, procs)
+
+    # critical path first, then larger jobs first
+    assert scheduler.sort([0, 1, 4, 5], procs) == [0, 4, 1, 5]
+
+    # prefer subjects that are already in progress
+    scheduler.mark_ready([5], now=0.0)
+    scheduler.mark_started([5], now=1.0)
+    assert scheduler.sort([0, 1, 4, 5], procs) == [4, 5, 0, 1]
+
+    scheduler.add_subnodes(6, 2)
+    assert scheduler.critical_paths[-2:] == [3, 3]
+    assert scheduler.subjects[-2:] == ["02", "02"]
+
+
+def test_job_scheduler_estimate():
+    node = MockNode("nipype_wf.single_subject_01_wf.merge")
+    key = job_key(node)
+
+    scheduler = JobScheduler(small_job_seconds=1.0)
+    assert not scheduler.is_small(key)
+
+    scheduler.observe(key, 0.5, runtime=object())  # no resource monitor
+    scheduler.update_estimate(node)
+    assert node.mem_gb == pytest.approx(0.2)
+    assert scheduler.is_small(key)
+
+    @dataclass
+    class Runtime:
+        mem_peak_gb: float
+
+    scheduler.observe(key, 2.0, runtime=Runtime(3.0))
+    scheduler.observe(key, 0.5, runtime=Runtime(2.0))
+    scheduler.update_estimate(node)
+    assert node.mem_gb == pytest.approx(3.0)
+    assert not scheduler.is_small(key)
+
+
+def test_job_scheduler_metrics():
+    scheduler = JobScheduler()
+    scheduler.reset(total_memory_gb=16.0, total_processors=4)
+    scheduler.subjects = [None, None]
+
+    scheduler.mark_ready([0, 1], now=0.0)
+    scheduler.mark_ready([0], now=5.0)  # still the same wait
+    scheduler.mark_started([0], now=10.0)
+    scheduler.mark_started([1], now=20.0)
+
+    assert scheduler.started_count == 2
+    assert scheduler.queue_wait_max == pytest.approx(20.0)
+
+    scheduler.start_time = 0.0
+    scheduler.observe("a", 10.0, n_procs=2, mem_gb=8.0)
+    scheduler.observe("b", 20.0, n_procs=2, mem_gb=4.0)
+    processors, memory = scheduler.utilization(now=20.0)
+    assert processors == pytest.approx(0.75)
+    assert memory == pytest.approx(0.5)
+
+    summary = scheduler.summary(now=20.0)
+    assert "15.0 seconds on average" in summary
+    assert "75% of processors" in summary
@@ -138,5 +138,8 @@ def save_images(results: list[ResultDict], base_directory: Path):
 
             _, extension = split_ext(outpath)
             if key in ["effect", "reho", "falff", "alff", "bold", "timeseries"]:
-                if extension in [".nii", ".nii.gz", ".tsv"]:  # add sidecar
+                if extension in [".nii", ".nii.gz", ".tsv", ".npz"]:  # add sidecar
+                    save_sidecar(outpath, metadata, vals)
+            elif key in ["covariance_matrix", "correlation_matrix"]:
+                if extension == ".npz":  # text files are written without sidecar
                     save_sidecar(outpath, metadata, vals)
@@ -5,7 +5,10 @@
 from pathlib import Path
 from unittest import TestCase
 
+import numpy as np
+
 from ....file_index.bids import BIDSIndex
+from ....utils.matrix import load_matrix, save_matrix
 from ...base import ResultDict
 from ..images import load_images, save_images
 
@@ -51,3 +54,50 @@ def test_images(tmp_path: Path):
     test_case.assertDictEqual(result["vals"], actual["vals"])
     test_case.assertDictEqual(result["metadata"], actual["metadata"])
     assert result["images"].keys() == actual["images"].keys()
+
+
+def test_images_matrix(tmp_path: Path):
+    np.random.seed(0)
+
+    time_series = np.random.rand(100, 10)
+    correlation_matrix = np.corrcoef(time_series.T)
+    correlation_matrix = (correlation_matrix + correlation_matrix.T) / 2
+
+    time_series_path = tmp_path / "timeseries.npz"
+    save_matrix(time_series_path, time_series)
+    correlation_matrix_path = tmp_path / "correlation.npz"
+    save_matrix(correlation_matrix_path, correlation_matrix, symmetric=True)
+
+    result: ResultDict = {
+        "tags": {
+            "task": "rest",
+            "feature": "corrMatrix1",
+            "atlas": "schaefer2018",
+            "sub": "01",
+        },
+        "images": {
+            "timeseries": time_series_path,
+            "correlation_matrix": correlation_matrix_path,
+        },
+        "vals": {
+            "dummy_scans": 0,
+        },
+        "metadata": {
+            "acquisition_orientation": "LAS",
+        },
+    }
+
+    save_images([result], tmp_path)
+
+    index = BIDSIndex()
+    index.put(tmp_path / "derivatives" / "halfpipe")
+
+    (actual,) = load_images(index)
+
+    assert result["images"].keys() == actual["images"].keys()
+    assert result["vals"] == actual["vals"]
+    assert result["metadata"] == actual["metadata"]
+    assert np.array_equal(load_matrix(actual["images"]["timeseries"]), time_series)
+    assert np.array_equal(
+        load_matrix(actual["images"]["correlation_matrix"]), correlation_matrix
+    )
@@ -3,14 +3,54 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 from abc import ABC, abstractmethod
+from functools import cached_property
 from pathlib import Path
 from typing import Dict, Generator, List, Optional, Tuple
 
 import nibabel as nib
 import numpy as np
-import pandas as pd
 from nilearn.image import new_img_like
 
+# results are stored per contrast, or with `None` for model outputs
+ResultKey = Tuple[Optional[str], str]
+
+
+class PatternDesign:
+    """
+    Design matrix for all voxels that have the same subjects available. The
+    derived matrices are calculated on first access, so that they only need
+    to be calculated once per pattern instead of once per voxel
+    """
+
+    def __init__(self, z: np.ndarray, available: np.ndarray):
+        self.z = z
+        self.available = available
+
+    @property
+    def npts(self) -> int:
+        return int(np.count_nonzero(self.available))
+
+    @cached_property
+    def filtered_z(self) -> np.ndarray:
+        # filtering for design matrix is already done
+        # the nans that are left should be replaced with zeros
+        return np.nan_to_num(self.z)[self.available, :]
+
+    @cached_property
+    def demeaned_z(self) -> np.ndarray:
+        return demean(self.filtered_z)
+
+    @cached_property
+    def outer_products(self) -> np.ndarray:
+        """
+        Outer products of the rows of the demeaned design matrix with shape
+        (npts, p * p), so that z.T @ diag(w) @ z can be calculated for many
+        voxels with a single matrix product
+        """
+        z = self.demeaned_z
+        n, p = z.shape
+        return (z[:, :, np.newaxis] * z[:, np.newaxis, :]).reshape(n, p * p)
+
 
 class ModelAlgorithm(ABC):
     model_outputs: List[str] = list()
@@ -27,29 +67,78 @@ class ModelAlgorithm(ABC):
     ) -> Optional[Dict]:
         raise NotImplementedError()
 
+    @classmethod
+    @abstractmethod
+    def output_shapes(cls, cmatdict: Dict) -> Dict[ResultKey, Tuple[int, ...]]:
+        """
+        Shape of the result for a single voxel for each output map, so that
+        we can allocate the result arrays before running the algorithm
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def chunk_calc(
+        cls,
+        coordinates: List[Tuple[int, int, int]],
+        y: np.ndarray,
+        s: np.ndarray,
+        design: PatternDesign,
+        cmatdict: Dict,
+        arrays: Dict[ResultKey, np.ndarray],
+    ) -> None:
+        """
+        Calculate results for a chunk of voxels that share the same pattern of
+        available subjects, where `y` and `s` have one column per coordinate,
+        and write them to the corresponding rows of the result arrays. The
+        default implementation loops over the voxels, algorithms that can be
+        vectorized should override this
+        """
+        for i, coordinate in enumerate(coordinates):
+            voxel_result = cls.voxel_calc(
+                coordinate,
+                y[:, i, np.newaxis].copy(),
+                design.z,
+                s[:, i, np.newaxis].copy(),
+                cmatdict,
+            )
+
+            if voxel_result is None:
+                continue
+
+            for (contrast_name, map_name), array in arrays.items():
+                if contrast_name is None:
+                    results = voxel_result
+                else:
+                    results = voxel_result.get(contrast_name)
+
+                if results is None or coordinate not in results:
+                    continue
+
+                voxel_dict = results[coordinate]
+                if map_name not in voxel_dict:
+                    continue
+
+                array[i] = np.reshape(voxel_dict[map_name], array.shape[1:])
+
     @staticmethod
     @abstractmethod
     def write_outputs(
-        ref_img: nib.Nifti1Image, cmatdict: Dict, voxel_results: Dict
+        ref_img: nib.Nifti1Image,
+        cmatdict: Dict,
+        coordinates: np.ndarray,
+        arrays: Dict[ResultKey, np.ndarray],
     ) -> Dict:
         raise NotImplementedError()
 
     @classmethod
-    def write_map(cls, ref_img: nib.Nifti1Image, out_name: str, series: pd.Series):
-        coordinates = series.index.tolist()
-        values = series.values
-
-        shape: List[int] = list(ref_img.shape[:3])
-
-        (k,) = set(
-            (1,)
-            if isinstance(value, (int, float))
-            else (len(value),)
-            if isinstance(value, (list, tuple))
-            else value.shape
-            for value in values
-        )
-        shape.extend(k)
+    def write_map(
+        cls,
+        ref_img: nib.Nifti1Image,
+        out_name: str,
+        coordinates: np.ndarray,
+        values: np.ndarray,
+    ):
+        shape: List[int] = [*ref_img.shape[:3], *values.shape[1:]]
 
         if len(shape) == 4 and shape[-1] == 1:
             shape = shape[:3]  # squeeze
@@ -60,8 +149,7 @@ class ModelAlgorithm(ABC):
         else:
             arr = np.full(shape, np.nan, dtype=np.float64)
 
-        for coordinate, value in zip(coordinates, values):
-            arr[coordinate] = value
+        arr[tuple(coordinates.T)] = np.reshape(values, (-1, *shape[3:]))
 
         img = new_img_like(ref_img, arr, copy_header=True)
         assert isinstance(img.header, nib.Nifti1Header)
@@ -73,6 +161,69 @@ class ModelAlgorithm(ABC):
         return fname
 
 
+class PatternAlgorithm(ModelAlgorithm):
+    """
+    Algorithm whose results only depend on which subjects are available for
+    a voxel and not on the voxel values. The results are calculated for all
+    patterns at once and then broadcast to the voxels
+    """
+
+    @classmethod
+    @abstractmethod
+    def pattern_calc(
+        cls, patterns: np.ndarray, z: np.ndarray, cmatdict: Dict
+    ) -> Dict[ResultKey, np.ndarray]:
+        """
+        Calculate the results for a boolean array of patterns with one row per
+        pattern and one column per subject. Returns arrays with one row per
+        pattern, where rows that have no result are NaN
+        """
+        raise NotImplementedError()
+
+    @classmethod
+    def voxel_calc(
+        cls,
+        coordinate: Tuple[int, int, int],
+        y: np.ndarray,
+        z: np.ndarray,
+        s: np.ndarray,
+        cmatdict: Dict,
+    ) -> Optional[Dict]:
+        available = np.logical_and(np.isfinite(y), np.isfinite(s)).ravel()
+        pattern_result = cls.pattern_calc(available[np.newaxis, :], z, cmatdict)
+
+        voxel_result: Dict = dict()
+        for (contrast_name, map_name), values in pattern_result.items():
+            if np.all(np.isnan(values[0])):
+                continue
+
+            if contrast_name is None:
+                results = voxel_result
+            else:
+                results = voxel_result.setdefault(contrast_name, dict())
+
+            results.setdefault(coordinate, dict())[map_name] = values[0]
+
+        return voxel_result
+
+    @classmethod
+    def chunk_calc(
+        cls,
+        coordinates: List[Tuple[int, int, int]],
+        y: np.ndarray,
+        s: np.ndarray,
+        design: PatternDesign,
+        cmatdict: Dict,
+        arrays: Dict[ResultKey, np.ndarray],
+    ) -> None:
+        pattern_result = cls.pattern_calc(
+            design.available[np.newaxis, :], design.z, cmatdict
+        )
+
+        for key, array in arrays.items():
+            array[:] = pattern_result[key][0]
+
+
 def listwise_deletion(*args: np.ndarray) -> Generator[np.ndarray, None, None]:
     available = np.all(np.concatenate([np.isfinite(a) for a in args], axis=1), axis=1)
 
@@ -2,79 +2,93 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
-from collections import defaultdict
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Tuple, Union
 
 import nibabel as nib
 import numpy as np
-import pandas as pd
 from typing_extensions import Literal
 
 from ..utils.format import format_workflow
-from .base import ModelAlgorithm, listwise_deletion
+from .base import PatternAlgorithm, ResultKey
 
 
-class Descriptive(ModelAlgorithm):
+class Descriptive(PatternAlgorithm):
     model_outputs: List[str] = []
     contrast_outputs = ["mean", "std"]
 
-    @staticmethod
-    def voxel_calc(
-        coordinate: Tuple[int, int, int],
-        y: np.ndarray,
-        z: np.ndarray,
-        s: np.ndarray,
-        cmatdict: dict,
-    ) -> Optional[Dict]:
-
+    @classmethod
+    def pattern_calc(
+        cls, patterns: np.ndarray, z: np.ndarray, cmatdict: Dict
+    ) -> Dict[ResultKey, np.ndarray]:
         # filtering for design matrix is already done
         # the nans that are left should be replaced with zeros
         z = np.nan_to_num(z)
 
-        # remove observations with nan cope/varcope
-        y, z, s = listwise_deletion(y, z, s)
+        # shift by the mean over all subjects for numerical stability
+        shift = z.mean(axis=0)
+        z = z - shift
+
+        weights = patterns.astype(np.float64)
+        npts = np.count_nonzero(patterns, axis=1)[:, np.newaxis]
+
+        # masked column sums for all patterns at once
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = (weights @ z) / npts
+            sum_of_squares = weights @ np.square(z) - npts * np.square(mean)
+            std = np.sqrt(np.maximum(sum_of_squares, 0) / (npts - 1))
 
-        # make data frame
-        zframe = pd.DataFrame(z)
+        mean += shift
 
-        voxel_result: Dict[
-            str, Dict[Tuple[int, int, int], Dict[str, float]]
-        ] = defaultdict(dict)
+        pattern_result: Dict[ResultKey, np.ndarray] = dict()
 
         for name, cmat in cmatdict.items():
+            if name.lower() == "intercept":
+                continue
+
+            pattern_result[(name, "mean")] = mean @ cmat.T
+            pattern_result[(name, "std")] = std @ cmat.T
 
+        return pattern_result
+
+    @classmethod
+    def output_shapes(cls, cmatdict: Dict) -> Dict[ResultKey, Tuple[int, ...]]:
+        shapes: Dict[ResultKey, Tuple[int, ...]] = dict()
+
+        for name, cmat in cmatdict.items():
             if name.lower() == "intercept":
                 continue
 
-            voxel_result[name][coordinate] = dict(
-                mean=cmat @ zframe.mean(),
-                std=cmat @ zframe.std(),
-            )
+            n, _ = cmat.shape
+
+            shapes[(name, "mean")] = (n,)
+            shapes[(name, "std")] = (n,)
 
-        return voxel_result
+        return shapes
 
     @classmethod
     def write_outputs(
-        cls, ref_img: nib.Nifti1Image, cmatdict: Dict, voxel_results: Dict
+        cls,
+        ref_img: nib.Nifti1Image,
+        cmatdict: Dict,
+        coordinates: np.ndarray,
+        arrays: Dict[ResultKey, np.ndarray],
     ) -> Dict:
         output_files: Dict[str, List[Union[Literal[False], str]]] = dict()
 
         for output_name in cls.contrast_outputs:
             output_files[output_name] = [False] * len(cmatdict)
 
-        for i, contrast_name in enumerate(cmatdict.keys()):  # cmatdict is ordered
-            contrast_results = voxel_results[contrast_name]
-
-            rdf = pd.DataFrame.from_records(contrast_results)
+        contrast_names = list(cmatdict.keys())  # cmatdict is ordered
 
-            for map_name, series in rdf.iterrows():
-                assert isinstance(map_name, str)
+        for (contrast_name, map_name), values in arrays.items():
+            assert isinstance(contrast_name, str)
+            i = contrast_names.index(contrast_name)
 
-                out_name = f"{map_name}_{i+1}_{format_workflow(contrast_name)}"
-                fname = cls.write_map(ref_img, out_name, series)
+            out_name = f"{map_name}_{i+1}_{format_workflow(contrast_name)}"
+            fname = cls.write_map(ref_img, out_name, coordinates, values)
 
-                output_name = map_name
-                if output_name in output_files:
-                    output_files[output_name][i] = str(fname)
+            output_name = map_name
+            if output_name in output_files:
+                output_files[output_name][i] = str(fname)
 
         return output_files
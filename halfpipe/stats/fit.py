@@ -2,25 +2,190 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
-from collections import defaultdict
 from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import ContextManager, Dict, Iterator, List, Optional, Tuple
+from tempfile import TemporaryDirectory
+from typing import ContextManager, Dict, Iterator, List, Optional, Set, Tuple
 
 import nibabel as nib
 import numpy as np
+from numpy.lib.format import open_memmap
 from tqdm import tqdm
 
 from ..ingest.design import parse_design
+from ..memory import memory_limit
 from ..utils.matrix import atleast_4d
 from ..utils.multiprocessing import Pool
 from .algorithms import algorithms, make_algorithms_set
+from .base import PatternAlgorithm, PatternDesign, ResultKey
 
+max_voxels_per_chunk = 2**10
+chunks_per_process = 2**4
 
-def voxel_calc(voxel_data):
-    algorithm_set, c, y, z, s, cmatdict = voxel_data
 
-    return {a: algorithms[a].voxel_calc(c, y, z, s, cmatdict) for a in algorithm_set}
+@dataclass
+class SharedData:
+    """
+    Paths to memory-mapped arrays in `.npy` format that are shared with the
+    worker processes, so that we only need to send them the paths and the
+    index ranges of the voxels that they should process
+    """
+
+    algorithm_set: Set[str]
+    cmatdict: Dict
+
+    coordinates: Path
+    z: Path
+    y: Path
+    s: Path
+
+    patterns: Path
+    pattern_indices: Path
+    order: Path
+
+    results: Dict[str, Dict[ResultKey, Path]]
+
+
+def make_shared_array(path: Path, shape: Tuple[int, ...], dtype, value) -> np.memmap:
+    array = open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+    array[...] = value
+    return array
+
+
+@lru_cache(maxsize=2**8)
+def load_design(z_path: Path, patterns_path: Path, pattern_index: int) -> PatternDesign:
+    """
+    Worker processes keep the designs of the patterns that they have seen
+    recently, so that consecutive chunks of the same pattern can re-use them
+    """
+    z = np.load(z_path)
+    available = np.array(np.load(patterns_path, mmap_mode="r")[pattern_index])
+    return PatternDesign(z, available)
+
+
+def voxel_algorithms(algorithm_set: Set[str]) -> List[str]:
+    return sorted(
+        a for a in algorithm_set if not issubclass(algorithms[a], PatternAlgorithm)
+    )
+
+
+def pattern_calc(shared: SharedData) -> None:
+    """
+    Run the algorithms that only depend on the pattern of available subjects
+    for all patterns at once, and broadcast the results to the voxels
+    """
+    z = np.load(shared.z)
+    patterns = np.load(shared.patterns)
+    pattern_indices = np.load(shared.pattern_indices)
+
+    for a in shared.algorithm_set:
+        algorithm = algorithms[a]
+        if not issubclass(algorithm, PatternAlgorithm):
+            continue
+
+        pattern_result = algorithm.pattern_calc(patterns, z, shared.cmatdict)
+
+        for key, path in shared.results[a].items():
+            array = np.load(path, mmap_mode="r+")
+            array[...] = pattern_result[key][pattern_indices]
+            array.flush()
+
+
+def chunk_calc(chunk: Tuple[SharedData, int, int]) -> int:
+    shared, start, stop = chunk
+
+    # the voxels are ordered by pattern, so that each chunk
+    # only contains runs of voxels with few different patterns
+    indices = np.array(np.load(shared.order, mmap_mode="r")[start:stop])
+    pattern_indices = np.load(shared.pattern_indices, mmap_mode="r")[indices]
+
+    coordinates: List[Tuple[int, int, int]] = list(
+        map(tuple, np.load(shared.coordinates, mmap_mode="r")[indices].tolist())
+    )
+
+    # fancy indexing copies to memory, as we need to transpose and modify the data
+    y = np.load(shared.y, mmap_mode="r")[indices].T
+    s = np.load(shared.s, mmap_mode="r")[indices].T
+
+    run_starts = [0, *(np.flatnonzero(np.diff(pattern_indices)) + 1)]
+    run_stops = [*run_starts[1:], indices.size]
+
+    for a in voxel_algorithms(shared.algorithm_set):
+        arrays = {
+            key: np.load(path, mmap_mode="r+")
+            for key, path in shared.results[a].items()
+        }
+        chunk_arrays = {key: array[indices] for key, array in arrays.items()}
+
+        for run_start, run_stop in zip(run_starts, run_stops):
+            run = slice(run_start, run_stop)
+            design = load_design(shared.z, shared.patterns, pattern_indices[run_start])
+
+            algorithms[a].chunk_calc(
+                coordinates[run],
+                y[:, run],
+                s[:, run],
+                design,
+                shared.cmatdict,
+                {key: array[run] for key, array in chunk_arrays.items()},
+            )
+
+        for key, array in arrays.items():
+            array[indices] = chunk_arrays[key]
+            array.flush()
+
+    return stop - start
+
+
+def make_chunks(voxel_count: int, num_threads: int) -> List[Tuple[int, int]]:
+    """
+    Split the voxels into contiguous index ranges. Larger chunks make better
+    use of vectorization, but we want to have enough chunks per process so that
+    the work is evenly distributed when some chunks take longer than others
+    """
+    voxels_per_chunk = -(-voxel_count // (max(1, num_threads) * chunks_per_process))
+    voxels_per_chunk = max(1, min(max_voxels_per_chunk, voxels_per_chunk))
+
+    return [
+        (start, min(start + voxels_per_chunk, voxel_count))
+        for start in range(0, voxel_count, voxels_per_chunk)
+    ]
+
+
+def load_slab(images: List[nib.Nifti1Image], slab: slice, dtype) -> np.ndarray:
+    """
+    Read a range of z-slices from all images through their array proxies,
+    so that only that part of the data needs to be in memory
+    """
+    return np.concatenate(
+        [
+            atleast_4d(np.asanyarray(image.dataobj[:, :, slab, ...]).astype(dtype))
+            for image in images
+        ],
+        axis=3,
+    )
+
+
+def make_slabs(
+    shape: Tuple[int, ...], subject_count: int, memory_gb: Optional[float]
+) -> List[slice]:
+    if memory_gb is None:
+        memory_gb = memory_limit()
+
+    x, y, slice_count = shape[:3]
+
+    # copes and var_copes as float64, masks as bool, and
+    # we allow for twice that for intermediate arrays
+    bytes_per_slice = 2 * x * y * subject_count * (2 * 8 + 1)
+    slices_per_slab = int(memory_gb * 2**30 // bytes_per_slice)
+    slices_per_slab = max(1, min(slice_count, slices_per_slab))
+
+    return [
+        slice(start, min(start + slices_per_slab, slice_count))
+        for start in range(0, slice_count, slices_per_slab)
+    ]
 
 
 def load_data(
@@ -30,61 +195,148 @@ def load_data(
     regressors: Dict[str, List[float]],
     contrasts: List[Tuple],
     algorithms_to_run: List[str],
-):
-    # load data
-    cope_data = [atleast_4d(nib.load(f).get_fdata()) for f in cope_files]
-    copes = np.concatenate(cope_data, axis=3)
+    directory: Path,
+    memory_gb: Optional[float] = None,
+) -> Tuple[SharedData, int]:
+    dmat, cmatdict = parse_design(regressors, contrasts)
 
-    mask_data = [
-        atleast_4d(np.asanyarray(nib.load(f).dataobj).astype(bool)) for f in mask_files
-    ]
-    masks = np.concatenate(mask_data, axis=3)
+    nevs = dmat.columns.size
+
+    algorithm_set = make_algorithms_set(algorithms_to_run)
+
+    if dmat.shape[1] == 1:  # do not run if we do not have regressors
+        algorithm_set -= frozenset(["mcartest"])
 
+    shared = SharedData(
+        algorithm_set=algorithm_set,
+        cmatdict=cmatdict,
+        coordinates=directory / "coordinates.npy",
+        z=directory / "z.npy",
+        y=directory / "y.npy",
+        s=directory / "s.npy",
+        patterns=directory / "patterns.npy",
+        pattern_indices=directory / "pattern_indices.npy",
+        order=directory / "order.npy",
+        results=dict(),
+    )
+
+    np.save(shared.z, dmat.to_numpy(dtype=np.float64))
+
+    # only read the headers for now
+    cope_images = [nib.load(f) for f in cope_files]
+    mask_images = [nib.load(f) for f in mask_files]
+
+    var_cope_images: Optional[List[nib.Nifti1Image]] = None
     if var_cope_files is not None:
-        var_cope_data = [atleast_4d(nib.load(f).get_fdata()) for f in var_cope_files]
-        var_copes = np.concatenate(var_cope_data, axis=3)
-    else:
-        var_copes = np.zeros_like(copes)
+        var_cope_images = [nib.load(f) for f in var_cope_files]
 
-    shape = copes[..., 0].shape
+    shape = cope_images[0].shape[:3]
+    subject_count = sum(
+        image.shape[3] if len(image.shape) > 3 else 1 for image in cope_images
+    )
 
-    dmat, cmatdict = parse_design(regressors, contrasts)
+    slabs = make_slabs(shape, subject_count, memory_gb)
 
-    nevs = dmat.columns.size
+    # the masks are small, so we can read them in a first pass to find an
+    # upper bound for the number of voxels that we will select
+    max_voxel_count = sum(
+        np.count_nonzero(
+            np.count_nonzero(load_slab(mask_images, slab, bool), axis=3) >= nevs + 3
+        )
+        for slab in slabs
+    )
+    y_array, s_array = (
+        open_memmap(
+            path, mode="w+", dtype=np.float64, shape=(max_voxel_count, subject_count)
+        )
+        for path in (shared.y, shared.s)
+    )
 
-    # update the masks
-    masks = np.logical_and(masks, np.isfinite(copes))
-    masks = np.logical_and(masks, np.isfinite(var_copes))
+    coordinates_list: List[np.ndarray] = list()
+    pattern_indices_list: List[np.ndarray] = list()
+    pattern_ids: Dict[bytes, int] = dict()
+    voxel_count = 0
+    for slab in slabs:
+        copes = load_slab(cope_images, slab, np.float64)
+        masks = load_slab(mask_images, slab, bool)
 
-    algorithm_set = make_algorithms_set(algorithms_to_run)
+        if var_cope_images is not None:
+            var_copes = load_slab(var_cope_images, slab, np.float64)
+        else:
+            var_copes = np.zeros_like(copes)
 
-    if dmat.shape[1] == 1:  # do not run if we do not have regressors
-        algorithm_set -= frozenset(["mcartest"])
+        # update the masks
+        masks = np.logical_and(masks, np.isfinite(copes))
+        masks = np.logical_and(masks, np.isfinite(var_copes))
+
+        # select voxels
+        npts = np.count_nonzero(masks, axis=3)
+        voxel_mask = npts >= nevs + 3  # need at least three degrees of freedom
+
+        coordinates = np.argwhere(voxel_mask)
+        coordinates[:, 2] += slab.start
+        coordinates_list.append(coordinates)
+
+        available = masks[voxel_mask]
+        missing = np.logical_not(available)
+
+        # hash the packed mask bits of each voxel to find its pattern
+        packed = np.packbits(available, axis=1)
+        keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        ids = np.array(
+            [
+                pattern_ids.setdefault(k.tobytes(), len(pattern_ids))
+                for k in unique_keys
+            ],
+            dtype=np.int64,
+        )
+        pattern_indices_list.append(ids[inverse])
 
-    # prepare voxelwise generator
-    def gen_voxel_data():
-        def ensure_row_vector(x):
-            return np.ravel(x)[:, np.newaxis]
+        start = voxel_count
+        voxel_count += coordinates.shape[0]
 
-        for coordinate in np.ndindex(*shape):
-            available = ensure_row_vector(masks[coordinate])
-            missing = np.logical_not(available)
+        for array, data in [(y_array, copes), (s_array, var_copes)]:
+            values = data[voxel_mask]
+            values[missing] = np.nan
+            array[start:voxel_count] = values
 
-            npts = np.count_nonzero(available)
-            if npts < nevs + 3:  # need at least three degrees of freedom
-                continue
+        del copes, var_copes, masks  # release memory before the next slab
 
-            y = ensure_row_vector(copes[coordinate])
-            y[missing] = np.nan
+    for array in (y_array, s_array):
+        array.flush()
+    del y_array, s_array
 
-            s = ensure_row_vector(var_copes[coordinate])
-            s[missing] = np.nan
+    np.save(shared.coordinates, np.concatenate(coordinates_list, axis=0))
 
-            z = dmat.to_numpy(dtype=np.float64)
+    patterns = np.zeros((len(pattern_ids), subject_count), dtype=bool)
+    for k, i in pattern_ids.items():
+        patterns[i] = np.unpackbits(
+            np.frombuffer(k, dtype=np.uint8), count=subject_count
+        ).astype(bool)
+    np.save(shared.patterns, patterns)
 
-            yield algorithm_set, coordinate, y, z, s, cmatdict
+    pattern_indices = np.concatenate(pattern_indices_list)
+    np.save(shared.pattern_indices, pattern_indices)
+    np.save(shared.order, np.argsort(pattern_indices, kind="stable"))
 
-    return gen_voxel_data(), cmatdict
+    for a in algorithm_set:
+        results: Dict[ResultKey, Path] = dict()
+
+        for i, (key, shape) in enumerate(algorithms[a].output_shapes(cmatdict).items()):
+            _, map_name = key
+
+            path = directory / f"{a}_{i:d}.npy"
+            if map_name == "mask":
+                make_shared_array(path, (voxel_count, *shape), bool, False)
+            else:
+                make_shared_array(path, (voxel_count, *shape), np.float64, np.nan)
+
+            results[key] = path
+
+        shared.results[a] = results
+
+    return shared, voxel_count
 
 
 def fit(
@@ -95,47 +347,56 @@ def fit(
     contrasts: List[Tuple],
     algorithms_to_run: List[str],
     num_threads: int,
+    memory_gb: Optional[float] = None,
 ) -> Dict:
-    voxel_data, cmatdict = load_data(
-        cope_files,
-        var_cope_files,
-        mask_files,
-        regressors,
-        contrasts,
-        algorithms_to_run,
-    )
-
-    # setup run
-    if num_threads < 2:
-        pool: Optional[Pool] = None
-        it: Iterator = map(voxel_calc, voxel_data)
-        cm: ContextManager = nullcontext()
-    else:
-        pool = Pool(processes=num_threads)
-        it = pool.imap_unordered(voxel_calc, voxel_data)
-        cm = pool
-
-    # run
-    voxel_results: Dict = defaultdict(lambda: defaultdict(dict))
-    with cm:
-        for x in tqdm(it, unit="voxels"):
-            if x is None:
-                continue
-
-            for a, d in x.items():  # transpose
-                if d is None:
-                    continue
-
-                for k, v in d.items():
-                    if v is None:
-                        continue
-
-                    voxel_results[a][k].update(v)
-
-    ref_image = nib.squeeze_image(nib.load(cope_files[0]))
-
-    output_files = dict()
-    for a, v in voxel_results.items():
-        output_files.update(algorithms[a].write_outputs(ref_image, cmatdict, v))
+    with TemporaryDirectory(dir=Path.cwd()) as temporary_directory:
+        shared, voxel_count = load_data(
+            cope_files,
+            var_cope_files,
+            mask_files,
+            regressors,
+            contrasts,
+            algorithms_to_run,
+            Path(temporary_directory),
+            memory_gb=memory_gb,
+        )
+
+        pattern_calc(shared)
+
+        chunks = list()
+        if len(voxel_algorithms(shared.algorithm_set)) > 0:
+            chunks = make_chunks(voxel_count, num_threads)
+        chunk_data = ((shared, start, stop) for start, stop in chunks)
+
+        # setup run
+        if num_threads < 2 or len(chunks) == 0:
+            pool: Optional[Pool] = None
+            it: Iterator = map(chunk_calc, chunk_data)
+            cm: ContextManager = nullcontext()
+        else:
+            pool = Pool(processes=num_threads)
+            it = pool.imap_unordered(chunk_calc, chunk_data)
+            cm = pool
+
+        # run
+        total = sum(stop - start for start, stop in chunks)
+        with cm, tqdm(total=total, unit="voxels") as progress_bar:
+            for chunk_voxel_count in it:
+                progress_bar.update(chunk_voxel_count)
+
+        load_design.cache_clear()
+
+        ref_image = nib.squeeze_image(nib.load(cope_files[0]))
+
+        coordinates = np.load(shared.coordinates)
+
+        output_files = dict()
+        for a, paths in shared.results.items():
+            arrays = {key: np.load(path, mmap_mode="r") for key, path in paths.items()}
+            output_files.update(
+                algorithms[a].write_outputs(
+                    ref_image, shared.cmatdict, coordinates, arrays
+                )
+            )
 
     return output_files
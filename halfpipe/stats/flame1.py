@@ -3,18 +3,17 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 from collections import defaultdict
-from math import isclose, isfinite, isnan, nan
+from math import isclose, isfinite, isnan
 from typing import Any
 
 import nibabel as nib
 import numpy as np
-import pandas as pd
 from scipy.optimize import minimize_scalar
 from typing_extensions import Literal
 
 from ..utils.format import format_workflow
-from .base import ModelAlgorithm, demean, listwise_deletion
-from .miscmaths import f2z_convert, t2z_convert
+from .base import ModelAlgorithm, PatternDesign, ResultKey, demean, listwise_deletion
+from .miscmaths import f2z_convert, f2z_convert_array, t2z_convert, t2z_convert_array
 
 
 def calcgam(beta, y, z, s) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
@@ -63,6 +62,113 @@ def solveforbeta(y, z, s):
     return beta
 
 
+def solve_batch(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    try:
+        return np.linalg.solve(a, b[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:  # at least one matrix is singular
+        return np.einsum("vpq,vq->vp", np.linalg.pinv(a, hermitian=True), b)
+
+
+def calcgam_batch(
+    beta: np.ndarray, y: np.ndarray, z: np.ndarray, s: np.ndarray, zz: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized version of `calcgam` for `y` and `s` with one column per voxel
+    and `beta` with one element per voxel. As the weight matrix is diagonal,
+    we only keep its diagonal around instead of building the n×n matrix.
+    `zz` has the outer products of the rows of the design matrix, so that we
+    can calculate z.T @ iU @ z for all voxels with a single matrix product
+    """
+    _, p = z.shape
+
+    weights = 1.0 / (s + beta[np.newaxis, :])  # diagonal of iU, shape (n, v)
+
+    ziUz = (weights.T @ zz).reshape(-1, p, p)
+    ziUy = (weights * y).T @ z
+
+    gam = solve_batch(ziUz, ziUy)
+
+    return gam, weights, ziUz, ziUy
+
+
+def marg_posterior_energy_batch(
+    ex: np.ndarray, y: np.ndarray, z: np.ndarray, s: np.ndarray, zz: np.ndarray
+) -> np.ndarray:
+    is_valid = ex > 0
+
+    gam, weights, ziUz, ziUy = calcgam_batch(np.where(is_valid, ex, 1.0), y, z, s, zz)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iU_logdet = np.log(weights).sum(axis=0)
+        _, ziUz_logdet = np.linalg.slogdet(ziUz)
+
+        yiUy = np.einsum("nv,nv->v", weights * y, y)
+        gamziUzgam = np.einsum("vp,vp->v", gam, ziUy)
+
+        energy = -(0.5 * iU_logdet - 0.5 * ziUz_logdet - 0.5 * (yiUy - gamziUzgam))
+
+    is_valid &= np.isfinite(energy)
+
+    return np.where(is_valid, energy, 1e32)
+
+
+def solveforbeta_batch(
+    y: np.ndarray,
+    z: np.ndarray,
+    s: np.ndarray,
+    zz: np.ndarray,
+    xtol: float = 1.48e-8,
+    maxiter: int = 500,
+) -> np.ndarray:
+    """
+    Minimize the marginal posterior energy for all voxels at once. We first
+    evaluate the energy on a logarithmic grid to bracket the minimum, and then
+    refine the bracket with a golden section search
+    """
+    _, v = y.shape
+
+    # the data is normalized to unit variance, so the
+    # random effects variance will be in this range
+    grid = np.logspace(-10, 4, num=57)
+
+    energies = np.vstack(
+        [marg_posterior_energy_batch(np.full(v, x), y, z, s, zz) for x in grid]
+    )
+
+    k = np.argmin(energies, axis=0)
+    a = grid[np.maximum(k - 1, 0)]
+    b = grid[np.minimum(k + 1, grid.size - 1)]
+
+    golden = (np.sqrt(5.0) - 1.0) / 2.0
+
+    c = b - golden * (b - a)
+    d = a + golden * (b - a)
+    fc = marg_posterior_energy_batch(c, y, z, s, zz)
+    fd = marg_posterior_energy_batch(d, y, z, s, zz)
+
+    for _ in range(maxiter):
+        if np.all(b - a <= xtol * (np.abs(c) + np.abs(d)) / 2 + 1e-11):
+            break
+
+        is_left = fc < fd
+
+        b = np.where(is_left, d, b)
+        a = np.where(is_left, a, c)
+
+        # re-use the interior point that remains in the bracket
+        e = np.where(is_left, b - golden * (b - a), a + golden * (b - a))
+        fe = marg_posterior_energy_batch(e, y, z, s, zz)
+
+        c, d = np.where(is_left, e, d), np.where(is_left, c, e)
+        fc, fd = np.where(is_left, fe, fd), np.where(is_left, fc, fe)
+
+    fu = np.where(fc < fd, c, d)
+
+    beta = np.maximum(1e-10, fu)
+
+    return beta
+
+
 def flame_stage1_onvoxel(y, z, s):
     norm = np.std(y)
 
@@ -85,6 +191,38 @@ def flame_stage1_onvoxel(y, z, s):
     return gam, ziUz
 
 
+def flame_stage1_batch(
+    y: np.ndarray, z: np.ndarray, s: np.ndarray, zz: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized version of `flame_stage1_onvoxel` for voxels that share the
+    same design matrix `z`. Returns a boolean array that marks the voxels for
+    which the per-voxel version would have raised an error
+    """
+    if zz is None:
+        n, p = z.shape
+        zz = (z[:, :, np.newaxis] * z[:, np.newaxis, :]).reshape(n, p * p)
+
+    norm = np.std(y, axis=0)
+
+    is_valid = norm > 0
+    norm = np.where(is_valid, norm, 1.0)
+
+    y = y / norm[np.newaxis, :]
+    s = s / np.square(norm)[np.newaxis, :]
+
+    is_valid &= np.all(s >= 0, axis=0)
+
+    beta = solveforbeta_batch(y, z, s, zz)
+
+    gam, _, ziUz, _ = calcgam_batch(beta, y, z, s, zz)
+
+    gam *= norm[:, np.newaxis]
+    ziUz /= np.square(norm)[:, np.newaxis, np.newaxis]
+
+    return gam, ziUz, is_valid
+
+
 def t_ols_contrast(mn, inverse_covariance, dof, tcontrast):
     a = np.linalg.lstsq(inverse_covariance, tcontrast.T, rcond=None)[0]
     varcope = float(tcontrast @ a)
@@ -142,6 +280,60 @@ def flame1_contrast(mn, inverse_covariance, npts, cmat):
         return dict(cope=cope, fstat=f, dof=[fdof1, fdof2lower], zstat=z, mask=mask)
 
 
+def flame1_contrast_batch(
+    mn: np.ndarray, inverse_covariance: np.ndarray, npts: int, cmat: np.ndarray
+) -> dict[str, np.ndarray | int | list[int]]:
+    """
+    Vectorized version of `flame1_contrast` for `mn` with one row per voxel
+    """
+    _, nevs = mn.shape
+
+    n, _ = cmat.shape
+
+    covariance = np.linalg.pinv(inverse_covariance, hermitian=True)
+
+    cope = mn @ cmat.T  # shape (v, n)
+    a = cmat[np.newaxis, :, :] @ covariance @ cmat.T[np.newaxis, :, :]
+
+    if n == 1:
+        tdoflower = npts - nevs
+
+        (cope,) = cope.T
+        varcope = a[:, 0, 0]
+
+        is_valid = np.isfinite(cope) & np.isfinite(varcope) & (varcope > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = np.where(is_valid, cope / np.sqrt(varcope), np.nan)
+
+        z = t2z_convert_array(t, tdoflower)
+
+        mask = np.isfinite(z)
+
+        return dict(
+            cope=cope, var_cope=varcope, dof=tdoflower, tstat=t, zstat=z, mask=mask
+        )
+
+    else:
+        fdof1 = n
+
+        fdof2lower = npts - nevs
+
+        b = np.einsum("vmn,vn->vm", np.linalg.pinv(a), cope)
+        f = np.einsum("vn,vn->v", cope, b) / fdof1
+
+        z = f2z_convert_array(f, fdof1, fdof2lower)
+
+        mask = np.isfinite(z)
+
+        return dict(
+            cope=cope[:, :, np.newaxis],
+            fstat=f,
+            dof=[fdof1, fdof2lower],
+            zstat=z,
+            mask=mask,
+        )
+
+
 def flame1_prepare_data(y: np.ndarray, z: np.ndarray, s: np.ndarray):
     # filtering for design matrix is already done
     # the nans that are left should be replaced with zeros
@@ -196,37 +388,89 @@ class FLAME1(ModelAlgorithm):
 
         return voxel_result
 
+    @classmethod
+    def chunk_calc(
+        cls,
+        coordinates: list[tuple[int, int, int]],
+        y: np.ndarray,
+        s: np.ndarray,
+        design: PatternDesign,
+        cmatdict: dict,
+        arrays: dict[ResultKey, np.ndarray],
+    ) -> None:
+        # all voxels share the same design matrix, so we can run them all at once
+        mn, inverse_covariance, is_valid = flame_stage1_batch(
+            y[design.available],
+            design.demeaned_z,
+            s[design.available],
+            zz=design.outer_products,
+        )
+
+        (voxel_indices,) = np.nonzero(is_valid)
+        if voxel_indices.size == 0:
+            return
+
+        mn = mn[is_valid]
+        inverse_covariance = inverse_covariance[is_valid]
+
+        for name, cmat in cmatdict.items():
+            r = flame1_contrast_batch(mn, inverse_covariance, design.npts, cmat)
+
+            for map_name, values in r.items():
+                arrays[(name, map_name)][voxel_indices] = values
+
+    @classmethod
+    def output_shapes(cls, cmatdict: dict) -> dict[ResultKey, tuple[int, ...]]:
+        shapes: dict[ResultKey, tuple[int, ...]] = dict()
+
+        for name, cmat in cmatdict.items():
+            n, _ = cmat.shape
+
+            if n == 1:
+                shapes[(name, "cope")] = ()
+                shapes[(name, "var_cope")] = ()
+                shapes[(name, "dof")] = ()
+                shapes[(name, "tstat")] = ()
+
+            elif n > 1:
+                shapes[(name, "cope")] = (n, 1)
+                shapes[(name, "fstat")] = ()
+                shapes[(name, "dof")] = (2,)
+
+            shapes[(name, "zstat")] = ()
+            shapes[(name, "mask")] = ()
+
+        return shapes
+
     @classmethod
     def write_outputs(
-        cls, ref_img: nib.Nifti1Image, cmatdict: dict, voxel_results: dict
+        cls,
+        ref_img: nib.Nifti1Image,
+        cmatdict: dict,
+        coordinates: np.ndarray,
+        arrays: dict[ResultKey, np.ndarray],
     ) -> dict:
         output_files: dict[str, list[Literal[False] | str]] = dict()
 
         for output_name in cls.contrast_outputs:
             output_files[output_name] = [False] * len(cmatdict)
 
-        for i, contrast_name in enumerate(cmatdict.keys()):  # cmatdict is ordered
-            contrast_results = voxel_results[contrast_name]
-
-            rdf = pd.DataFrame.from_records(contrast_results)
-
-            if "mask" not in rdf.index:  # ensure that we always output a mask
-                rdf = rdf.append(pd.Series(data=False, index=rdf.columns, name="mask"))
+        contrast_names = list(cmatdict.keys())  # cmatdict is ordered
 
-            if "zstat" not in rdf.index:  # ensure that we always output a zstat
-                rdf = rdf.append(pd.Series(data=nan, index=rdf.columns, name="zstat"))
+        for (contrast_name, map_name), values in arrays.items():
+            assert isinstance(contrast_name, str)
+            i = contrast_names.index(contrast_name)
 
-            for map_name, series in rdf.iterrows():
-                out_name = f"{map_name}_{i+1}_{format_workflow(contrast_name)}"
-                fname = cls.write_map(ref_img, out_name, series)
+            out_name = f"{map_name}_{i+1}_{format_workflow(contrast_name)}"
+            fname = cls.write_map(ref_img, out_name, coordinates, values)
 
-                if map_name in frozenset(["dof"]):
-                    output_name = map_name
+            if map_name in frozenset(["dof"]):
+                output_name = map_name
 
-                else:
-                    output_name = f"{map_name}s"
+            else:
+                output_name = f"{map_name}s"
 
-                if output_name in output_files:
-                    output_files[output_name][i] = str(fname)
+            if output_name in output_files:
+                output_files[output_name][i] = str(fname)
 
         return output_files
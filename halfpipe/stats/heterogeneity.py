@@ -6,12 +6,11 @@ from math import inf, log, nan, pi
 
 import nibabel as nib
 import numpy as np
-import pandas as pd
 from numpy import typing as npt
 from scipy import optimize, special, stats
 
 from ..utils import logger
-from .base import ModelAlgorithm
+from .base import ModelAlgorithm, PatternDesign, ResultKey
 from .flame1 import flame1_prepare_data
 
 
@@ -48,6 +47,23 @@ class MoM:
 
         return i2
 
+    @staticmethod
+    def i2_batch(y, z, s, zz):
+        """
+        Vectorized version of `i2` for `y` and `s` with one column per voxel
+        """
+        n, p = z.shape
+
+        w0 = 1.0 / s
+        _, _, _, q, trp0 = ReML.projection_terms(w0, y, z, zz)
+
+        τ2 = np.maximum((q - (n - p - 1)) / trp0, 0)
+
+        h2 = τ2 * trp0 / (n - p - 1) + 1
+        i2 = (h2 - 1) / h2
+
+        return i2
+
 
 class ReML:
     @staticmethod
@@ -73,6 +89,138 @@ class ReML:
     def fit(cls, y: np.ndarray, x: np.ndarray | None, s: np.ndarray):
         return optimize.minimize_scalar(cls.neg_log_lik, args=(y, x, s), method="brent")
 
+    @staticmethod
+    def projection_terms(w: np.ndarray, y: np.ndarray, x: np.ndarray, xx: np.ndarray):
+        """
+        For a diagonal weight matrix W with one column of `w` per voxel, the
+        projection matrix P = W - W X (X' W X)^-1 X' W is only ever applied to
+        vectors, so we never need to build the n×n matrices. `xx` has the outer
+        products of the rows of `x` so that we can calculate X' W X with a
+        single matrix product for all voxels
+        """
+        _, p = x.shape
+
+        b = (w.T @ xx).reshape(-1, p, p)
+        binv = np.linalg.pinv(b, hermitian=True)
+
+        # P y = W (y - X γ)
+        γ = np.einsum("vpq,vq->vp", binv, (w * y).T @ x)
+        py = w * (y - x @ γ.T)
+
+        ypy = np.einsum("nv,nv->v", y, py)
+
+        # tr(P) = tr(W) - tr((X' W X)^-1 X' W^2 X)
+        c2 = (np.square(w).T @ xx).reshape(-1, p, p)
+        trp = w.sum(axis=0) - np.einsum("vpq,vqp->v", binv, c2)
+
+        return b, binv, py, ypy, trp
+
+    @classmethod
+    def terms_batch(
+        cls, ϑ: np.ndarray, y: np.ndarray, x: np.ndarray, s: np.ndarray, xx: np.ndarray
+    ):
+        """
+        Vectorized negative log-likelihood, jacobian and hessian as in the
+        scalar methods, and tr(P P) for Fisher scoring
+        """
+        _, p = x.shape
+
+        w = 1.0 / (s + ϑ[np.newaxis, :])
+
+        b, binv, py, ypy, trp = cls.projection_terms(w, y, x, xx)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            _, log_det_b = np.linalg.slogdet(b)
+            neg_log_lik = (-np.log(w).sum(axis=0) + log_det_b + ypy) / 2
+        neg_log_lik = np.where(np.isfinite(neg_log_lik), neg_log_lik, inf)
+
+        yppy = np.einsum("nv,nv->v", py, py)
+        jacobian = trp - yppy
+
+        # P P y
+        δ = np.einsum("vpq,vq->vp", binv, (w * py).T @ x)
+        ppy = w * (py - x @ δ.T)
+        hessian = np.einsum("nv,nv->v", py, ppy)
+
+        # tr(P P) = tr(W^2) - 2 tr(B^-1 X' W^3 X) + tr(B^-1 X' W^2 X B^-1 X' W^2 X)
+        c2 = (np.square(w).T @ xx).reshape(-1, p, p)
+        c3 = (np.power(w, 3).T @ xx).reshape(-1, p, p)
+        binvc2 = binv @ c2
+        trpp = (
+            np.square(w).sum(axis=0)
+            - 2 * np.einsum("vpq,vqp->v", binv, c3)
+            + np.einsum("vpq,vqp->v", binvc2, binvc2)
+        )
+
+        return neg_log_lik, jacobian, hessian, trpp
+
+    @classmethod
+    def neg_log_lik_batch(
+        cls, ϑ: np.ndarray, y: np.ndarray, x: np.ndarray, s: np.ndarray, xx: np.ndarray
+    ):
+        w = 1.0 / (s + ϑ[np.newaxis, :])
+        b, _, _, ypy, _ = cls.projection_terms(w, y, x, xx)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            _, log_det_b = np.linalg.slogdet(b)
+            neg_log_lik = (-np.log(w).sum(axis=0) + log_det_b + ypy) / 2
+
+        return np.where(np.isfinite(neg_log_lik), neg_log_lik, inf)
+
+    @classmethod
+    def fit_batch(
+        cls,
+        y: np.ndarray,
+        x: np.ndarray,
+        s: np.ndarray,
+        xx: np.ndarray,
+        xtol: float = 1.48e-8,
+        maxiter: int = 100,
+    ):
+        """
+        Minimize the negative log-likelihood for all voxels at once. We start
+        from the best value on a logarithmic grid, and then take Newton steps
+        that fall back to Fisher scoring where the hessian is not positive, and
+        that are halved until the likelihood does not get worse
+        """
+        _, v = y.shape
+
+        # the data is normalized to unit variance, so the
+        # random effects variance will be in this range
+        grid = np.hstack([0.0, np.logspace(-8, 4, num=49)])
+        neg_log_liks = np.vstack(
+            [cls.neg_log_lik_batch(np.full(v, g), y, x, s, xx) for g in grid]
+        )
+        ϑ = grid[np.argmin(neg_log_liks, axis=0)]
+
+        is_done = np.zeros(v, dtype=bool)
+        for _ in range(maxiter):
+            neg_log_lik, jacobian, hessian, trpp = cls.terms_batch(ϑ, y, x, s, xx)
+
+            # `jacobian` is the derivative of twice the negative log-likelihood
+            curvature = 2 * hessian - trpp
+            curvature = np.where(curvature > 0, curvature, trpp)
+            step = np.where(is_done, 0.0, -jacobian / curvature)
+            step = np.nan_to_num(step, nan=0.0, posinf=0.0, neginf=0.0)
+
+            tolerance = 1e-12 * np.abs(neg_log_lik)
+            for _ in range(32):
+                candidate = np.maximum(ϑ + step, 0)
+                candidate_neg_log_lik = cls.neg_log_lik_batch(candidate, y, x, s, xx)
+                is_worse = candidate_neg_log_lik > neg_log_lik + tolerance
+                if not np.any(is_worse):
+                    break
+                step = np.where(is_worse, step / 2, step)
+
+            candidate = np.maximum(ϑ + step, 0)
+            is_done |= np.abs(candidate - ϑ) <= xtol * (1 + ϑ)
+            ϑ = candidate
+
+            if np.all(is_done):
+                break
+
+        return ϑ, cls.neg_log_lik_batch(ϑ, y, x, s, xx)
+
     @classmethod
     def neg_log_lik(cls, ϑ: float, y: np.ndarray, x: np.ndarray | None, s: np.ndarray):
         vinv, p, b = cls.model(ϑ, x, s)
@@ -151,6 +299,55 @@ class InvGammaML:
 
         return ϑ
 
+    @staticmethod
+    def fit_batch(x: np.ndarray, maxiter: int = 100):
+        """
+        Vectorized maximum likelihood fit for `x` with one column per voxel.
+        The scale can be written in terms of the shape, so that we only need
+        to find the root of log(a) - digamma(a) = c with Newton's method
+        """
+        mean_inverse = np.mean(1 / x, axis=0)
+        c = np.log(mean_inverse) + np.mean(np.log(x), axis=0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # starting value from Minka (2002)
+            a = (3 - c + np.sqrt(np.square(c - 3) + 24 * c)) / (12 * c)
+            a = np.where(c > 0, a, nan)
+
+            for _ in range(maxiter):
+                f = np.log(a) - special.digamma(a) - c
+                step = f / (1 / a - special.polygamma(1, a))
+                a = np.where(a - step > 0, a - step, a / 2)
+
+                if not np.any(np.abs(step) > 1e-12 * a):
+                    break
+
+        b = a / mean_inverse
+        ϑ = np.vstack([a, b]).T
+
+        return ϑ
+
+    @staticmethod
+    def inverse_hessian_batch(ϑ: np.ndarray, x: np.ndarray):
+        """
+        Closed form of the inverse of the 2×2 `hessian` for many voxels
+        """
+        n, _ = x.shape
+        a, b = ϑ.T
+
+        trigamma = special.polygamma(1, a)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            det = n * (a * trigamma - 1) / np.square(b)
+
+            inverse_hessian = np.empty((a.size, 2, 2))
+            inverse_hessian[:, 0, 0] = a / np.square(b)
+            inverse_hessian[:, 0, 1] = 1 / b
+            inverse_hessian[:, 1, 0] = 1 / b
+            inverse_hessian[:, 1, 1] = trigamma
+            inverse_hessian /= det[:, np.newaxis, np.newaxis]
+
+        return inverse_hessian
+
     @staticmethod
     def neg_log_lik(ϑ: np.ndarray, x: np.ndarray):
         a, b = ϑ
@@ -253,6 +450,67 @@ def het_on_voxel(y, z, s):
     )
 
 
+def het_on_voxels(y, z, s, zz):
+    """
+    Vectorized version of `het_on_voxel` for voxels that share the same design
+    matrix `z`. Returns a boolean array that marks the voxels for which the
+    per-voxel version would have raised an error
+    """
+    n, _ = y.shape
+
+    norm = np.std(y, axis=0)
+
+    is_valid = (norm > 0) & np.all(s > 0, axis=0)
+    norm = np.where(is_valid, norm, 1.0)
+    s = np.where(is_valid, s, 1.0)
+
+    y_norm = y / norm
+    s_norm = s / np.square(norm)
+
+    # calculate beta
+
+    neg_log_lik_fe = ReML.neg_log_lik_batch(np.zeros(norm.size), y_norm, z, s_norm, zz)
+
+    ϑ, neg_log_lik_me = ReML.fit_batch(y_norm, z, s_norm, zz)
+
+    _, _, hessian, _ = ReML.terms_batch(ϑ, y_norm, z, s_norm, zz)
+    var_res = 1 / hessian
+    beta = np.vstack([ϑ, var_res]).T
+    beta *= np.square(norm)[:, np.newaxis]
+
+    # calculate lrt
+
+    chisq = 2 * (neg_log_lik_fe - neg_log_lik_me)
+
+    pseudor2 = 1 - neg_log_lik_me / neg_log_lik_fe
+    pseudor2 = np.clip(pseudor2, 0, 1)
+
+    # calculate other
+
+    i2 = MoM.i2_batch(y_norm, z, s_norm, zz)
+
+    ϑ = InvGammaML.fit_batch(s)
+    var_ϑ = InvGammaML.inverse_hessian_batch(ϑ, s)
+    gamma = np.concatenate([ϑ[:, np.newaxis, :], var_ϑ], axis=1)
+
+    u = np.sum(1 / s, axis=0)
+    v = np.sum(1 / np.square(s), axis=0)
+    νq = (n - 1) * u / (np.square(u) - v)
+    typical = νq
+
+    voxel_dict = dict(
+        hetnorm=norm,
+        hetbeta=beta,
+        hetgamma=gamma,
+        hettypical=typical,
+        heti2=i2,
+        hetpseudor2=pseudor2,
+        hetchisq=chisq,
+    )
+
+    return voxel_dict, is_valid
+
+
 class Heterogeneity(ModelAlgorithm):
     model_outputs: list[str] = [
         "hetnorm",
@@ -290,18 +548,55 @@ class Heterogeneity(ModelAlgorithm):
         voxel_result = {coordinate: voxel_dict}
         return voxel_result
 
+    @classmethod
+    def chunk_calc(
+        cls,
+        coordinates: list[tuple[int, int, int]],
+        y: np.ndarray,
+        s: np.ndarray,
+        design: PatternDesign,
+        cmatdict: dict,
+        arrays: dict[ResultKey, np.ndarray],
+    ) -> None:
+        _ = cmatdict
+
+        # all voxels share the same design matrix, so we can run them all at once
+        with np.errstate(divide="ignore", invalid="ignore"):
+            voxel_dict, is_valid = het_on_voxels(
+                y[design.available],
+                design.demeaned_z,
+                s[design.available],
+                design.outer_products,
+            )
+
+        for (_, map_name), array in arrays.items():
+            array[is_valid] = voxel_dict[map_name][is_valid]
+
+    @classmethod
+    def output_shapes(cls, cmatdict: dict) -> dict[ResultKey, tuple[int, ...]]:
+        _ = cmatdict
+        return {
+            (None, "hetnorm"): (),
+            (None, "hetbeta"): (2,),
+            (None, "hetgamma"): (3, 2),
+            (None, "hettypical"): (),
+            (None, "heti2"): (),
+            (None, "hetpseudor2"): (),
+            (None, "hetchisq"): (),
+        }
+
     @classmethod
     def write_outputs(
-        cls, ref_img: nib.Nifti1Image, cmatdict: dict, voxel_results: dict
+        cls,
+        ref_img: nib.Nifti1Image,
+        cmatdict: dict,
+        coordinates: np.ndarray,
+        arrays: dict[ResultKey, np.ndarray],
     ) -> dict:
         output_files = dict()
 
-        rdf = pd.DataFrame.from_records(voxel_results)
-
-        for map_name, series in rdf.iterrows():
-            assert isinstance(map_name, str)
-
-            fname = cls.write_map(ref_img, map_name, series)
+        for (_, map_name), values in arrays.items():
+            fname = cls.write_map(ref_img, map_name, coordinates, values)
             output_files[map_name] = str(fname)
 
         return output_files
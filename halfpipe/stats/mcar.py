@@ -2,46 +2,138 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
+import nibabel as nib
 import numpy as np
-import statsmodels.api as sm
-from statsmodels.tools.sm_exceptions import PerfectSeparationError
+from scipy import special
 
-from .base import demean
-from .heterogeneity import Heterogeneity
-from .miscmaths import chisq2z_convert
+from .base import PatternAlgorithm, ResultKey, demean
+from .miscmaths import chisq2z_convert_array
 
+max_patterns_per_block = 2**12
 
-class MCARTest(Heterogeneity):
+
+def log_likelihood(y: np.ndarray, η: np.ndarray) -> np.ndarray:
+    """
+    Log-likelihood of the logistic model for each row of `y`, where `η` is
+    the linear predictor. We use that log(σ(η)) = -log(1 + exp(-η)) to avoid
+    overflow for large values
+    """
+    return -np.sum(y * np.logaddexp(0, -η) + (1 - y) * np.logaddexp(0, η), axis=1)
+
+
+def logit_batch(
+    y: np.ndarray, x: np.ndarray, maxiter: int = 35, tol: float = 1e-8
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Fit a logistic regression of each row of `y` on the same design matrix `x`
+    with iteratively reweighted least squares, which is Newton's method for
+    this model. Returns the log-likelihood and a boolean array that marks the
+    rows with perfect separation, for which the estimates are not available
+    """
+    m, _ = y.shape
+    _, k = x.shape
+
+    xx = (x[:, :, np.newaxis] * x[:, np.newaxis, :]).reshape(-1, k * k)
+
+    β = np.zeros((m, k))
+    is_separated = np.zeros(m, dtype=bool)
+    is_done = np.zeros(m, dtype=bool)
+
+    for _ in range(maxiter):
+        μ = special.expit(β @ x.T)
+
+        # same criterion as statsmodels
+        is_separated |= np.all(np.isclose(μ, y), axis=1)
+
+        w = μ * (1 - μ)
+        hessian = (w @ xx).reshape(-1, k, k)
+        gradient = (y - μ) @ x
+
+        step = np.einsum(
+            "mkl,ml->mk", np.linalg.pinv(hessian, hermitian=True), gradient
+        )
+        step[is_done] = 0
+        β += step
+
+        is_done |= np.all(np.abs(step) <= tol, axis=1)
+        if np.all(is_done):
+            break
+
+    return log_likelihood(y, β @ x.T), is_separated
+
+
+class MCARTest(PatternAlgorithm):
     model_outputs = ["mcarchisq", "mcardof", "mcarz"]
     contrast_outputs: list[str] = []
 
-    @staticmethod
-    def voxel_calc(
-        coordinate: tuple[int, int, int],
-        y: np.ndarray,
-        z: np.ndarray,
-        s: np.ndarray,
-        cmatdict: dict,
-    ) -> dict | None:
+    @classmethod
+    def pattern_calc(
+        cls, patterns: np.ndarray, z: np.ndarray, cmatdict: dict
+    ) -> dict[ResultKey, np.ndarray]:
+        _ = cmatdict
 
         z = demean(z)
 
-        isavailable = np.logical_and(np.isfinite(y), np.isfinite(s))
-        ismissing = np.logical_not(isavailable)
+        # drop observations with missing regressors
+        is_finite = np.all(np.isfinite(z), axis=1)
+        z = z[is_finite]
+        ismissing = np.logical_not(patterns[:, is_finite]).astype(np.float64)
+
+        pattern_count, n = ismissing.shape
+
+        # the likelihood of the intercept-only model has a closed form
+        proportion = ismissing.mean(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            llnull = n * (
+                special.xlogy(proportion, proportion)
+                + special.xlogy(1 - proportion, 1 - proportion)
+            )
+
+        llf = np.full(pattern_count, np.nan)
+        is_separated = np.zeros(pattern_count, dtype=bool)
+        for start in range(0, pattern_count, max_patterns_per_block):
+            block = slice(start, start + max_patterns_per_block)
+            llf[block], is_separated[block] = logit_batch(ismissing[block], z)
 
-        if np.all(ismissing) or np.all(isavailable):
-            return None  # zero variance
+        chisq = 2 * (llf - llnull)
+        dof = np.full(pattern_count, np.linalg.matrix_rank(z) - 1, dtype=np.float64)
+        zstat = chisq2z_convert_array(chisq, dof)
 
-        try:
-            model = sm.Logit(ismissing.ravel().astype(float), z, missing="drop")
-            result = model.fit(disp=False, warn_convergence=False)
+        # zero variance
+        is_valid = (proportion > 0) & (proportion < 1)
+        is_valid &= np.logical_not(is_separated)
+
+        pattern_result: dict[ResultKey, np.ndarray] = dict()
+        for map_name, values in [
+            ("mcarchisq", chisq),
+            ("mcardof", dof),
+            ("mcarz", zstat),
+        ]:
+            pattern_result[(None, map_name)] = np.where(is_valid, values, np.nan)
+
+        return pattern_result
+
+    @classmethod
+    def output_shapes(cls, cmatdict: dict) -> dict[ResultKey, tuple[int, ...]]:
+        _ = cmatdict
+        return {
+            (None, "mcarchisq"): (),
+            (None, "mcardof"): (),
+            (None, "mcarz"): (),
+        }
+
+    @classmethod
+    def write_outputs(
+        cls,
+        ref_img: nib.Nifti1Image,
+        cmatdict: dict,
+        coordinates: np.ndarray,
+        arrays: dict[ResultKey, np.ndarray],
+    ) -> dict:
+        output_files = dict()
 
-            chisq = result.llr
-            dof = result.df_model
-            zstat = chisq2z_convert(chisq, dof)
+        for (_, map_name), values in arrays.items():
+            fname = cls.write_map(ref_img, map_name, coordinates, values)
+            output_files[map_name] = str(fname)
 
-            voxel_dict = dict(mcarchisq=chisq, mcardof=dof, mcarz=zstat)
-            voxel_result = {coordinate: voxel_dict}
-            return voxel_result
-        except (PerfectSeparationError, np.linalg.LinAlgError):
-            return None
+        return output_files
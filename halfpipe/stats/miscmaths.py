@@ -4,8 +4,12 @@
 
 import math
 from abc import ABC, abstractmethod
+from typing import Callable
 
+import numpy as np
 from mpmath import autoprec, mp, mpf, mpmathify
+from numpy import typing as npt
+from scipy import special, stats
 
 
 def erfinv(a: mpf, tol: float = 1e-16) -> mpf:
@@ -187,3 +191,64 @@ def chisq2z_convert(x: float, k: int, **kwargs) -> float:
         return -math.inf
 
     return ChisqDistribution(k).auto_convert(x, **kwargs)
+
+
+def auto_convert_array(
+    x: npt.ArrayLike,
+    distribution: stats.rv_continuous,
+    convert: Callable[..., float],
+    *args: npt.ArrayLike,
+    min_log_p: float = -700.0,
+) -> np.ndarray:
+    """
+    Vectorized version of `Distribution.auto_convert`. We use the log-survival
+    and log-cumulative distribution functions from scipy, which are accurate
+    unless the p-value gets close to the smallest representable number. Only
+    for these extreme values we fall back to the arbitrary precision `convert`
+    function
+    """
+    x, *args = np.broadcast_arrays(np.asarray(x, dtype=np.float64), *args)
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        log_cdf = distribution.logcdf(x, *args)
+        log_cdfc = distribution.logsf(x, *args)
+
+        use_complement = log_cdfc < log_cdf
+        # it is more accurate to use the smaller of the two probabilities
+        z = np.where(
+            use_complement,
+            -special.ndtri_exp(log_cdfc),
+            special.ndtri_exp(log_cdf),
+        )
+
+    log_p = np.minimum(log_cdf, log_cdfc)
+    needs_fallback = np.isfinite(x) & np.logical_not(log_p > min_log_p)
+
+    for index in map(tuple, np.argwhere(needs_fallback)):
+        z[index] = convert(x[index].item(), *(a[index].item() for a in args))
+
+    return z
+
+
+def t2z_convert_array(x: npt.ArrayLike, nu: npt.ArrayLike) -> np.ndarray:
+    return auto_convert_array(x, stats.t, t2z_convert, nu)
+
+
+def f2z_convert_array(
+    x: npt.ArrayLike, d1: npt.ArrayLike, d2: npt.ArrayLike
+) -> np.ndarray:
+    z = auto_convert_array(x, stats.f, f2z_convert, d1, d2)
+
+    is_invalid = np.less_equal(x, 0) | np.less_equal(d1, 0) | np.less_equal(d2, 0)
+    z[np.broadcast_to(is_invalid, z.shape)] = -math.inf
+
+    return z
+
+
+def chisq2z_convert_array(x: npt.ArrayLike, k: npt.ArrayLike) -> np.ndarray:
+    z = auto_convert_array(x, stats.chi2, chisq2z_convert, k)
+
+    is_invalid = np.less_equal(x, 0) | np.less_equal(k, 0)
+    z[np.broadcast_to(is_invalid, z.shape)] = -math.inf
+
+    return z
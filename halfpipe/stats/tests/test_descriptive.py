@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from ..descriptive import Descriptive
+
+
+def test_Descriptive_pattern_calc():
+    np.random.seed(0)
+
+    n, pattern_count = 40, 25
+
+    z = np.hstack([np.ones((n, 1)), 100.0 + np.random.randn(n, 2)])
+    z[3, 2] = np.nan  # is replaced with zero
+
+    patterns = np.random.rand(pattern_count, n) > 0.3
+
+    cmatdict = OrderedDict(
+        [
+            ("intercept", np.array([[1.0, 0.0, 0.0]])),
+            ("a", np.array([[0.0, 1.0, 0.0]])),
+            ("ab", np.array([[0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])),
+        ]
+    )
+
+    pattern_result = Descriptive.pattern_calc(patterns, z, cmatdict)
+
+    assert set(pattern_result.keys()) == set(Descriptive.output_shapes(cmatdict))
+
+    for i, pattern in enumerate(patterns):
+        zframe = pd.DataFrame(np.nan_to_num(z)[pattern])
+
+        for name in ["a", "ab"]:
+            cmat = cmatdict[name]
+            assert np.allclose(pattern_result[(name, "mean")][i], cmat @ zframe.mean())
+            assert np.allclose(pattern_result[(name, "std")][i], cmat @ zframe.std())
@@ -4,9 +4,11 @@
 
 import os
 
+import nibabel as nib
+import numpy as np
 import pytest
 
-from ..fit import fit
+from ..fit import fit, load_data
 
 
 @pytest.mark.slow
@@ -29,3 +31,133 @@ def test_fit(tmp_path, wakemandg_hensonrn):
     assert len(result) > 0
     assert "hetchisq" in result
     assert "mcarz" in result
+
+
+def make_synthetic_data(tmp_path, subject_count=20, shape=(5, 4, 3)):
+    np.random.seed(0)
+
+    cope_files = list()
+    var_cope_files = list()
+    mask_files = list()
+
+    affine = np.eye(4)
+    for i in range(subject_count):
+        cope = np.random.randn(*shape)
+        var_cope = np.random.gamma(2.0, 0.5, size=shape)
+        mask = np.random.rand(*shape) > 0.1
+
+        for data, files in [
+            (cope, cope_files),
+            (var_cope, var_cope_files),
+            (mask.astype(np.uint8), mask_files),
+        ]:
+            path = tmp_path / f"{len(files):02d}_{id(files):x}.nii.gz"
+            nib.save(nib.Nifti1Image(data, affine), path)
+            files.append(path)
+
+    regressors = dict(
+        intercept=[1.0] * subject_count,
+        age=np.random.randn(subject_count).tolist(),
+        sex=np.random.randn(subject_count).tolist(),
+    )
+    names = list(regressors.keys())
+    contrasts = [
+        ("intercept", "T", names, [1, 0, 0]),
+        ("age", "T", names, [0, 1, 0]),
+        (
+            "agesex",
+            "F",
+            [("age", "T", names, [0, 1, 0]), ("sex", "T", names, [0, 0, 1])],
+        ),
+    ]
+
+    return cope_files, var_cope_files, mask_files, regressors, contrasts
+
+
+def test_fit_num_threads(tmp_path):
+    os.chdir(str(tmp_path))
+
+    data = make_synthetic_data(tmp_path)
+    algorithms_to_run = ["flame1", "heterogeneity", "mcartest"]
+
+    results = list()
+    for num_threads in [1, 2]:
+        path = tmp_path / f"num_threads-{num_threads:d}"
+        path.mkdir()
+        os.chdir(str(path))
+
+        results.append(fit(*data, algorithms_to_run, num_threads))
+
+    a, b = results
+    assert a.keys() == b.keys()
+    assert {"copes", "zstats", "mean", "hetchisq", "mcarz"} <= a.keys()
+
+    for key in a.keys():
+        if isinstance(a[key], str):
+            a[key], b[key] = [a[key]], [b[key]]
+
+        for x, y in zip(a[key], b[key]):
+            if x is False:
+                assert y is False
+                continue
+
+            x = nib.load(x).get_fdata()
+            y = nib.load(y).get_fdata()
+            assert np.any(np.isfinite(x))
+            assert np.allclose(x, y, equal_nan=True)
+
+
+def test_fit_memory_gb(tmp_path):
+    os.chdir(str(tmp_path))
+
+    data = make_synthetic_data(tmp_path)
+    algorithms_to_run = ["flame1"]
+
+    results = list()
+    for memory_gb in [None, 1e-6]:  # read one slice at a time
+        path = tmp_path / f"memory_gb-{memory_gb}"
+        path.mkdir()
+        os.chdir(str(path))
+
+        results.append(fit(*data, algorithms_to_run, 1, memory_gb=memory_gb))
+
+    a, b = results
+    assert a.keys() == b.keys()
+
+    for x, y in zip(a["zstats"], b["zstats"]):
+        x = nib.load(x).get_fdata()
+        y = nib.load(y).get_fdata()
+        assert np.any(np.isfinite(x))
+        assert np.allclose(x, y, equal_nan=True)
+
+
+def test_load_data_patterns(tmp_path):
+    cope_files, var_cope_files, mask_files, regressors, contrasts = make_synthetic_data(
+        tmp_path
+    )
+    shared, voxel_count = load_data(
+        cope_files,
+        var_cope_files,
+        mask_files,
+        regressors,
+        contrasts,
+        ["flame1"],
+        tmp_path,
+        memory_gb=1e-6,  # use multiple slabs
+    )
+
+    y = np.load(shared.y)[:voxel_count]
+    s = np.load(shared.s)[:voxel_count]
+    available = np.isfinite(y) & np.isfinite(s)
+
+    patterns = np.load(shared.patterns)
+    pattern_indices = np.load(shared.pattern_indices)
+    order = np.load(shared.order)
+
+    # each pattern is stored once and matches the voxels that refer to it
+    assert np.unique(patterns, axis=0).shape == patterns.shape
+    assert np.array_equal(patterns[pattern_indices], available)
+
+    # voxels are ordered so that the voxels of a pattern are contiguous
+    assert np.array_equal(np.sort(order), np.arange(voxel_count))
+    assert np.all(np.diff(pattern_indices[order]) >= 0)
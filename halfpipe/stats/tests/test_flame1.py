@@ -13,7 +13,9 @@ from nipype.pipeline import engine as pe
 
 from ...interfaces.fixes.flameo import FLAMEO as FSLFLAMEO
 from ...interfaces.imagemaths.merge import _merge, _merge_mask
+from ..base import PatternDesign
 from ..fit import fit
+from ..flame1 import FLAME1
 
 
 @pytest.mark.slow
@@ -132,3 +134,63 @@ def test_FLAME1(tmp_path, wakemandg_hensonrn, use_var_cope):
             assert (
                 float(np.abs(a0 - a1).mean()) < 5e-2
             ), f"Too high mean error average for {k}"
+
+
+def test_FLAME1_chunk_calc():
+    np.random.seed(0)
+
+    n, v = 50, 60
+
+    z = np.hstack([np.ones((n, 1)), np.random.randn(n, 2)])
+    s = np.random.gamma(2.0, 0.5, size=(n, v))
+    y = z @ np.random.randn(3, v) + np.random.randn(n, v) * np.sqrt(s + 0.5)
+
+    # three patterns of missing observations
+    y[:5, : v // 3] = np.nan
+    s[45:, v // 3 : 2 * v // 3] = np.nan
+
+    coordinates = [(i, 0, 0) for i in range(v)]
+    cmatdict = OrderedDict(
+        [
+            ("intercept", np.array([[1.0, 0.0, 0.0]])),
+            ("a", np.array([[0.0, 1.0, 0.0]])),
+            ("ab", np.array([[0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])),
+        ]
+    )
+
+    arrays = {
+        key: np.full((v, *shape), np.nan)
+        for key, shape in FLAME1.output_shapes(cmatdict).items()
+    }
+
+    available = np.isfinite(y) & np.isfinite(s)
+    patterns, pattern_indices = np.unique(available, axis=1, return_inverse=True)
+    for j, pattern in enumerate(patterns.T):
+        (voxel_indices,) = np.nonzero(np.ravel(pattern_indices) == j)
+        assert np.all(np.diff(voxel_indices) == 1)
+        run = slice(voxel_indices[0], voxel_indices[-1] + 1)
+
+        FLAME1.chunk_calc(
+            coordinates[run],
+            y[:, run],
+            s[:, run],
+            PatternDesign(z, pattern),
+            cmatdict,
+            {key: array[run] for key, array in arrays.items()},
+        )
+
+    for i, coordinate in enumerate(coordinates):
+        voxel_result = FLAME1.voxel_calc(
+            coordinate,
+            y[:, i, np.newaxis].copy(),
+            z,
+            s[:, i, np.newaxis].copy(),
+            cmatdict,
+        )
+        assert voxel_result is not None
+
+        for (name, map_name), array in arrays.items():
+            a = voxel_result[name][coordinate][map_name]
+            b = array[i]
+
+            assert np.allclose(a, b, rtol=1e-4), f"Mismatch for {map_name}"
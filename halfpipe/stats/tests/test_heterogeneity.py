@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+
+from ..base import PatternDesign
+from ..heterogeneity import InvGammaML, het_on_voxel, het_on_voxels
+
+
+def test_InvGammaML_fit_batch():
+    np.random.seed(0)
+
+    x = np.random.gamma(2.0, 0.5, size=(30, 10))
+    ϑ = InvGammaML.fit_batch(x)
+
+    for i in range(x.shape[1]):
+        # the jacobian is zero at the maximum likelihood estimate
+        assert np.allclose(InvGammaML.jacobian(ϑ[i], x[:, i]), 0, atol=1e-6)
+        assert np.allclose(ϑ[i], InvGammaML.fit(x[:, i]), rtol=1e-3)
+
+
+def test_het_on_voxels():
+    np.random.seed(0)
+
+    n, v = 40, 50
+
+    z = np.hstack([np.ones((n, 1)), np.random.randn(n, 2)])
+    design = PatternDesign(z, np.ones(n, dtype=bool))
+
+    s = np.random.gamma(2.0, 0.5, size=(n, v))
+    τ2 = np.random.choice([0.0, 0.1, 1.0, 5.0], size=v)
+    y = design.demeaned_z @ np.random.randn(3, v)
+    y += np.random.randn(n, v) * np.sqrt(s + τ2)
+
+    s[:, 0] = -1  # invalid voxel
+
+    voxel_dict, is_valid = het_on_voxels(y, design.demeaned_z, s, design.outer_products)
+
+    assert not is_valid[0]
+    assert np.all(is_valid[1:])
+
+    for i in range(1, v):
+        reference = het_on_voxel(
+            y[:, i, np.newaxis].copy(), design.demeaned_z, s[:, i, np.newaxis].copy()
+        )
+
+        for map_name, value in reference.items():
+            rtol = 1e-3 if map_name == "hetgamma" else 1e-5
+            assert np.allclose(
+                voxel_dict[map_name][i], np.squeeze(value), rtol=rtol, atol=1e-8
+            ), f"Mismatch for {map_name}"
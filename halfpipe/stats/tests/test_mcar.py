@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import numpy as np
+import statsmodels.api as sm
+
+from ..base import demean
+from ..mcar import MCARTest
+
+
+def test_MCARTest_pattern_calc():
+    np.random.seed(0)
+
+    n, pattern_count = 60, 20
+
+    z = np.hstack([np.ones((n, 1)), np.random.randn(n, 2)])
+    patterns = np.random.rand(pattern_count, n) > np.random.rand(pattern_count, 1)
+
+    patterns[0] = True  # nothing missing
+    patterns[1] = z[:, 1] > 0  # perfect separation
+
+    pattern_result = MCARTest.pattern_calc(patterns, z, dict())
+
+    for i, pattern in enumerate(patterns):
+        chisq = pattern_result[(None, "mcarchisq")][i]
+        dof = pattern_result[(None, "mcardof")][i]
+
+        if i < 2:
+            assert np.isnan(chisq) and np.isnan(dof)
+            continue
+
+        model = sm.Logit(np.logical_not(pattern).astype(float), demean(z))
+        result = model.fit(disp=False, warn_convergence=False)
+
+        assert np.isclose(chisq, result.llr)
+        assert dof == result.df_model
+
+    assert np.all(np.isfinite(pattern_result[(None, "mcarz")][2:]))
@@ -9,7 +9,14 @@ import numpy as np
 import pytest
 from scipy import stats
 
-from ..miscmaths import chisq2z_convert, f2z_convert, t2z_convert
+from ..miscmaths import (
+    chisq2z_convert,
+    chisq2z_convert_array,
+    f2z_convert,
+    f2z_convert_array,
+    t2z_convert,
+    t2z_convert_array,
+)
 
 
 def t2z_convert_numpy(t, dof):
@@ -152,3 +159,64 @@ def test_gmpy():
     from mpmath.libmp import BACKEND
 
     assert BACKEND == "gmpy"
+
+
+# array tests
+
+
+@pytest.mark.parametrize("dof", [2, 10, 30])
+def test_t2z_convert_array(dof):
+    t = np.hstack([np.linspace(-7, 7, num=15), np.logspace(1, 4, num=5)])
+
+    z = t2z_convert_array(t, dof)
+    assert np.allclose(z, [t2z_convert(x, dof) for x in t])
+    assert np.allclose(-z, t2z_convert_array(-t, dof))  # symmetric
+
+
+@pytest.mark.parametrize("d1,d2", [(1, 1), (5, 2), (10, 100)])
+def test_f2z_convert_array(d1, d2):
+    f = np.hstack([np.linspace(1e-3, 7, num=10), np.logspace(2, 4, num=5)])
+
+    z = f2z_convert_array(f, d1, d2)
+    assert np.allclose(z, [f2z_convert(x, d1, d2) for x in f])
+
+
+@pytest.mark.parametrize("k", [2, 10, 30])
+def test_chisq2z_convert_array(k):
+    x = np.hstack([np.linspace(1e-3, 7, num=10), np.logspace(1, 3, num=5)])
+
+    z = chisq2z_convert_array(x, k)
+    assert np.allclose(z, [chisq2z_convert(a, k) for a in x])
+
+
+@pytest.mark.slow
+@pytest.mark.timeout(600)
+def test_convert_array_huge():
+    t = np.logspace(5, 100, num=10)
+    assert np.allclose(t2z_convert_array(t, 30), [t2z_convert(x, 30) for x in t])
+
+    x = np.hstack([np.logspace(-100, -4, num=10), np.logspace(4, 100, num=10)])
+    assert np.allclose(
+        f2z_convert_array(x, 10, 100), [f2z_convert(a, 10, 100) for a in x]
+    )
+    assert np.allclose(
+        chisq2z_convert_array(x, 30), [chisq2z_convert(a, 30) for a in x]
+    )
+
+
+def test_convert_array_nonfinite():
+    x = np.array([np.inf, -np.inf, np.nan])
+
+    assert np.array_equal(t2z_convert_array(x, 1), x, equal_nan=True)
+    assert np.array_equal(f2z_convert_array(x, 1, 1), x, equal_nan=True)
+    assert np.array_equal(chisq2z_convert_array(x, 1), x, equal_nan=True)
+
+
+@pytest.mark.timeout(30)
+def test_convert_array_full_brain():
+    # number of voxels in a 2mm brain mask
+    t = np.random.standard_t(30, size=228483)
+    t[:100] *= 1e6  # some extreme values
+
+    z = t2z_convert_array(t, 30)
+    assert np.all(np.isfinite(z))
@@ -5,11 +5,12 @@
 import pickle
 from pathlib import Path
 from shelve import open as open_shelf
+from timeit import default_timer as timer
 from typing import Any, Mapping, Optional, Union
 from uuid import UUID
 
 from ..utils import logger
-from .pickle import dump_pickle_lzma, load_pickle_lzma
+from .pickle import dump_pickle_cache, load_pickle_cache
 
 
 def _make_cache_file_path(type_str: str, uuid: Optional[Union[UUID, str]]):
@@ -33,7 +34,8 @@ def uncache_obj(
     cache_file_path = str(Path(workdir) / _make_cache_file_path(type_str, uuid))
 
     try:
-        obj = load_pickle_lzma(cache_file_path)
+        start = timer()
+        obj = load_pickle_cache(cache_file_path)
 
         if obj is not None:
             if uuid is not None and hasattr(obj, "uuid"):
@@ -41,7 +43,10 @@ def uncache_obj(
                 if obj_uuid is None or str(obj_uuid) != str(uuid):
                     return None
 
-            logger.info(f"Using {display_str} from cache at {cache_file_path}")
+            logger.info(
+                f"Using {display_str} from cache at {cache_file_path} "
+                f"(loaded in {timer() - start:.1f} seconds)"
+            )
 
             return obj
 
@@ -62,6 +67,7 @@ def cache_obj(
     type_str: str,
     obj: Any,
     uuid: Optional[Union[UUID, str]] = None,
+    codec_name: Optional[str] = None,
 ):
     if uuid is None:
         uuid = getattr(obj, "uuid", None)
@@ -75,4 +81,9 @@ def cache_obj(
             shelf.update(obj)
 
     else:
-        dump_pickle_lzma(cache_file_path, obj)
+        start = timer()
+        file_path = dump_pickle_cache(cache_file_path, obj, codec_name=codec_name)
+        logger.info(
+            f"Saved {type_str} to cache at {file_path} "
+            f"in {timer() - start:.1f} seconds"
+        )
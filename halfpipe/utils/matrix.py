@@ -27,3 +27,46 @@ def atleast_4d(ary):
 
     else:
         return ary
+
+
+def save_matrix(path, array, symmetric: bool = False):
+    """
+    Save a matrix in binary numpy format. For symmetric matrices, only the
+    upper triangle including the diagonal is stored
+    """
+    import numpy as np
+
+    array = np.asarray(array)
+
+    if symmetric is True:
+        n, m = array.shape
+        assert n == m
+        upper_triangle = array[np.triu_indices(n)]
+        np.savez(path, upper_triangle=upper_triangle, shape=np.array(array.shape))
+    else:
+        np.savez(path, array=array)
+
+
+def load_matrix(path):
+    """
+    Load a matrix that was saved as a text file or with `save_matrix`
+    """
+    from pathlib import Path
+
+    import numpy as np
+
+    if Path(path).suffix != ".npz":
+        return np.loadtxt(path, ndmin=2)
+
+    with np.load(path) as npz_file:
+        if "upper_triangle" not in npz_file:
+            return npz_file["array"]
+
+        n, _ = npz_file["shape"]
+        upper_triangle = npz_file["upper_triangle"]
+
+    array = np.empty((n, n), dtype=upper_triangle.dtype)
+    array[np.triu_indices(n)] = upper_triangle
+    lower = np.tril_indices(n, k=-1)
+    array[lower] = array.T[lower]
+    return array
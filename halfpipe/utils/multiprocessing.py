@@ -12,6 +12,31 @@ from typing import Union
 
 from ..logging import logging_context
 
+# heavy modules that the worker processes would otherwise each import again
+# when they unpickle their first node
+preload_modules = [
+    "halfpipe",
+    "numpy",
+    "scipy",
+    "pandas",
+    "nibabel",
+    "matplotlib.pyplot",
+    "nipype",
+    "nipype.pipeline.engine",
+    "nipype.interfaces.base",
+    "niworkflows",
+    "fmriprep",
+    "halfpipe.plugins.multiproc",
+]
+
+
+def set_forkserver_preload():
+    """
+    Needs to be called before the forkserver process is started, which happens
+    when the first process is created
+    """
+    get_context("forkserver").set_forkserver_preload(preload_modules)
+
 
 def initializer(logging_args, host_env):
     from ..logging import setup as setup_logging
@@ -6,9 +6,12 @@ import gzip
 import lzma
 import pickle
 import re
-from io import BufferedIOBase
+import struct
+from io import BufferedIOBase, BytesIO
+from os import getenv
 from pathlib import Path
-from typing import Callable, Literal
+from timeit import default_timer as timer
+from typing import IO, Callable, Literal
 
 from traits.trait_errors import TraitError
 
@@ -16,35 +19,239 @@ from . import logger
 from .future import chdir
 from .path import split_ext
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+pickle_extension = ".pickle"
 pickle_lzma_extension = ".pickle.xz"
 
+lzma_magic = b"\xfd7zXZ\x00"
+
+Frame = bytes | bytearray | memoryview
+
+
+class Codec:
+    """
+    Compression for cached pickle files. The codec is recorded in the header of
+    each file, so files can always be read regardless of the current default.
+    Decompressed frames need to be writable, because they back the buffers of
+    objects like numpy arrays
+    """
+
+    name: str = "none"
+    available: bool = True
+
+    def compress(self, data: Frame) -> Frame:
+        return data
+
+    def decompress(self, data: bytearray) -> bytearray:
+        return data
+
+
+class LZMACodec(Codec):
+    name = "lzma"
+
+    def compress(self, data: Frame) -> Frame:
+        return lzma.compress(data)
+
+    def decompress(self, data: bytearray) -> bytearray:
+        return bytearray(lzma.decompress(data))
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    available = zstandard is not None
+
+    def compress(self, data: Frame) -> Frame:
+        if zstandard is None:
+            raise ValueError("The zstd codec requires the `zstandard` package")
+        return zstandard.ZstdCompressor(level=3, threads=-1).compress(data)
+
+    def decompress(self, data: bytearray) -> bytearray:
+        if zstandard is None:
+            raise ValueError("The zstd codec requires the `zstandard` package")
+
+        size = zstandard.frame_content_size(data)
+        if size < 0:  # unknown size
+            return bytearray(zstandard.ZstdDecompressor().decompress(data))
+
+        # decompress directly into the output buffer
+        out = bytearray(size)
+        view = memoryview(out)
+        with zstandard.ZstdDecompressor().stream_reader(data) as reader:
+            offset = 0
+            while offset < size:
+                count = reader.readinto(view[offset:])
+                if count == 0:
+                    raise EOFError("Unexpected end of zstd frame")
+                offset += count
+        return out
+
+
+codecs: dict[str, Codec] = {
+    codec.name: codec for codec in [Codec(), LZMACodec(), ZstdCodec()]
+}
+
+
+def get_default_codec_name() -> str:
+    codec_name = getenv("HALFPIPE_CACHE_CODEC")
+    if codec_name is None:
+        return "zstd" if codecs["zstd"].available else "none"
+
+    codec = codecs.get(codec_name)
+    if codec is None:
+        logger.warning(
+            f'Unknown cache codec "{codec_name}" in HALFPIPE_CACHE_CODEC. '
+            'Using "none" instead'
+        )
+        return "none"
+    if not codec.available:
+        logger.warning(
+            f'Cache codec "{codec_name}" is not available because its package is '
+            'not installed. Using "none" instead'
+        )
+        return "none"
+
+    return codec_name
+
+
+default_codec_name = get_default_codec_name()
 
-def load_pickle_lzma(file_path: str):
-    if not file_path.endswith(pickle_lzma_extension):
-        file_path = f"{file_path}{pickle_lzma_extension}"
 
+class Header:
+    """
+    Versioned header of cached pickle files. The pickle data and each of its
+    out-of-band buffers follow as separate frames, which are each compressed
+    with the codec
+    """
+
+    magic = b"HALFPIPE"
+    version = 1
+
+    header_struct = struct.Struct("<8sB8sI")  # magic, version, codec, frame count
+    frame_struct = struct.Struct("<Q")  # length of frame
+
+    @classmethod
+    def write(cls, file_handle: IO[bytes], codec: Codec, frames: list[Frame]) -> None:
+        file_handle.write(
+            cls.header_struct.pack(
+                cls.magic, cls.version, codec.name.encode(), len(frames)
+            )
+        )
+        for frame in frames:
+            data = codec.compress(frame)
+            file_handle.write(cls.frame_struct.pack(len(data)))
+            file_handle.write(data)
+
+    @classmethod
+    def read(cls, file_handle: IO[bytes]) -> list[bytearray]:
+        magic, version, codec_name, frame_count = cls.header_struct.unpack(
+            file_handle.read(cls.header_struct.size)
+        )
+        if magic != cls.magic:
+            raise ValueError("File is not a cached pickle")
+        if version > cls.version:
+            raise ValueError(f'Unsupported cached pickle version "{version:d}"')
+
+        codec = codecs[codec_name.rstrip(b"\x00").decode()]
+
+        frames: list[bytearray] = list()
+        for _ in range(frame_count):
+            (length,) = cls.frame_struct.unpack(file_handle.read(cls.frame_struct.size))
+            data = bytearray(length)
+            if file_handle.readinto(data) != length:  # type: ignore
+                raise EOFError()
+            frames.append(codec.decompress(data))
+
+        return frames
+
+
+def find_pickle(file_path: str | Path) -> Path | None:
+    """
+    Find a cached pickle file, falling back to the legacy `.pickle.xz` format
+    """
+    file_path = Path(file_path)
+    for candidate in [
+        file_path,
+        Path(f"{file_path}{pickle_extension}"),
+        Path(f"{file_path}{pickle_lzma_extension}"),
+    ]:
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def read_pickle(file_handle: IO[bytes]):
+    if file_handle.peek(len(lzma_magic))[: len(lzma_magic)] == lzma_magic:  # type: ignore
+        with lzma.open(file_handle, "rb") as lzma_file_handle:
+            return Unpickler(lzma_file_handle).load()
+
+    data, *buffers = Header.read(file_handle)
+    return Unpickler(BytesIO(data), buffers=buffers).load()
+
+
+def load_pickle_cache(file_path: str | Path):
+    found_path = find_pickle(file_path)
+    if found_path is None:
+        logger.debug(f'Could not find "{file_path}"')
+        return None
+
+    start = timer()
     try:
-        with lzma.open(file_path, "rb") as file_handle:
-            return Unpickler(file_handle).load()
+        with open(found_path, "rb") as file_handle:
+            obj = read_pickle(file_handle)
 
-    except (lzma.LZMAError, TraitError, EOFError, AttributeError) as e:
-        logger.error(f'Error while reading "{file_path}"', exc_info=e)
+    except (
+        lzma.LZMAError,
+        TraitError,
+        EOFError,
+        AttributeError,
+        ValueError,
+        KeyError,
+        struct.error,
+        pickle.UnpicklingError,
+    ) as e:
+        logger.error(f'Error while reading "{found_path}"', exc_info=e)
         return None
 
+    logger.debug(f'Loaded "{found_path}" in {timer() - start:.3f} seconds')
+    return obj
 
-def dump_pickle_lzma(file_path: str, obj):
-    if not file_path.endswith(pickle_lzma_extension):
-        file_path = f"{file_path}{pickle_lzma_extension}"
 
-    if Path(file_path).is_file():
+def dump_pickle_cache(
+    file_path: str | Path, obj, codec_name: str | None = None
+) -> Path:
+    """
+    Write with pickle protocol 5, so that large buffers like numpy arrays are
+    passed to the codec directly without being copied into the pickle stream
+    """
+    if codec_name is None:
+        codec_name = default_codec_name
+    codec = codecs[codec_name]
+
+    file_path = Path(file_path)
+    if not file_path.name.endswith(pickle_extension):
+        file_path = Path(f"{file_path}{pickle_extension}")
+
+    if file_path.is_file():
         logger.warning(f'Overwriting existing file "{file_path}"')
 
-    try:
-        with lzma.open(file_path, "wb") as fptr:
-            pickle.dump(obj, fptr, protocol=pickle.HIGHEST_PROTOCOL)
+    start = timer()
+
+    buffers: list[pickle.PickleBuffer] = list()
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+
+    frames = [data, *(buffer.raw() for buffer in buffers)]
+    with open(file_path, "wb") as file_handle:
+        Header.write(file_handle, codec, frames)
 
-    except lzma.LZMAError as e:
-        logger.error(f'Error while writing "{file_path}"', exc_info=e)
+    logger.debug(
+        f'Saved "{file_path}" with codec "{codec.name}" '
+        f"in {timer() - start:.3f} seconds"
+    )
+    return file_path
 
 
 class Unpickler(pickle.Unpickler):
@@ -69,6 +276,8 @@ def load_pickle(file_path: str | Path):
         file_open = gzip.open
     elif file_extension == ".pickle.xz":
         file_open = lzma.open
+    elif file_extension == ".pickle":
+        return load_pickle_cache(file_path)
     else:
         raise ValueError()
 
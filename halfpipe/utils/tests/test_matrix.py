@@ -2,7 +2,10 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
-from ..matrix import load_vector
+import numpy as np
+import pytest
+
+from ..matrix import load_matrix, load_vector, save_matrix
 
 
 def test_load_vector(tmp_path):
@@ -17,3 +20,22 @@ def test_load_vector(tmp_path):
     b = load_vector(test_file_path)
 
     assert tuple(a) == tuple(b)
+
+
+@pytest.mark.parametrize("symmetric", [False, True])
+def test_save_matrix(tmp_path, symmetric):
+    np.random.seed(0)
+
+    array = np.random.rand(20, 20)
+    if symmetric:
+        array = array @ array.T
+
+    path = tmp_path / "matrix.npz"
+    save_matrix(path, array, symmetric=symmetric)
+
+    assert np.array_equal(load_matrix(path), array)
+
+    text_path = tmp_path / "matrix.tsv"
+    np.savetxt(text_path, array, delimiter="\t")
+
+    assert np.allclose(load_matrix(text_path), array)
@@ -9,9 +9,16 @@ import pickle
 from pathlib import Path
 from typing import Callable
 
+import numpy as np
 import pytest
 
-from ..pickle import load_pickle
+from ..pickle import (
+    Header,
+    dump_pickle_cache,
+    get_default_codec_name,
+    load_pickle,
+    load_pickle_cache,
+)
 
 
 @pytest.mark.parametrize(
@@ -28,3 +35,43 @@ def test_load_pickle(tmp_path: Path, file_names: str, function_mode: Callable) -
     with function_mode(tmp_path / file_names, "wb") as f:
         pickle.dump(test_list, f)
     assert load_pickle(tmp_path / file_names) == test_list
+
+
+@pytest.mark.parametrize("codec_name", ["none", "lzma", "zstd"])
+def test_pickle_cache(tmp_path: Path, codec_name: str) -> None:
+    if codec_name == "zstd":
+        pytest.importorskip("zstandard")
+
+    obj = dict(a=np.arange(100, dtype=np.float64), b=["hello", "world"])
+
+    file_path = dump_pickle_cache(tmp_path / "test", obj, codec_name=codec_name)
+    assert file_path.name == "test.pickle"
+
+    with open(file_path, "rb") as file_handle:
+        assert file_handle.read(len(Header.magic)) == Header.magic
+
+    for path in [tmp_path / "test", file_path]:
+        loaded = load_pickle_cache(path)
+        assert loaded["b"] == obj["b"]
+        assert np.all(loaded["a"] == obj["a"])
+        loaded["a"][0] = 1  # arrays need to be writeable
+
+    assert load_pickle(file_path)["b"] == obj["b"]
+
+
+def test_pickle_cache_legacy(tmp_path: Path) -> None:
+    test_list = ["hello", "world"]
+
+    with lzma.open(tmp_path / "test.pickle.xz", "wb") as f:
+        pickle.dump(test_list, f)
+    assert load_pickle_cache(tmp_path / "test") == test_list
+
+    assert load_pickle_cache(tmp_path / "missing") is None
+
+
+def test_default_codec_name(monkeypatch) -> None:
+    monkeypatch.setenv("HALFPIPE_CACHE_CODEC", "lzma")
+    assert get_default_codec_name() == "lzma"
+
+    monkeypatch.setenv("HALFPIPE_CACHE_CODEC", "missing")
+    assert get_default_codec_name() == "none"
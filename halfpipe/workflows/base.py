@@ -105,6 +105,9 @@ def init_workflow(workdir: Path, spec: Optional[Spec] = None) -> IdentifiableWor
 
         workflow.bids_to_sub_id_map[bids_subject] = subject
 
+    for subject, subject_sha1 in database.sha1_by_subject().items():
+        workflow.subject_uuids[subject] = uuid5(spec.uuid, subject_sha1 + __version__)
+
     bids_dir = Path(workdir) / "rawdata"
     bids_database.write(bids_dir)
 
@@ -6,12 +6,24 @@ import logging
 import re
 from argparse import Namespace
 from collections import OrderedDict, defaultdict
+from contextlib import nullcontext
 from copy import deepcopy
 from fnmatch import fnmatch
 from functools import partial
 from pathlib import Path
 from shutil import copyfile, rmtree
-from typing import Dict, List, Mapping, Optional, Set, Tuple, Union
+from typing import (
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from uuid import UUID
 
 import networkx as nx
 import nipype.pipeline.engine as pe
@@ -23,13 +35,23 @@ from ..fixes import Node
 from ..resource import get as getresource
 from ..utils.cache import cache_obj, uncache_obj
 from ..utils.format import format_like_bids, normalize_subject
+from ..utils.multiprocessing import Pool
 from ..utils.path import resolve
+from ..utils.pickle import (
+    dump_pickle_cache,
+    find_pickle,
+    load_pickle_cache,
+    pickle_extension,
+)
 from ..utils.table import SynchronizedTable
 from .base import IdentifiableWorkflow
 from .constants import constants
+from .graphstore import GraphStore
 
 max_chunk_size = 50  # subjects
 
+subject_graph_cache_directory = ".subject_graphs"
+
 
 class IdentifiableDiGraph(nx.DiGraph):
     uuid: Optional[str]
@@ -212,6 +234,45 @@ def prepare_graph(config, base_dir, uuid, graph):
     return graph
 
 
+def subject_graph_cache_path(workdir, subject: str, subject_uuid: UUID) -> Path:
+    subject_uuidstr = str(subject_uuid)[:8]
+    return (
+        Path(workdir)
+        / subject_graph_cache_directory
+        / f"{format_like_bids(subject)}.{subject_uuidstr}"
+    )
+
+
+def load_subject_graph(
+    cache_path: Path, base_dir: str
+) -> Optional[IdentifiableDiGraph]:
+    if find_pickle(cache_path) is None:
+        return None
+
+    graph = load_pickle_cache(cache_path)
+    if not isinstance(graph, IdentifiableDiGraph):
+        return None
+
+    for node in graph:
+        node.base_dir = base_dir  # in case the working directory was moved
+
+    return graph
+
+
+def prepare_subject_graph(
+    config, base_dir, uuid, item: Tuple[Optional[Path], nx.DiGraph]
+) -> nx.DiGraph:
+    cache_path, graph = item
+
+    graph = prepare_graph(config, base_dir, uuid, graph)
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        dump_pickle_cache(cache_path, graph)
+
+    return graph
+
+
 def init_flat_graph(workflow, workdir) -> nx.DiGraph:
     flat_graph = uncache_obj(
         workdir, ".flat_graph", workflow.uuid, display_str="flat graph"
@@ -228,8 +289,10 @@ def init_flat_graph(workflow, workdir) -> nx.DiGraph:
 
 
 def init_execgraph(
-    workdir: Union[Path, str], workflow: IdentifiableWorkflow
-) -> Dict[str, IdentifiableDiGraph]:
+    workdir: Union[Path, str],
+    workflow: IdentifiableWorkflow,
+    n_procs: Optional[int] = None,
+) -> Mapping[str, IdentifiableDiGraph]:
     logger = logging.getLogger("halfpipe")
 
     uuid = workflow.uuid
@@ -256,19 +319,12 @@ def init_execgraph(
 
     # create or load execgraph
 
-    graphs: Dict[str, IdentifiableDiGraph] = dict()
-
-    obj = uncache_obj(workdir, "graphs", uuid)
-    if isinstance(obj, Mapping):
-        for k, v in obj.items():
-            assert isinstance(v, IdentifiableDiGraph)
-            graphs[k] = v
-
-        if len(graphs) > 0:
-            return graphs
+    graph_store = GraphStore.load(workdir, uuid)
+    if graph_store is not None:
+        if len(graph_store) > 0:
+            return graph_store
         else:
             logger.warning("Re-generating invalid graphs")
-            graphs = dict()
 
     logger.info("Generating flat graph")
 
@@ -283,28 +339,65 @@ def init_execgraph(
     base_dir = str(workflow.base_dir)
     subject_nodes, input_source_dict = split_flat_graph(flat_graph, base_dir)
 
+    subject_uuids: Dict[str, UUID] = getattr(workflow, "subject_uuids", dict())
+
     graphs = OrderedDict()
+    cache_paths: Dict[str, Optional[Path]] = dict()
+    file_paths: Dict[str, Path] = dict()
     for s, nodes in sorted(subject_nodes.items(), key=lambda t: t[0]):
         s = workflow.bids_to_sub_id_map.get(s, s)
 
         if s == "model":
             raise ValueError('Subject cannot be named "model"')
 
+        cache_path = None
+        subject_uuid = subject_uuids.get(s)
+        if subject_uuid is not None:
+            cache_path = subject_graph_cache_path(workdir, s, subject_uuid)
+            file_paths[s] = Path(f"{cache_path}{pickle_extension}")
+
+            graph = load_subject_graph(cache_path, base_dir)
+            if graph is not None:
+                file_path = find_pickle(cache_path)
+                if file_path is not None:  # may be in the legacy format
+                    file_paths[s] = file_path
+                graph.uuid = uuid
+                graphs[s] = graph
+
+                flat_graph.remove_nodes_from(nodes)
+                continue
+
         subgraph: nx.DiGraph = flat_graph.subgraph(nodes).copy()
         graphs[s] = IdentifiableDiGraph(subgraph)
+        cache_paths[s] = cache_path
 
         flat_graph.remove_nodes_from(nodes)
 
     if len(flat_graph.nodes) > 0:
         graphs["model"] = IdentifiableDiGraph(flat_graph)
+        cache_paths["model"] = None  # depends on all subjects
 
-    logger.info("Expanding subgraphs")
+    logger.info(
+        f"Expanding {len(cache_paths):d} subgraphs "
+        f"and using {len(graphs) - len(cache_paths):d} subgraphs from cache"
+    )
 
     partial_prepare_graph = partial(
-        prepare_graph, workflow.config, workflow.base_dir, uuid
+        prepare_subject_graph, workflow.config, workflow.base_dir, uuid
     )
-    for s, graph in graphs.items():
-        graphs[s] = partial_prepare_graph(graph)
+    items = [(cache_paths[s], graphs[s]) for s in cache_paths.keys()]
+
+    if n_procs is None or n_procs < 2 or len(items) < 2:
+        it: Iterator = map(partial_prepare_graph, items)
+        cm: ContextManager = nullcontext()
+    else:
+        pool = Pool(processes=min(n_procs, len(items)))
+        it = pool.imap(partial_prepare_graph, items)
+        cm = pool
+
+    with cm:
+        for s, graph in zip(cache_paths.keys(), it):
+            graphs[s] = graph
 
     logger.info("Update input source at chunk boundaries")
 
@@ -315,6 +408,6 @@ def init_execgraph(
                 node.input_source.update(input_source_dict[fullname])
 
     logger.info(f'Created graphs for workflow "{uuidstr}"')
-    cache_obj(workdir, "graphs", graphs, uuid=uuid)
+    GraphStore.save(workdir, uuid, graphs, file_paths=file_paths)
 
     return graphs
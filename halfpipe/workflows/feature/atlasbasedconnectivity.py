@@ -4,12 +4,12 @@
 
 from pathlib import Path
 
-from nipype.algorithms import confounds as nac
 from nipype.interfaces import utility as niu
 from nipype.pipeline import engine as pe
 
 from ...interfaces.connectivity import ConnectivityMeasure
 from ...interfaces.imagemaths.resample import Resample
+from ...interfaces.imagemaths.tsnr import TSNR
 from ...interfaces.report.vals import CalcMean
 from ...interfaces.resultdict.datasink import ResultdictDatasink
 from ...interfaces.resultdict.make import MakeResultdicts
@@ -56,10 +56,13 @@ def init_atlasbasedconnectivity_wf(
     )
 
     min_region_coverage = 1
+    output_format = "tsv"
     if feature is not None:
         inputnode.inputs.atlas_names = feature.atlases
         if hasattr(feature, "min_region_coverage"):
             min_region_coverage = feature.min_region_coverage
+        if hasattr(feature, "output_format"):
+            output_format = feature.output_format
 
     if atlas_files is not None:
         inputnode.inputs.atlas_files = atlas_files
@@ -116,7 +119,10 @@ def init_atlasbasedconnectivity_wf(
     #
     connectivitymeasure = pe.MapNode(
         ConnectivityMeasure(
-            background_label=0, min_region_coverage=min_region_coverage
+            background_label=0,
+            min_region_coverage=min_region_coverage,
+            output_format=output_format,
+            cache_directory=workdir,
         ),
         name="connectivitymeasure",
         iterfield=["atlas_file"],
@@ -138,18 +144,18 @@ def init_atlasbasedconnectivity_wf(
     )
 
     #
-    tsnr = pe.Node(interface=nac.TSNR(), name="tsnr", mem_gb=memcalc.series_std_gb)
+    tsnr = pe.Node(interface=TSNR(), name="tsnr", mem_gb=memcalc.series_std_gb)
     workflow.connect(inputnode, "bold", tsnr, "in_file")
 
     calcmean = pe.MapNode(
-        CalcMean(),
+        CalcMean(cache_directory=workdir),
         iterfield="parcellation",
         name="calcmean",
         mem_gb=memcalc.series_std_gb,
     )
     workflow.connect(resample, "output_image", calcmean, "parcellation")
     workflow.connect(inputnode, "mask", calcmean, "mask")
-    workflow.connect(tsnr, "tsnr_file", calcmean, "in_file")
+    workflow.connect(tsnr, "out_file", calcmean, "in_file")
 
     workflow.connect(calcmean, "mean", make_resultdicts, "mean_atlas_tsnr")
 
@@ -5,17 +5,17 @@
 from pathlib import Path
 
 from fmriprep import config
-from nipype.algorithms import confounds as nac
-from nipype.interfaces import fsl
 from nipype.interfaces import utility as niu
 from nipype.pipeline import engine as pe
 
+from ...interfaces.imagemaths.apply_mask import ApplyMask
 from ...interfaces.imagemaths.max_intensity import MaxIntensity
 from ...interfaces.imagemaths.resample import Resample
+from ...interfaces.imagemaths.tsnr import TSNR
 from ...interfaces.report.vals import CalcMean
 from ...interfaces.resultdict.datasink import ResultdictDatasink
 from ...interfaces.resultdict.make import MakeResultdicts
-from ...interfaces.stats.dof import MakeDofVolume
+from ...interfaces.stats.glm import GLM, SpatialRegression
 from ...interfaces.utility.tsv import FillNA, MergeColumns
 from ...utils.format import format_workflow
 from ..constants import constants
@@ -169,23 +169,22 @@ def init_dualregression_wf(
 
     # Delete zero voxels for the maps
     applymask = pe.MapNode(
-        fsl.ApplyMask(),
+        ApplyMask(),
         name="applymask",
         iterfield="in_file",
         mem_gb=memcalc.volume_std_gb,
     )
-    workflow.connect(inputnode, "mask", applymask, "mask_file")
+    workflow.connect(inputnode, "mask", applymask, "mask")
     workflow.connect(resample, "output_image", applymask, "in_file")
 
     # first step, calculate spatial regression of ICA components on to the
     # bold file
-    spatialglm = pe.MapNode(
-        fsl.GLM(out_file="beta", demean=True),
+    spatialglm = pe.Node(
+        SpatialRegression(),
         name="spatialglm",
-        iterfield="design",
         mem_gb=memcalc.series_std_gb * 5,
     )
-    workflow.connect(applymask, "out_file", spatialglm, "design")
+    workflow.connect(applymask, "out_file", spatialglm, "map_files")
     workflow.connect(inputnode, "bold", spatialglm, "in_file")
     workflow.connect(inputnode, "mask", spatialglm, "mask")
 
@@ -200,7 +199,7 @@ def init_dualregression_wf(
         iterfield="map_timeseries_file",
         name="contrasts",
     )
-    workflow.connect(spatialglm, "out_file", contrasts, "map_timeseries_file")
+    workflow.connect(spatialglm, "out_files", contrasts, "map_timeseries_file")
     workflow.connect(inputnode, "confounds_selected", contrasts, "confounds_file")
 
     workflow.connect(
@@ -211,7 +210,7 @@ def init_dualregression_wf(
     design = pe.MapNode(
         MergeColumns(2), iterfield=["in1", "column_names1"], name="design"
     )
-    workflow.connect(spatialglm, "out_file", design, "in1")
+    workflow.connect(spatialglm, "out_files", design, "in1")
     workflow.connect(contrasts, "map_component_names", design, "column_names1")
     workflow.connect(inputnode, "confounds_selected", design, "in2")
 
@@ -220,44 +219,19 @@ def init_dualregression_wf(
     fillna = pe.MapNode(FillNA(), iterfield="in_tsv", name="fillna")
     workflow.connect(design, "out_no_header", fillna, "in_tsv")
 
-    temporalglm = pe.MapNode(
-        fsl.GLM(
-            out_file="beta.nii.gz",
-            out_cope="cope.nii.gz",
-            out_varcb_name="varcope.nii.gz",
-            out_z_name="zstat.nii.gz",
-            demean=True,
-        ),
-        name="temporalglm",
-        iterfield=["design", "contrasts"],
-        mem_gb=memcalc.series_std_gb * 5,
-    )
+    temporalglm = pe.Node(GLM(), name="temporalglm", mem_gb=memcalc.series_std_gb * 5)
     workflow.connect(inputnode, "bold", temporalglm, "in_file")
     workflow.connect(inputnode, "mask", temporalglm, "mask")
-    workflow.connect(fillna, "out_no_header", temporalglm, "design")
+    workflow.connect(fillna, "out_no_header", temporalglm, "designs")
     workflow.connect(contrasts, "out_no_header", temporalglm, "contrasts")
 
-    # make dof volume
-    makedofvolume = pe.MapNode(
-        MakeDofVolume(),
-        iterfield=["design"],
-        name="makedofvolume",
-    )
-    workflow.connect(inputnode, "bold", makedofvolume, "bold_file")
-    workflow.connect(fillna, "out_no_header", makedofvolume, "design")
-
-    for glmattr, resultattr in (("cope", "effect"), ("varcb", "variance"), ("z", "z")):
-        split = pe.MapNode(
-            fsl.Split(dimension="t"),
-            iterfield="in_file",
-            name=f"split{resultattr}images",
-        )
-        workflow.connect(temporalglm, f"out_{glmattr}", split, "in_file")
-        workflow.connect(split, "out_files", make_resultdicts_b, resultattr)
-    workflow.connect(makedofvolume, "out_file", make_resultdicts_b, "dof")
+    workflow.connect(temporalglm, "copes", make_resultdicts_b, "effect")
+    workflow.connect(temporalglm, "varcopes", make_resultdicts_b, "variance")
+    workflow.connect(temporalglm, "zstats", make_resultdicts_b, "z")
+    workflow.connect(temporalglm, "dof_files", make_resultdicts_b, "dof")
 
     #
-    tsnr = pe.Node(nac.TSNR(), name="tsnr", mem_gb=memcalc.series_std_gb)
+    tsnr = pe.Node(TSNR(), name="tsnr", mem_gb=memcalc.series_std_gb)
     workflow.connect(inputnode, "bold", tsnr, "in_file")
 
     maxintensity = pe.MapNode(
@@ -275,7 +249,7 @@ def init_dualregression_wf(
         mem_gb=memcalc.series_std_gb,
     )
     workflow.connect(maxintensity, "out_file", calcmean, "parcellation")
-    workflow.connect(tsnr, "tsnr_file", calcmean, "in_file")
+    workflow.connect(tsnr, "out_file", calcmean, "in_file")
 
     workflow.connect(calcmean, "mean", make_resultdicts_b, "mean_component_tsnr")
 
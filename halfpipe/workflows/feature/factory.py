@@ -28,6 +28,36 @@ def _find_setting(setting_name, spec):
     return setting
 
 
+def _find_band(setting) -> tuple[float, float] | None:
+    """
+    Frequency band in hertz that is passed by the bandpass filter of a setting.
+    Gaussian filter widths are converted to cutoff frequencies as one over
+    the width in seconds
+    """
+    bandpass_filter = setting.get("bandpass_filter")
+    if not isinstance(bandpass_filter, dict):
+        return None
+
+    if bandpass_filter.get("type") == "frequency_based":
+        low, high = bandpass_filter.get("low"), bandpass_filter.get("high")
+    elif bandpass_filter.get("type") == "gaussian":
+        hp_width, lp_width = bandpass_filter.get("hp_width"), bandpass_filter.get(
+            "lp_width"
+        )
+        low = 1 / hp_width if hp_width else None
+        high = 1 / lp_width if lp_width else None
+    else:
+        return None
+
+    if low is None and high is None:
+        return None
+
+    return (
+        float(low) if low is not None else 0.0,
+        float(high) if high is not None else float("inf"),
+    )
+
+
 class FeatureFactory(Factory):
     def __init__(self, ctx, setting_factory):
         super(FeatureFactory, self).__init__(ctx)
@@ -158,6 +188,8 @@ class FeatureFactory(Factory):
             vwf = init_reho_wf(**kwargs)
         elif feature.type == "falff":
             confounds_action = "regression"
+            setting = _find_setting(feature.setting, self.ctx.spec)
+            kwargs["band"] = _find_band(setting)
             vwf = init_falff_wf(**kwargs)
         else:
             raise ValueError(f'Unknown feature type "{feature.type}"')
@@ -193,6 +225,9 @@ class FeatureFactory(Factory):
                     metadata["raw_sources"] = sorted(raw_sources)
                     node.inputs.metadata = metadata
 
+                if not hasattr(node.inputs, "bold"):
+                    continue  # do not create a setting that is not used
+
                 self.setting_factory.connect(
                     hierarchy,
                     node,
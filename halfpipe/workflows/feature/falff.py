@@ -6,8 +6,8 @@ from pathlib import Path
 
 import nipype.interfaces.utility as niu
 import nipype.pipeline.engine as pe
-from nipype.interfaces import afni
 
+from ...interfaces.falff import ALFF
 from ...interfaces.imagemaths.lazy_blur import LazyBlurToFWHM
 from ...interfaces.imagemaths.zscore import ZScore
 from ...interfaces.resultdict.datasink import ResultdictDatasink
@@ -17,11 +17,16 @@ from ..memory import MemoryCalculator
 
 
 def init_falff_wf(
-    workdir: str | Path, feature=None, fwhm=None, memcalc=MemoryCalculator.default()
+    workdir: str | Path,
+    feature=None,
+    fwhm=None,
+    band: tuple[float, float] | None = None,
+    memcalc=MemoryCalculator.default(),
 ):
     """
     Calculate Amplitude of low frequency oscillations(ALFF) and
-    fractional ALFF maps
+    fractional ALFF maps from the power spectrum of the unfiltered
+    time series within the frequency band
 
     Returns
     -------
@@ -46,18 +51,30 @@ def init_falff_wf(
     # input
     inputnode = pe.Node(
         niu.IdentityInterface(
-            fields=["tags", "vals", "metadata", "bold", "mask", "fwhm"]
+            fields=[
+                "tags",
+                "vals",
+                "metadata",
+                "mask",
+                "repetition_time",
+                "fwhm",
+            ]
         ),
         name="inputnode",
     )
     unfiltered_inputnode = pe.Node(
-        niu.IdentityInterface(fields=["bold", "mask"]),
+        niu.IdentityInterface(fields=["bold", "mask", "vals"]),
         name="unfiltered_inputnode",
     )
     outputnode = pe.Node(
         niu.IdentityInterface(fields=["resultdicts"]), name="outputnode"
     )
 
+    # the filtered setting is not needed, because the frequency band is applied
+    # to the spectrum of the unfiltered time series
+    workflow.connect(unfiltered_inputnode, "mask", inputnode, "mask")
+    workflow.connect(unfiltered_inputnode, "vals", inputnode, "vals")
+
     if fwhm is not None:
         inputnode.inputs.fwhm = float(fwhm)
     elif feature is not None and hasattr(feature, "smoothing"):
@@ -83,36 +100,18 @@ def init_falff_wf(
     )
     workflow.connect(make_resultdicts, "resultdicts", resultdict_datasink, "indicts")
 
-    # standard deviation of the filtered image
-    stddev_filtered = pe.Node(
-        afni.TStat(), name="stddev_filtered", mem_gb=memcalc.series_std_gb
-    )
-    stddev_filtered.inputs.outputtype = "NIFTI_GZ"
-    stddev_filtered.inputs.options = "-stdev"
-    workflow.connect(inputnode, "bold", stddev_filtered, "in_file")
-    workflow.connect(inputnode, "mask", stddev_filtered, "mask")
-
-    # standard deviation of the unfiltered image
-    stddev_unfiltered = pe.Node(
-        afni.TStat(), name="stddev_unfiltered", mem_gb=memcalc.series_std_gb
-    )
-    stddev_unfiltered.inputs.outputtype = "NIFTI_GZ"
-    stddev_unfiltered.inputs.options = "-stdev"
-    workflow.connect(unfiltered_inputnode, "bold", stddev_unfiltered, "in_file")
-    workflow.connect(unfiltered_inputnode, "mask", stddev_unfiltered, "mask")
-
-    falff = pe.Node(afni.Calc(), name="falff", mem_gb=memcalc.volume_std_gb)
-    falff.inputs.args = "-float"
-    falff.inputs.expr = "(1.0*bool(a))*((1.0*b)/(1.0*c))"
-    falff.inputs.outputtype = "NIFTI_GZ"
-    workflow.connect(inputnode, "mask", falff, "in_file_a")
-    workflow.connect(stddev_filtered, "out_file", falff, "in_file_b")
-    workflow.connect(stddev_unfiltered, "out_file", falff, "in_file_c")
+    # both maps in one pass over the unfiltered image
+    alff = pe.Node(ALFF(), name="alff", mem_gb=memcalc.series_std_gb)
+    if band is not None:
+        alff.inputs.bands = [band]
+    workflow.connect(unfiltered_inputnode, "bold", alff, "in_file")
+    workflow.connect(inputnode, "repetition_time", alff, "repetition_time")
+    workflow.connect(inputnode, "mask", alff, "mask")
 
     #
     merge = pe.Node(niu.Merge(2), name="merge")
-    workflow.connect(stddev_filtered, "out_file", merge, "in1")
-    workflow.connect(falff, "out_file", merge, "in2")
+    workflow.connect(alff, "alff_files", merge, "in1")
+    workflow.connect(alff, "falff_files", merge, "in2")
 
     smooth = pe.MapNode(
         LazyBlurToFWHM(outputtype="NIFTI_GZ"), iterfield="in_file", name="smooth"
@@ -127,7 +126,9 @@ def init_falff_wf(
     workflow.connect(smooth, "out_file", zscore, "in_file")
     workflow.connect(inputnode, "mask", zscore, "mask")
 
-    split = pe.Node(niu.Split(splits=[1, 1]), name="split")
+    # the merged list has the alff maps of all bands followed by the falff maps
+    band_count = len(alff.inputs.bands)
+    split = pe.Node(niu.Split(splits=[band_count, band_count]), name="split")
     workflow.connect(zscore, "out_file", split, "inlist")
 
     workflow.connect(split, "out1", make_resultdicts, "alff")
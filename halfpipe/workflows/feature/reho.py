@@ -5,11 +5,12 @@
 from pathlib import Path
 
 import nipype.pipeline.engine as pe
+from fmriprep import config
 from nipype.interfaces import utility as niu
 
-from ...interfaces.fixes.reho import ReHo
 from ...interfaces.imagemaths.lazy_blur import LazyBlurToFWHM
 from ...interfaces.imagemaths.zscore import ZScore
+from ...interfaces.reho import ReHo
 from ...interfaces.resultdict.datasink import ResultdictDatasink
 from ...interfaces.resultdict.make import MakeResultdicts
 from ...utils.format import format_workflow
@@ -72,12 +73,13 @@ def init_reho_wf(
 
     #
     reho = pe.Node(
-        interface=ReHo(neighborhood="vertices", out_file="reho.nii"),
+        interface=ReHo(neighborhood="vertices"),
         name="reho",
         mem_gb=memcalc.series_std_gb * 2,
+        n_procs=config.nipype.omp_nthreads,
     )
     workflow.connect(inputnode, "bold", reho, "in_file")
-    workflow.connect(inputnode, "mask", reho, "mask_file")
+    workflow.connect(inputnode, "mask", reho, "mask")
 
     #
     smooth = pe.Node(LazyBlurToFWHM(outputtype="NIFTI_GZ"), name="smooth")
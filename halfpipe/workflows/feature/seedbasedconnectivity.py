@@ -5,17 +5,17 @@
 from pathlib import Path
 
 from fmriprep import config
-from nipype.algorithms import confounds as nac
-from nipype.interfaces import fsl
 from nipype.interfaces import utility as niu
 from nipype.pipeline import engine as pe
 
 from ...interfaces.imagemaths.mask_coverage import MaskCoverage
+from ...interfaces.imagemaths.meants import MeanTimeSeries
 from ...interfaces.imagemaths.resample import Resample
+from ...interfaces.imagemaths.tsnr import TSNR
 from ...interfaces.report.vals import CalcMean
 from ...interfaces.resultdict.datasink import ResultdictDatasink
 from ...interfaces.resultdict.make import MakeResultdicts
-from ...interfaces.stats.dof import MakeDofVolume
+from ...interfaces.stats.glm import GLM
 from ...interfaces.utility.tsv import FillNA, MergeColumns
 from ...utils.format import format_workflow
 from ..constants import constants
@@ -159,7 +159,7 @@ def init_seedbasedconnectivity_wf(
 
     # calculate the mean time series of the region defined by each mask
     meants = pe.MapNode(
-        fsl.ImageMeants(),
+        MeanTimeSeries(),
         name="meants",
         iterfield="mask",
         mem_gb=memcalc.series_std_gb,
@@ -196,44 +196,26 @@ def init_seedbasedconnectivity_wf(
     # calculate the regression of the mean time series
     # onto the functional image.
     # the result is the seed connectivity map
-    glm = pe.MapNode(
-        fsl.GLM(
-            out_file="beta.nii.gz",
-            out_cope="cope.nii.gz",
-            out_varcb_name="varcope.nii.gz",
-            out_z_name="zstat.nii.gz",
-            demean=True,
-        ),
-        name="glm",
-        iterfield=["design", "contrasts"],
-        mem_gb=memcalc.series_std_gb * 5,
-    )
+    glm = pe.Node(GLM(), name="glm", mem_gb=memcalc.series_std_gb * 5)
     workflow.connect(inputnode, "bold", glm, "in_file")
     workflow.connect(inputnode, "mask", glm, "mask")
-    workflow.connect(fillna, "out_no_header", glm, "design")
+    workflow.connect(fillna, "out_no_header", glm, "designs")
     workflow.connect(contrasts, "out_no_header", glm, "contrasts")
 
-    # make dof volume
-    makedofvolume = pe.MapNode(
-        MakeDofVolume(), iterfield=["design"], name="makedofvolume"
-    )
-    workflow.connect(inputnode, "bold", makedofvolume, "bold_file")
-    workflow.connect(fillna, "out_no_header", makedofvolume, "design")
-
-    workflow.connect(glm, "out_cope", make_resultdicts, "effect")
-    workflow.connect(glm, "out_varcb", make_resultdicts, "variance")
-    workflow.connect(glm, "out_z", make_resultdicts, "z")
-    workflow.connect(makedofvolume, "out_file", make_resultdicts, "dof")
+    workflow.connect(glm, "copes", make_resultdicts, "effect")
+    workflow.connect(glm, "varcopes", make_resultdicts, "variance")
+    workflow.connect(glm, "zstats", make_resultdicts, "z")
+    workflow.connect(glm, "dof_files", make_resultdicts, "dof")
 
     #
-    tsnr = pe.Node(nac.TSNR(), name="tsnr", mem_gb=2 * memcalc.series_std_gb)
+    tsnr = pe.Node(TSNR(), name="tsnr", mem_gb=2 * memcalc.series_std_gb)
     workflow.connect(inputnode, "bold", tsnr, "in_file")
 
     calcmean = pe.MapNode(
         CalcMean(), iterfield="mask", name="calcmean", mem_gb=memcalc.series_std_gb
     )
     workflow.connect(maskseeds, "out_files", calcmean, "mask")
-    workflow.connect(tsnr, "tsnr_file", calcmean, "in_file")
+    workflow.connect(tsnr, "out_file", calcmean, "in_file")
 
     workflow.connect(calcmean, "mean", make_resultdicts, "mean_seed_tsnr")
 
@@ -14,6 +14,7 @@ from nipype.pipeline import engine as pe
 
 from ...interfaces.conditions import ApplyConditionOffset, ParseConditionFile
 from ...interfaces.fixes.level1design import Level1Design
+from ...interfaces.imagemaths.image_range import ImageRange
 from ...interfaces.resultdict.datasink import ResultdictDatasink
 from ...interfaces.resultdict.make import MakeResultdicts
 from ...interfaces.stats.dof import MakeDofVolume
@@ -236,7 +237,7 @@ def init_taskbased_wf(
 
     # calculate range of image values to determine cutoff value
     stats = pe.Node(
-        fsl.ImageStats(op_string="-R"),
+        ImageRange(),
         name="stats",
         mem_gb=memcalc.series_std_gb,
     )
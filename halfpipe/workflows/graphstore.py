@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import json
+import os
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+from typing import Dict, Iterator, Mapping, Optional, Union
+from uuid import UUID
+
+import networkx as nx
+
+from ..utils import logger
+from ..utils.format import format_like_bids
+from ..utils.pickle import dump_pickle_cache, load_pickle_cache, pickle_extension
+
+graph_store_directory = "graphs"
+
+
+class GraphStore(Mapping[str, nx.DiGraph]):
+    """
+    Read-only mapping of chunk names to execution graphs, which are stored in
+    one file per chunk plus an index. The graphs are only loaded when they are
+    accessed, so that a cluster job only needs to read its own subject. The
+    files are never modified after the index was written, so readers do not
+    need any locks
+    """
+
+    index_file_name = "index.json"
+
+    def __init__(self, path: Path, uuid: UUID, file_names: Dict[str, str]):
+        self.path = path
+        self.uuid = uuid
+        self.file_names = file_names
+
+        self._graphs: Dict[str, nx.DiGraph] = dict()
+
+    @staticmethod
+    def make_path(workdir: Union[Path, str], uuid: Union[UUID, str]) -> Path:
+        uuidstr = str(uuid)[:8]
+        return Path(workdir) / graph_store_directory / uuidstr
+
+    @classmethod
+    def load(
+        cls, workdir: Union[Path, str], uuid: Union[UUID, str]
+    ) -> Optional["GraphStore"]:
+        path = cls.make_path(workdir, uuid)
+
+        index_path = path / cls.index_file_name
+        if not index_path.is_file():
+            return None
+
+        try:
+            with open(index_path, "r") as file_handle:
+                index = json.load(file_handle)
+
+            store_uuid = UUID(index["uuid"])
+            file_names = dict(index["graphs"])
+
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f'Could not read graph index "{index_path}"', exc_info=e)
+            return None
+
+        # the uuid may be abbreviated on the command line
+        if not str(store_uuid).startswith(str(uuid)):
+            return None
+
+        logger.info(f"Using graphs from cache at {path}")
+
+        return cls(path, store_uuid, file_names)
+
+    @classmethod
+    def save(
+        cls,
+        workdir: Union[Path, str],
+        uuid: UUID,
+        graphs: Mapping[str, nx.DiGraph],
+        file_paths: Optional[Mapping[str, Path]] = None,
+    ) -> "GraphStore":
+        """
+        Write the graphs that are not already in `file_paths` to a temporary
+        directory first and then rename it, so that readers never see a
+        partial store
+        """
+        if file_paths is None:
+            file_paths = dict()
+
+        path = cls.make_path(workdir, uuid)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        if path.is_dir() and not (path / cls.index_file_name).is_file():
+            rmtree(path, ignore_errors=True)  # remove invalid store
+
+        temporary_path = Path(mkdtemp(dir=path.parent, prefix=f".{path.name}."))
+
+        file_names: Dict[str, str] = dict()
+        for name, graph in graphs.items():
+            file_path = file_paths.get(name)
+            if file_path is not None and Path(file_path).is_file():
+                file_names[name] = os.path.relpath(file_path, path)
+                continue
+
+            file_name = f"{format_like_bids(name)}{pickle_extension}"
+            dump_pickle_cache(temporary_path / file_name, graph)
+            file_names[name] = file_name
+
+        index = dict(uuid=str(uuid), graphs=file_names)
+        with open(temporary_path / cls.index_file_name, "w") as file_handle:
+            json.dump(index, file_handle, indent=4)
+
+        try:
+            temporary_path.rename(path)
+        except OSError:  # another process was faster
+            rmtree(temporary_path, ignore_errors=True)
+
+        return cls(path, uuid, file_names)
+
+    def __getitem__(self, key: str) -> nx.DiGraph:
+        if key not in self._graphs:
+            file_path = self.path / self.file_names[key]
+
+            graph = load_pickle_cache(file_path)
+            if not isinstance(graph, nx.DiGraph):
+                raise ValueError(f'Could not load graph "{key}" from "{file_path}"')
+
+            setattr(graph, "uuid", self.uuid)
+            self._graphs[key] = graph
+
+        return self._graphs[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.file_names)
+
+    def __len__(self) -> int:
+        return len(self.file_names)
@@ -3,13 +3,13 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 from fmriprep import config
-from nipype.algorithms import confounds as nac
 from nipype.interfaces import utility as niu
 from nipype.pipeline import engine as pe
 from niworkflows.interfaces.utility import KeySelect
 from niworkflows.utils.spaces import SpatialReferences
 
 from ...interfaces.imagemaths.resample import Resample
+from ...interfaces.imagemaths.tsnr import TSNR
 from ...interfaces.report.imageplot import PlotEpi, PlotRegistration
 from ...interfaces.report.vals import CalcMean, UpdateVals
 from ...interfaces.resultdict.datasink import ResultdictDatasink
@@ -111,11 +111,11 @@ def init_func_report_wf(
     workflow.connect(epi_norm_rpt, "out_report", make_resultdicts, "epi_norm_rpt")
 
     # plot the tsnr image
-    tsnr = pe.Node(nac.TSNR(), name="compute_tsnr", mem_gb=memcalc.series_std_gb * 2.5)
+    tsnr = pe.Node(TSNR(), name="compute_tsnr", mem_gb=memcalc.series_std_gb * 2.5)
     workflow.connect(select_std, "bold_std", tsnr, "in_file")
 
     tsnr_rpt = pe.Node(PlotEpi(), name="tsnr_rpt", mem_gb=memcalc.min_gb)
-    workflow.connect(tsnr, "tsnr_file", tsnr_rpt, "in_file")
+    workflow.connect(tsnr, "out_file", tsnr_rpt, "in_file")
     workflow.connect(select_std, "bold_mask_std", tsnr_rpt, "mask_file")
     workflow.connect(tsnr_rpt, "out_report", make_resultdicts, "tsnr_rpt")
 
@@ -156,7 +156,7 @@ def init_func_report_wf(
         mem_gb=2 * memcalc.volume_std_gb,
     )
     workflow.connect(confvals, "vals", calcmean, "vals")  # base dict to update
-    workflow.connect(tsnr, "tsnr_file", calcmean, "in_file")
+    workflow.connect(tsnr, "out_file", calcmean, "in_file")
     workflow.connect(resample, "output_image", calcmean, "dseg")
 
     workflow.connect(calcmean, "vals", make_resultdicts, "vals")
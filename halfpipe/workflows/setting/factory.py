@@ -2,14 +2,17 @@
 # emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
+import re
 from abc import abstractmethod
 from dataclasses import dataclass
 from math import isclose
 from typing import Callable, Hashable
 
+from nipype.interfaces.base import isdefined
 from nipype.pipeline import engine as pe
 
 from ...collect.metadata import collect_metadata
+from ...interfaces.transformer import Transformer, TransformerChain
 from ...utils import logger
 from ...utils.copy import deepcopyfactory
 from ...utils.hash import b32_digest
@@ -28,6 +31,8 @@ from .smoothing import init_smoothing_wf
 
 alphabet = "abcdefghijklmnopqrstuvwxzy"
 
+step_input_pattern = re.compile(r"^step(?P<index>\d+)_(?P<name>.+)$")
+
 
 @dataclass(frozen=True)
 class SettingTuple:
@@ -41,6 +46,147 @@ class LookupTuple:
     memcalc: MemoryCalculator
 
 
+def _is_transformer_node(node) -> bool:
+    if not isinstance(node, pe.Node):
+        return False
+    interface = node.interface
+    if not isinstance(interface, Transformer) or not interface.chainable:
+        return False
+    return hasattr(interface.inputs, "in_file")
+
+
+def _transformer_steps(node: pe.Node) -> tuple[list[type[Transformer]], dict[str, str]]:
+    """
+    Returns the transformer classes that the node runs, and how the names of the
+    inputs of the node map to the inputs of a chain that starts with the node
+    """
+    interface = node.interface
+
+    if isinstance(interface, TransformerChain):
+        # `step_names` is set by the constructor of the new chain, and
+        # `dtype` and `compresslevel` are copied separately
+        name_map = {
+            name: name
+            for name in interface.inputs.copyable_trait_names()
+            if step_input_pattern.fullmatch(name) is not None
+        }
+        name_map["in_file"] = "in_file"
+        return list(interface.transformers), name_map
+
+    names = [
+        name
+        for name in interface.inputs.copyable_trait_names()
+        if name not in frozenset(["dtype", "compresslevel"])
+    ]
+    name_map = {name: f"step1_{name}" for name in names}
+    name_map["in_file"] = "in_file"
+    return [type(interface)], name_map
+
+
+def _shift_step(name: str, offset: int) -> str:
+    m = step_input_pattern.fullmatch(name)
+    if m is None:
+        return name
+    index = int(m.group("index"))
+    return f"step{index + offset:d}_{m.group('name')}"
+
+
+def _find_transformer_pair(workflow: pe.Workflow) -> tuple[pe.Node, pe.Node] | None:
+    graph = workflow._graph
+    for u, v, data in graph.edges(data=True):
+        if not _is_transformer_node(u) or not _is_transformer_node(v):
+            continue
+        if type(u) is not type(v):
+            continue
+        if list(data["connect"]) != [("out_file", "in_file")]:
+            continue
+        if list(graph.successors(u)) != [v]:
+            continue  # the output of the first node is also used elsewhere
+        if isinstance(u, pe.MapNode) and isinstance(v, pe.MapNode):
+            if "in_file" not in u.iterfield or "in_file" not in v.iterfield:
+                continue
+            if u.nested or v.nested:
+                continue
+        return u, v
+    return None
+
+
+def collapse_transformer_nodes(workflow: pe.Workflow) -> None:
+    """
+    Replace adjacent transformer nodes in a workflow, where the output file of
+    the first is only used as the input file of the second, with a single
+    node that runs them both in memory and only writes the final output
+    """
+    while True:
+        pair = _find_transformer_pair(workflow)
+        if pair is None:
+            break
+
+        u, v = pair
+        graph = workflow._graph
+
+        u_transformers, u_name_map = _transformer_steps(u)
+        v_transformers, v_name_map = _transformer_steps(v)
+
+        offset = len(u_transformers)
+        v_name_map = {
+            name: _shift_step(chain_name, offset)
+            for name, chain_name in v_name_map.items()
+            if name != "in_file"
+        }
+
+        interface = TransformerChain(transformers=u_transformers + v_transformers)
+
+        name = f"{u.name}_{v.name}"
+        mem_gb = max(u.mem_gb, v.mem_gb)
+        n_procs = max(u.n_procs, v.n_procs)
+        if isinstance(u, pe.MapNode) and isinstance(v, pe.MapNode):
+            iterfield = [u_name_map[field] for field in u.iterfield]
+            iterfield.extend(
+                v_name_map[field] for field in v.iterfield if field != "in_file"
+            )
+            node: pe.Node = pe.MapNode(
+                interface,
+                iterfield=iterfield,
+                name=name,
+                mem_gb=mem_gb,
+                n_procs=n_procs,
+                serial=u._serial or v._serial,
+            )
+        else:
+            node = pe.Node(interface, name=name, mem_gb=mem_gb, n_procs=n_procs)
+
+        # the first node determines how the data is read,
+        # and the second node how the output is written
+        for source, name_map, value_names in [
+            (u, u_name_map, ["dtype"]),
+            (v, v_name_map, ["compresslevel"]),
+        ]:
+            for input_name in [*name_map.keys(), *value_names]:
+                if isinstance(source, pe.MapNode) and input_name in source.iterfield:
+                    value = getattr(source.inputs, input_name)
+                else:
+                    value = getattr(source.interface.inputs, input_name)
+                if isdefined(value):
+                    node.set_input(name_map.get(input_name, input_name), value)
+
+        connections = list()
+        for source, name_map in [(u, u_name_map), (v, v_name_map)]:
+            for predecessor in graph.predecessors(source):
+                if predecessor is u:
+                    continue
+                for source_output, input_name in graph[predecessor][source]["connect"]:
+                    connections.append(
+                        (predecessor, node, [(source_output, name_map[input_name])])
+                    )
+        for successor in graph.successors(v):
+            connections.append((node, successor, list(graph[v][successor]["connect"])))
+
+        workflow.remove_nodes([u, v])
+        workflow.add_nodes([node])
+        workflow.connect(connections)
+
+
 class ICAAROMAComponentsFactory(Factory):
     def __init__(
         self, ctx, fmriprep_factory: Factory, alt_bold_factory: AltBOLDFactory
@@ -168,6 +314,7 @@ class LookupFactory(Factory):
                 f"Creating workflow with {self.__class__.__name__} for {lookup_tuple}"
             )
             prototype = self._prototype(lookup_tuple)
+            collapse_transformer_nodes(prototype)
             self.wf_factories[lookup_tuple] = deepcopyfactory(prototype)
 
             prototype_name = prototype.name
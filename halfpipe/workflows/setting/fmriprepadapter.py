@@ -4,9 +4,9 @@
 
 import nipype.interfaces.utility as niu
 import nipype.pipeline.engine as pe
-from nipype.interfaces import fsl
 from niworkflows.interfaces.utility import KeySelect
 
+from ...interfaces.imagemaths.apply_mask import ApplyMask
 from ..constants import constants
 from ..memory import MemoryCalculator
 
@@ -47,12 +47,12 @@ def init_fmriprep_adapter_wf(
 
     #
     applymask = pe.Node(
-        interface=fsl.ApplyMask(),
+        interface=ApplyMask(dtype="float32"),
         name="applymask",
         mem_gb=memcalc.series_std_gb,
     )
     workflow.connect(select_std, "bold_std", applymask, "in_file")
-    workflow.connect(select_std, "bold_mask_std", applymask, "mask_file")
+    workflow.connect(select_std, "bold_mask_std", applymask, "mask")
 
     #
     merge = pe.Node(niu.Merge(2), name="merge")
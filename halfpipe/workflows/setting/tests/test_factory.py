@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+from nipype.interfaces import utility as niu
+from nipype.pipeline import engine as pe
+
+from ....interfaces.fslnumpy.tempfilt import TemporalFilter
+from ....interfaces.imagemaths.addmeans import AddMeans
+from ....interfaces.imagemaths.zscore import ZScore
+from ....interfaces.reho import ReHo
+from ....interfaces.transformer import TransformerChain
+from ..bandpassfilter import init_bandpass_filter_wf
+from ..factory import collapse_transformer_nodes
+
+
+def run_bandpass_filter_wf(tmp_path, files, mask_file, collapse):
+    workflow = init_bandpass_filter_wf(bandpass_filter=("gaussian", 125.0, 12.0))
+    workflow.base_dir = str(tmp_path)
+
+    if collapse:
+        collapse_transformer_nodes(workflow)
+
+    inputnode = workflow.get_node("inputnode")
+    inputnode.inputs.files = files
+    inputnode.inputs.mask = mask_file
+    inputnode.inputs.repetition_time = 2.0
+    inputnode.inputs.vals = dict()
+
+    graph = workflow.run()
+
+    # identity nodes are removed from the execution graph
+    (node,) = [node for node in graph.nodes if node.name.endswith("addmeans")]
+    return workflow, node.result.outputs.out_file
+
+
+@pytest.mark.timeout(600)
+def test_collapse_transformer_nodes(tmp_path):
+    os.chdir(str(tmp_path))
+
+    np.random.seed(0)
+
+    shape = (6, 5, 4)
+    mask = np.random.rand(*shape) > 0.3
+    mask_file = str(tmp_path / "mask.nii.gz")
+    nib.save(nib.Nifti1Image(mask.astype(np.uint8), np.eye(4)), mask_file)
+
+    data = np.random.rand(*shape, 50) * 100 + 1000
+    bold_file = str(tmp_path / "bold.nii.gz")
+    nib.save(nib.Nifti1Image(data, np.eye(4)), bold_file)
+
+    confounds_file = str(tmp_path / "confounds.tsv")
+    np.savetxt(
+        confounds_file,
+        np.random.rand(50, 2),
+        delimiter="\t",
+        header="a\tb",
+        comments="",
+    )
+
+    files = [bold_file, confounds_file]
+
+    results = list()
+    for collapse in [False, True]:
+        path = tmp_path / f"collapse-{collapse}"
+        path.mkdir()
+        workflow, out_files = run_bandpass_filter_wf(path, files, mask_file, collapse)
+
+        names = workflow.list_node_names()
+        assert ("temporalfilter_addmeans" in names) == collapse
+        results.append(out_files)
+
+    (a, b) = results
+    assert [os.path.basename(f) for f in a] == [os.path.basename(f) for f in b]
+    assert np.allclose(nib.load(a[0]).get_fdata(), nib.load(b[0]).get_fdata())
+    assert np.allclose(
+        np.loadtxt(a[1], skiprows=1), np.loadtxt(b[1], skiprows=1), equal_nan=True
+    )
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_collapse_transformer_nodes_three(reverse: bool):
+    workflow = pe.Workflow(name="chain_wf")
+
+    inputnode = pe.Node(
+        niu.IdentityInterface(fields=["in_file", "mean_file"]), name="inputnode"
+    )
+    a = pe.Node(TemporalFilter(highpass_sigma=10.0), name="a")
+    b = pe.Node(TemporalFilter(lowpass_sigma=2.0), name="b")
+    c = pe.Node(AddMeans(compresslevel=1), name="c")
+
+    connections = [
+        (a, b, [("out_file", "in_file")]),
+        (b, c, [("out_file", "in_file")]),
+    ]
+    if reverse:  # fuse b and c first
+        connections.reverse()
+    workflow.connect(connections)
+    workflow.connect(
+        [
+            (inputnode, a, [("in_file", "in_file")]),
+            (inputnode, c, [("mean_file", "mean_file")]),
+        ]
+    )
+
+    collapse_transformer_nodes(workflow)
+
+    (node,) = [node for node in workflow._graph.nodes if node is not inputnode]
+    interface = node.interface
+    assert isinstance(interface, TransformerChain)
+    assert interface.transformers == [TemporalFilter, TemporalFilter, AddMeans]
+    assert interface.inputs.step_names == [
+        "TemporalFilter",
+        "TemporalFilter",
+        "AddMeans",
+    ]
+    assert interface.inputs.step1_highpass_sigma == 10.0
+    assert interface.inputs.step2_lowpass_sigma == 2.0
+    assert interface.inputs.compresslevel == 1
+
+    assert workflow._graph[inputnode][node]["connect"] == [
+        ("in_file", "in_file"),
+        ("mean_file", "step3_mean_file"),
+    ]
+
+
+def test_collapse_transformer_nodes_chainable():
+    workflow = pe.Workflow(name="chain_wf")
+
+    a = pe.Node(ZScore(), name="a")
+    b = pe.Node(ReHo(), name="b")  # needs the loaded image
+    workflow.connect(a, "out_file", b, "in_file")
+
+    collapse_transformer_nodes(workflow)
+
+    assert set(workflow._graph.nodes) == {a, b}
+
+
+def test_transformer_chain_inputs():
+    chain = TransformerChain(transformers=[TemporalFilter, AddMeans])
+
+    assert chain.suffix == "bptf_addmean"
+    assert chain.inputs.step_names == ["TemporalFilter", "AddMeans"]
+    assert hasattr(chain.inputs, "step1_lowpass_sigma")
+    assert hasattr(chain.inputs, "step2_mean_file")
+    assert not hasattr(chain.inputs, "step2_in_file")
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+
+from pathlib import Path
+from uuid import uuid4
+
+import networkx as nx
+
+from ...utils.pickle import dump_pickle_cache
+from ..graphstore import GraphStore
+
+
+def make_graph(name: str) -> nx.DiGraph:
+    graph = nx.DiGraph()
+    graph.add_edge(f"{name}_a", f"{name}_b")
+    return graph
+
+
+def test_graph_store(tmp_path: Path):
+    uuid = uuid4()
+
+    graphs = {name: make_graph(name) for name in ["01", "02", "model"]}
+
+    # graphs that were already written elsewhere are not copied
+    cache_path = tmp_path / "cache" / "01.pickle"
+    cache_path.parent.mkdir()
+    dump_pickle_cache(cache_path, graphs["01"])
+
+    GraphStore.save(tmp_path, uuid, graphs, file_paths={"01": cache_path})
+
+    path = GraphStore.make_path(tmp_path, uuid)
+    assert not (path / "01.pickle").exists()
+    assert (path / "02.pickle").is_file()
+
+    graph_store = GraphStore.load(tmp_path, str(uuid)[:8])
+    assert graph_store is not None
+    assert list(graph_store.keys()) == ["01", "02", "model"]
+    assert len(graph_store._graphs) == 0  # nothing was loaded yet
+
+    graph = graph_store["02"]
+    assert set(graph.edges) == set(graphs["02"].edges)
+    assert getattr(graph, "uuid") == uuid
+    assert list(graph_store._graphs.keys()) == ["02"]
+
+    assert set(graph_store["01"].edges) == set(graphs["01"].edges)
+
+
+def test_graph_store_missing(tmp_path: Path):
+    uuid = uuid4()
+
+    assert GraphStore.load(tmp_path, uuid) is None
+
+    path = GraphStore.make_path(tmp_path, uuid)
+    path.mkdir(parents=True)
+    assert GraphStore.load(tmp_path, uuid) is None  # no index
+
+    GraphStore.save(tmp_path, uuid, {"01": make_graph("01")})
+    assert GraphStore.load(tmp_path, uuid) is not None
+    assert GraphStore.load(tmp_path, uuid4()) is None
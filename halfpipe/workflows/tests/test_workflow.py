@@ -26,9 +26,12 @@ from ...model.file.schema import FileSchema
 from ...model.setting import SettingSchema
 from ...model.spec import Spec, SpecSchema, save_spec
 from ...resource import get as get_resource
+from ...utils.format import format_like_bids
 from ...utils.image import nvol
+from .. import execgraph
 from ..base import init_workflow
-from ..execgraph import init_execgraph
+from ..execgraph import init_execgraph, subject_graph_cache_directory
+from ..graphstore import GraphStore
 
 
 @pytest.fixture(scope="module")
@@ -317,6 +320,77 @@ def test_with_reconall(tmp_path, mock_spec):
     assert any("recon" in u.name for u in graph.nodes)
 
 
+def add_subject(bids_path: Path, source: str, target: str) -> None:
+    """
+    copy the files of one subject to a new subject
+    """
+    for path in (bids_path / source).rglob("*"):
+        if not path.is_file():
+            continue
+
+        relative_path = str(path.relative_to(bids_path)).replace(source, target)
+        target_path = bids_path / relative_path
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+
+        if path.suffix in [".json", ".tsv"]:  # may refer to other files
+            target_path.write_text(path.read_text().replace(source, target))
+        else:
+            shutil.copyfile(path, target_path)
+
+
+@pytest.mark.timeout(1200)
+def test_subject_graph_cache(tmp_path, bids_data, mock_spec, monkeypatch):
+    bids_path = tmp_path / "bids_data"
+    shutil.copytree(bids_data, bids_path)
+    mock_spec.files[0] = FileSchema().load(dict(datatype="bids", path=str(bids_path)))
+
+    workdir = tmp_path / "workdir"
+    workdir.mkdir()
+    save_spec(mock_spec, workdir=workdir)
+
+    workflow = init_workflow(workdir)
+    graphs = init_execgraph(workdir, workflow, n_procs=2)
+
+    subjects = [s for s in graphs.keys() if s != "model"]
+    cache_paths = list((workdir / subject_graph_cache_directory).iterdir())
+    assert len(cache_paths) == len(subjects)
+
+    prepared: list[str] = list()
+    prepare_subject_graph = execgraph.prepare_subject_graph
+
+    def counting_prepare_subject_graph(config, base_dir, uuid, item):
+        cache_path, _ = item
+        if cache_path is None:
+            prepared.append("model")
+        else:
+            prepared.append(cache_path.name.split(".")[0])
+        return prepare_subject_graph(config, base_dir, uuid, item)
+
+    monkeypatch.setattr(
+        execgraph, "prepare_subject_graph", counting_prepare_subject_graph
+    )
+    model = ["model"] if "model" in graphs else []
+
+    # remove the graphs of the workflow but keep the subject graphs
+    shutil.rmtree(GraphStore.make_path(workdir, workflow.uuid))
+
+    cached_graphs = init_execgraph(workdir, workflow)
+    assert prepared == model
+    assert cached_graphs.keys() == graphs.keys()
+    for s in subjects:
+        assert {u.fullname for u in cached_graphs[s]} == {u.fullname for u in graphs[s]}
+
+    # only the graph of the new subject is prepared
+    (subject,) = subjects
+    add_subject(bids_path, f"sub-{subject}", "sub-9999")
+    prepared.clear()
+
+    workflow = init_workflow(workdir)
+    graphs = init_execgraph(workdir, workflow)
+    assert len(graphs.keys() - set(model)) == 2
+    assert prepared == [format_like_bids("9999"), *model]
+
+
 @pytest.mark.slow
 @pytest.mark.timeout(3 * 3600)
 def test_feature_extraction(tmp_path, mock_spec):